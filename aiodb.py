@@ -0,0 +1,204 @@
+# Async MySQL access for the ASGI app (asgi.py).
+#
+# mysql.connector.aio has no pool of its own, so AsyncConnectionPool is the
+# counterpart of db.ConnectionPool: the same size, timeout, recycle and ping
+# rules, but a request waiting for a connection, or for MySQL, yields the
+# event loop instead of holding a thread. One worker can then serve many
+# concurrent users with MYSQL_ASYNC_POOL_SIZE connections.
+#
+# Connections are bound to the event loop that opened them, so there is one
+# pool per loop (in practice one per worker process). Reads all go to the
+# primary; replica routing is only done by the sync app for now.
+import asyncio
+import time
+import mysql.connector.aio
+from mysql.connector import Error, InterfaceError
+from config import Config
+from db import PoolTimeout
+import metrics
+
+
+# Wraps a raw connection so that close() hands it back to the pool
+class AsyncPooledConnection:
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    async def cursor(self, *args, **kwargs):
+        return metrics.AsyncInstrumentedCursor(await self._raw.cursor(*args, **kwargs))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        if self._raw is not None:
+            raw, self._raw = self._raw, None
+            await self._pool.release(raw)
+
+    async def discard(self):
+        if self._raw is not None:
+            raw, self._raw = self._raw, None
+            await self._pool.release(raw, broken=True)
+
+
+class AsyncConnectionPool:
+    def __init__(self, connect, size=20, timeout=5.0, recycle=3600, ping_after=30):
+        self._connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+        self._idle = []
+        self._created_at = {}
+        self._last_used = {}
+        self._open = 0
+        self._cond = asyncio.Condition()
+        self.metrics = {
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'connects': 0,
+            'recycled': 0,
+            'ping_failures': 0,
+        }
+
+    async def _new_connection(self):
+        try:
+            raw = await self._connect()
+        except OSError as e:
+            # mysql.connector.aio lets socket errors through as they are;
+            # raise what the sync connector would
+            raise InterfaceError(msg=f"Can't connect to MySQL server: {e}") from e
+        now = time.monotonic()
+        self._created_at[id(raw)] = now
+        self._last_used[id(raw)] = now
+        self.metrics['connects'] += 1
+        return raw
+
+    async def _forget(self, raw):
+        self._created_at.pop(id(raw), None)
+        self._last_used.pop(id(raw), None)
+        try:
+            await raw.close()
+        except (Error, OSError):
+            pass
+
+    async def _is_usable(self, raw):
+        now = time.monotonic()
+        if self.recycle and now - self._created_at.get(id(raw), now) > self.recycle:
+            self.metrics['recycled'] += 1
+            return False
+        if now - self._last_used.get(id(raw), now) > self.ping_after:
+            try:
+                await raw.ping(reconnect=False)
+            except (Error, OSError):
+                self.metrics['ping_failures'] += 1
+                return False
+        return True
+
+    async def acquire(self):
+        self.metrics['checkouts'] += 1
+        async with self._cond:
+            if not self._idle and self._open >= self.size:
+                self.metrics['waits'] += 1
+                try:
+                    await asyncio.wait_for(
+                        self._cond.wait_for(lambda: self._idle or self._open < self.size),
+                        self.timeout
+                    )
+                except asyncio.TimeoutError:
+                    self.metrics['timeouts'] += 1
+                    raise PoolTimeout(msg='Timed out waiting for a database connection')
+            raw = self._idle.pop() if self._idle else None
+            self._open += 1
+
+        try:
+            while raw is not None and not await self._is_usable(raw):
+                await self._forget(raw)
+                raw = self._idle.pop() if self._idle else None
+            if raw is None:
+                raw = await self._new_connection()
+        except BaseException:
+            async with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+        return AsyncPooledConnection(self, raw)
+
+    async def release(self, raw, broken=False):
+        if not broken:
+            try:
+                # Never hand an open transaction to the next request
+                if raw.in_transaction:
+                    await raw.rollback()
+            except (Error, OSError):
+                broken = True
+        if broken:
+            await self._forget(raw)
+        else:
+            self._last_used[id(raw)] = time.monotonic()
+        async with self._cond:
+            self._open -= 1
+            if not broken:
+                self._idle.append(raw)
+            self._cond.notify()
+
+    async def close_all(self):
+        idle, self._idle = self._idle, []
+        for raw in idle:
+            await self._forget(raw)
+
+    def stats(self):
+        stats = dict(self.metrics)
+        stats['size'] = self.size
+        stats['idle'] = len(self._idle)
+        stats['in_use'] = self._open
+        return stats
+
+
+async def _connect():
+    return await mysql.connector.aio.connect(
+        host=Config.MYSQL_HOST,
+        port=Config.MYSQL_PORT,
+        user=Config.MYSQL_USER,
+        password=Config.MYSQL_PASSWORD,
+        database=Config.MYSQL_DB
+    )
+
+
+_pool = None
+_pool_loop = None
+
+
+# The pool of the running event loop, created on first use
+def get_async_pool():
+    global _pool, _pool_loop
+    loop = asyncio.get_running_loop()
+    if _pool is None or _pool_loop is not loop:
+        _pool = AsyncConnectionPool(
+            _connect,
+            size=Config.MYSQL_ASYNC_POOL_SIZE,
+            timeout=Config.MYSQL_POOL_TIMEOUT,
+            recycle=Config.MYSQL_POOL_RECYCLE,
+            ping_after=Config.MYSQL_POOL_PING_AFTER
+        )
+        _pool_loop = loop
+    return _pool
+
+
+async def get_db_connection():
+    start = time.perf_counter()
+    try:
+        return await get_async_pool().acquire()
+    except Error as e:
+        print(f"Error connecting to MySQL: {e}")
+        return None
+    finally:
+        metrics.record_acquire(time.perf_counter() - start)
+
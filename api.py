@@ -0,0 +1,308 @@
+# JSON API for mobile and partner clients, mounted at /api/v1.
+#
+# Clients exchange a username and password for a signed bearer token at
+# POST /api/v1/tokens and send it as "Authorization: Bearer <token>". The
+# token carries the user id and name, so authenticating a call only checks
+# its signature and age; the users table is read once, at login.
+#
+# GET /balance and GET /history send an ETag derived from the cached account
+# summary (balance plus id of the newest transaction). A client that sends it
+# back in If-None-Match gets a 304 without any SQL being run.
+#
+# POST /deposit, /withdraw and /transfer take an optional Idempotency-Key
+# header; repeating a key returns the first response again, marked with
+# Idempotent-Replayed: true, without moving any money.
+import functools
+import hashlib
+import json
+from flask import Blueprint, Response, g, request
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+from mysql.connector import Error
+from config import Config
+from db import get_db_connection, get_read_connection
+from cache import get_account_summary
+from directory import get_directory
+import groupcommit
+import hashing
+import idempotency
+import ledger
+import money
+import transactions
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+_serializer = URLSafeTimedSerializer(Config.SECRET_KEY, salt='api-token')
+
+
+def _json(payload, status=200, headers=None):
+    body = json.dumps(payload, separators=(',', ':'), default=str)
+    return Response(body, status=status, headers=headers, mimetype='application/json')
+
+
+def _error(message, status):
+    return _json({'error': message}, status)
+
+
+def issue_token(user_id, username):
+    return _serializer.dumps({'uid': user_id, 'name': username})
+
+
+def token_required(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not token:
+            return _error('Missing bearer token', 401)
+        try:
+            claims = _serializer.loads(token, max_age=Config.API_TOKEN_TTL)
+        except SignatureExpired:
+            return _error('Token expired', 401)
+        except BadSignature:
+            return _error('Invalid token', 401)
+        g.api_user_id = claims['uid']
+        g.api_username = claims['name']
+        return view(*args, **kwargs)
+    return wrapper
+
+
+# Answer with 304 when the client already has this version
+def _conditional(etag, build):
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={'ETag': f'"{etag}"'})
+    response = build()
+    if response.status_code == 200:
+        response.set_etag(etag)
+    return response
+
+
+def _summary_or_error():
+    summary = get_account_summary(g.api_user_id)
+    if summary is None:
+        return None, _error('Account unavailable', 503)
+    return summary, None
+
+
+def _latest_id(summary):
+    return summary['recent'][0].get('id', 0) if summary['recent'] else 0
+
+
+def _amount():
+    payload = request.get_json(silent=True) or {}
+    return money.parse(payload.get('amount')), payload
+
+
+# Response for a completed deposit, withdrawal or transfer, the same for the
+# first request and for repeats of its Idempotency-Key
+def _done(result, replayed=False):
+    body = {'status': 'ok', 'amount': money.format_paise(result['amount'])}
+    if 'receiver' in result:
+        body['receiver'] = result['receiver']
+    return _json(body, headers={'Idempotent-Replayed': 'true'} if replayed else None)
+
+
+def _in_progress():
+    return _error('A request with this Idempotency-Key is still running', 409)
+
+
+@api.route('/tokens', methods=['POST'])
+def create_token():
+    payload = request.get_json(silent=True) or {}
+    username = payload.get('username')
+    password = payload.get('password')
+    if not username or not password:
+        return _error('username and password are required', 400)
+
+    connection = get_db_connection()
+    if not connection:
+        return _error('Database connection failed', 503)
+    try:
+        cursor = connection.cursor(dictionary=True, buffered=True)
+        cursor.execute("SELECT id, username, password FROM users WHERE username = %s", (username,))
+        user = cursor.fetchone()
+        cursor.close()
+    except Error as e:
+        print(f"API login error: {e}")
+        return _error('Login failed', 500)
+    finally:
+        connection.close()
+
+    try:
+        if not user or not hashing.verify_password(user['password'], password):
+            return _error('Invalid username or password', 401)
+    except hashing.HashingBusy:
+        return _error('Server busy, retry shortly', 503)
+    return _json({
+        'token': issue_token(user['id'], user['username']),
+        'token_type': 'Bearer',
+        'expires_in': Config.API_TOKEN_TTL,
+    }, 201)
+
+
+@api.route('/balance')
+@token_required
+def balance():
+    summary, error = _summary_or_error()
+    if error:
+        return error
+    version = f"{summary['balance']}:{_latest_id(summary)}"
+    etag = hashlib.sha1(f'balance:{g.api_user_id}:{version}'.encode()).hexdigest()
+    return _conditional(etag, lambda: _json({
+        'username': g.api_username,
+        'balance': money.format_paise(summary['balance']),
+        'month_in': money.format_paise(summary['month_in']),
+        'month_out': money.format_paise(summary['month_out']),
+    }))
+
+
+@api.route('/history')
+@token_required
+def history():
+    summary, error = _summary_or_error()
+    if error:
+        return error
+    filters = transactions.parse_filters(request.args)
+    cursor = request.args.get('cursor')
+    limit = min(request.args.get('limit', Config.HISTORY_PAGE_SIZE, type=int), Config.HISTORY_PAGE_SIZE)
+    limit = max(limit, 1)
+    # Rows never change once written, so a page only changes when a new
+    # transaction arrives for this user
+    key = json.dumps([g.api_user_id, _latest_id(summary), filters, cursor, limit])
+    etag = hashlib.sha1(f'history:{key}'.encode()).hexdigest()
+
+    def build():
+        connection = get_read_connection(g.api_user_id)
+        if not connection:
+            return _error('Database connection failed', 503)
+        try:
+            rows, next_cursor = transactions.fetch_page(connection, g.api_user_id, filters, cursor, limit)
+        except Error as e:
+            print(f"API history error: {e}")
+            return _error('Could not load history', 500)
+        finally:
+            connection.close()
+        return _json({
+            'transactions': [
+                {'id': row['id'], 'date': row['date'], 'type': row['type'],
+                 'direction': row['direction'], 'amount': money.format_paise(row['amount']),
+                 'description': row['description']}
+                for row in rows
+            ],
+            'next_cursor': next_cursor,
+        })
+
+    return _conditional(etag, build)
+
+
+@api.route('/deposit', methods=['POST'])
+@token_required
+def deposit():
+    amount, _ = _amount()
+    if amount is None:
+        return _error('amount must be a positive number with at most 2 decimals', 400)
+
+    key = idempotency.get_key(request)
+    if Config.DEPOSIT_GROUP_COMMIT:
+        stored = idempotency.lookup(g.api_user_id, key)
+        if stored:
+            return _done(stored, replayed=True)
+        try:
+            result = groupcommit.deposit(g.api_user_id, amount, key)
+        except idempotency.Replayed as e:
+            return _done(e.result, replayed=True)
+        except idempotency.RequestInProgress:
+            return _in_progress()
+        except groupcommit.DepositPending as e:
+            # Accepted but not yet confirmed; a retry with the same key replays it
+            return _json({'status': 'pending', 'error': str(e)}, 202)
+        except groupcommit.GroupCommitUnavailable as e:
+            return _error(str(e), 503)
+        except (Error, ledger.LedgerError):
+            return _error('Deposit failed', 500)
+        return _done(result)
+
+    connection = get_db_connection()
+    if not connection:
+        return _error('Database connection failed', 503)
+    try:
+        stored = idempotency.lookup(g.api_user_id, key, connection)
+        if stored:
+            return _done(stored, replayed=True)
+        result = ledger.deposit(connection, g.api_user_id, amount, key)
+    except idempotency.Replayed as e:
+        return _done(e.result, replayed=True)
+    except idempotency.RequestInProgress:
+        return _in_progress()
+    except (Error, ledger.LedgerError) as e:
+        print(f"API deposit error: {e}")
+        return _error('Deposit failed', 500)
+    finally:
+        connection.close()
+    return _done(result)
+
+
+@api.route('/withdraw', methods=['POST'])
+@token_required
+def withdraw():
+    amount, _ = _amount()
+    if amount is None:
+        return _error('amount must be a positive number with at most 2 decimals', 400)
+
+    connection = get_db_connection()
+    if not connection:
+        return _error('Database connection failed', 503)
+    key = idempotency.get_key(request)
+    try:
+        stored = idempotency.lookup(g.api_user_id, key, connection)
+        if stored:
+            return _done(stored, replayed=True)
+        result = ledger.withdraw(connection, g.api_user_id, amount, key)
+    except idempotency.Replayed as e:
+        return _done(e.result, replayed=True)
+    except idempotency.RequestInProgress:
+        return _in_progress()
+    except ledger.InsufficientFunds:
+        return _error('Insufficient balance', 409)
+    except (Error, ledger.LedgerError) as e:
+        print(f"API withdraw error: {e}")
+        return _error('Withdrawal failed', 500)
+    finally:
+        connection.close()
+    return _done(result)
+
+
+@api.route('/transfer', methods=['POST'])
+@token_required
+def transfer():
+    amount, payload = _amount()
+    receiver_username = payload.get('receiver_username')
+    if amount is None:
+        return _error('amount must be a positive number with at most 2 decimals', 400)
+    if not receiver_username:
+        return _error('receiver_username is required', 400)
+    if receiver_username == g.api_username:
+        return _error('Cannot transfer to yourself', 400)
+
+    connection = get_db_connection()
+    if not connection:
+        return _error('Database connection failed', 503)
+    key = idempotency.get_key(request)
+    try:
+        stored = idempotency.lookup(g.api_user_id, key, connection)
+        if stored:
+            return _done(stored, replayed=True)
+        receiver = get_directory().resolve(receiver_username, connection)
+        if not receiver:
+            return _error('Receiver not found', 404)
+        result = ledger.transfer(connection, g.api_user_id, g.api_username, receiver[0], receiver[1], amount, key)
+    except idempotency.Replayed as e:
+        return _done(e.result, replayed=True)
+    except idempotency.RequestInProgress:
+        return _in_progress()
+    except ledger.InsufficientFunds:
+        return _error('Insufficient balance', 409)
+    except (Error, ledger.LedgerError) as e:
+        print(f"API transfer error: {e}")
+        return _error('Transfer failed', 500)
+    finally:
+        connection.close()
+    return _done(result)
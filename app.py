@@ -1,74 +1,77 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, Response, stream_with_context
 from config import Config
-import mysql.connector
 from mysql.connector import Error
-from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from db import get_db_connection, get_read_connection, get_pool, get_router
+import ledger
+import transactions
+import batch
+import idempotency
+import hashing
+import groupcommit
+import snapshots
+from directory import get_directory
+import metrics
+import sessions
+import assets
+import pagecache
+import ratelimit
+import money
+from api import api
+from cache import get_account_summary, get_account_cache
+from datetime import date, datetime, timedelta
 import re
 
 app = Flask(__name__)
 app.config.from_object(Config)
 app.secret_key = Config.SECRET_KEY
 
-# Helper function to get database connection
-def get_db_connection():
-    try:
-        connection = mysql.connector.connect(
-            host=Config.MYSQL_HOST,
-            user=Config.MYSQL_USER,
-            password=Config.MYSQL_PASSWORD,
-            database=Config.MYSQL_DB
-        )
-        return connection
-    except Error as e:
-        print(f"Error connecting to MySQL: {e}")
-        return None
+metrics.init_app(app)
+sessions.init_app(app)
+assets.init_app(app)
+money.init_app(app)
+idempotency.init_app(app)
+pagecache.init_app(app)
+ratelimit.init_app(app)
+app.register_blueprint(api)
+metrics.register_collector('db_pool', lambda: get_pool().stats())
+metrics.register_collector('account_cache', lambda: get_account_cache().stats())
+metrics.register_collector('password_hashing', hashing.stats)
+metrics.register_collector('user_directory', lambda: get_directory().stats())
+metrics.register_collector('page_cache', pagecache.stats)
+metrics.register_collector('rate_limit', ratelimit.stats)
+metrics.register_collector('idempotency', idempotency.stats)
+if Config.MYSQL_REPLICAS:
+    metrics.register_collector('replicas', lambda: get_router().stats())
+if Config.SESSION_BACKEND != 'cookie':
+    metrics.register_collector('sessions', sessions.stats)
+if Config.DEPOSIT_GROUP_COMMIT:
+    metrics.register_collector('group_commit', lambda: groupcommit.get_writer().stats())
 
-# Initialize database
-def init_db():
-    connection = get_db_connection()
-    if connection:
-        try:
-            cursor = connection.cursor()
-            
-            # Create users table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    username VARCHAR(100) UNIQUE NOT NULL,
-                    aadhar VARCHAR(12) UNIQUE NOT NULL,
-                    password VARCHAR(255) NOT NULL,
-                    balance DECIMAL(10, 2) DEFAULT 0.00,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Create transactions table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS transactions (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    user_id INT NOT NULL,
-                    type ENUM('deposit', 'withdraw', 'transfer') NOT NULL,
-                    amount DECIMAL(10, 2) NOT NULL,
-                    description TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(id)
-                )
-            """)
-            
-            connection.commit()
-            print("Database initialized successfully")
-        except Error as e:
-            print(f"Error initializing database: {e}")
-        finally:
-            cursor.close()
-            connection.close()
+INVALID_AMOUNT = 'Invalid amount! Enter a positive amount with at most 2 decimals.'
+IN_PROGRESS = 'This request is already being processed.'
+DEPOSIT_PENDING = 'Your deposit is still being confirmed. Check your balance before depositing again.'
+
+# Account summary for the logged-in user, taken from the session while it
+# holds a fresh copy
+def account_summary(user_id):
+    return sessions.account_summary(session, user_id, get_account_summary)
 
-# Initialize the database when the app starts
-init_db()
+# Flash the outcome of a deposit, withdrawal or transfer and go to the
+# dashboard. A repeated idempotency key gets the same message as the first
+# request.
+def money_done(result):
+    amount = money.format_paise(result['amount'])
+    if result['type'] == 'deposit':
+        flash(f'Successfully deposited ₹{amount}!', 'success')
+    elif result['type'] == 'withdraw':
+        flash(f'Successfully withdrew ₹{amount}!', 'success')
+    else:
+        flash(f"Successfully transferred ₹{amount} to {result['receiver']}!", 'success')
+    return redirect(url_for('dashboard'))
 
 # Home page
 @app.route('/')
+@pagecache.cached_page
 def index():
     return render_template('index.html')
 
@@ -90,7 +93,11 @@ def register():
             return render_template('register.html')
         
         # Hash password
-        hashed_password = generate_password_hash(password)
+        try:
+            hashed_password = hashing.hash_password(password)
+        except hashing.HashingBusy:
+            flash('The server is busy, please try again in a moment.', 'danger')
+            return render_template('register.html'), 503
         
         connection = get_db_connection()
         if connection:
@@ -101,6 +108,7 @@ def register():
                     (username, aadhar, hashed_password)
                 )
                 connection.commit()
+                get_directory().add(cursor.lastrowid, username)
                 flash('Registration successful! Please login.', 'success')
                 return redirect(url_for('login'))
             except Error as e:
@@ -127,45 +135,65 @@ def login():
         connection = get_db_connection()
         if connection:
             try:
-                cursor = connection.cursor(dictionary=True)
-                cursor.execute("SELECT * FROM users WHERE username = %s", (username,))
+                cursor = connection.cursor(dictionary=True, buffered=True)
+                cursor.execute("SELECT id, username, password FROM users WHERE username = %s", (username,))
                 user = cursor.fetchone()
-                
-                if user and check_password_hash(user['password'], password):
+            except Error as e:
+                flash('Login failed! Please try again.', 'danger')
+                return render_template('login.html')
+            finally:
+                cursor.close()
+                connection.close()
+            
+            # The connection goes back to the pool before the slow hash check
+            try:
+                if user and hashing.verify_password(user['password'], password):
+                    if hashing.needs_rehash(user['password']):
+                        rehash_password(user['id'], password)
                     session['user_id'] = user['id']
                     session['username'] = user['username']
                     flash('Login successful!', 'success')
                     return redirect(url_for('dashboard'))
                 else:
                     flash('Invalid username or password!', 'danger')
-            except Error as e:
-                flash('Login failed! Please try again.', 'danger')
-            finally:
-                cursor.close()
-                connection.close()
+            except hashing.HashingBusy:
+                flash('The server is busy, please try again in a moment.', 'danger')
+                return render_template('login.html'), 503
     
     return render_template('login.html')
 
-# Dashboard page
-@app.route('/dashboard')
-def dashboard():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
+# Upgrade a password hash made with old cost parameters; the login goes
+# ahead even if this fails
+def rehash_password(user_id, password):
+    try:
+        new_hash = hashing.hash_password(password)
+    except hashing.HashingBusy:
+        return
     connection = get_db_connection()
     if connection:
         try:
-            cursor = connection.cursor(dictionary=True)
-            cursor.execute("SELECT balance FROM users WHERE id = %s", (session['user_id'],))
-            user = cursor.fetchone()
-            
-            return render_template('dashboard.html', username=session['username'], balance=user['balance'])
+            cursor = connection.cursor()
+            cursor.execute("UPDATE users SET password = %s WHERE id = %s", (new_hash, user_id))
+            connection.commit()
+            cursor.close()
+            hashing.metrics['rehashed'] += 1
         except Error as e:
-            flash('Error loading dashboard!', 'danger')
+            print(f"Error upgrading password hash: {e}")
         finally:
-            cursor.close()
             connection.close()
+
+# Dashboard page
+@app.route('/dashboard')
+def dashboard():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    
+    summary = account_summary(session['user_id'])
+    if summary:
+        return render_template('dashboard.html', username=session['username'],
+                               balance=summary['balance'], summary=summary)
     
+    flash('Error loading dashboard!', 'danger')
     return redirect(url_for('login'))
 
 # Deposit page
@@ -175,56 +203,46 @@ def deposit():
         return redirect(url_for('login'))
     
     # Get current balance for display
-    connection = get_db_connection()
-    balance = 0.00
-    if connection:
-        try:
-            cursor = connection.cursor(dictionary=True)
-            cursor.execute("SELECT balance FROM users WHERE id = %s", (session['user_id'],))
-            user = cursor.fetchone()
-            if user:
-                balance = user['balance']
-        except Error as e:
-            print(f"Error fetching balance: {e}")
-        finally:
-            cursor.close()
-            connection.close()
+    summary = account_summary(session['user_id'])
+    balance = summary['balance'] if summary else 0
     
     if request.method == 'POST':
-        try:
-            amount = float(request.form['amount'])
-            
-            if amount <= 0:
-                flash('Amount must be positive!', 'danger')
-                return render_template('deposit.html', balance=balance)
-            
-            connection = get_db_connection()
-            if connection:
-                try:
-                    cursor = connection.cursor()
-                    # Update balance
-                    cursor.execute(
-                        "UPDATE users SET balance = balance + %s WHERE id = %s",
-                        (amount, session['user_id'])
-                    )
-                    # Record transaction
-                    cursor.execute(
-                        "INSERT INTO transactions (user_id, type, amount, description) VALUES (%s, 'deposit', %s, %s)",
-                        (session['user_id'], amount, f'Deposited ₹{amount:.2f}')
-                    )
-                    connection.commit()
-                    flash(f'Successfully deposited ₹{amount:.2f}!', 'success')
-                    return redirect(url_for('dashboard'))
-                except Error as e:
-                    flash(f'Deposit failed! Error: {e}', 'danger')
-                    print(f"Database error: {e}")
-                finally:
-                    cursor.close()
-                    connection.close()
-            else:
-                flash('Database connection failed!', 'danger')
-        except ValueError:
-            flash('Invalid amount! Please enter a valid number.', 'danger')
+        amount = money.parse(request.form.get('amount'))
+        if amount is None:
+            flash(INVALID_AMOUNT, 'danger')
+            return render_template('deposit.html', balance=balance)
+        
+        key = idempotency.get_key(request)
+        if Config.DEPOSIT_GROUP_COMMIT:
+            try:
+                result = idempotency.lookup(session['user_id'], key)
+                return money_done(result or groupcommit.deposit(session['user_id'], amount, key))
+            except idempotency.Replayed as e:
+                return money_done(e.result)
+            except idempotency.RequestInProgress:
+                flash(IN_PROGRESS, 'info')
+            except groupcommit.DepositPending:
+                flash(DEPOSIT_PENDING, 'info')
+            except (Error, ledger.LedgerError, groupcommit.GroupCommitUnavailable) as e:
+                flash(f'Deposit failed! Error: {e}', 'danger')
+            return render_template('deposit.html', balance=balance)
+        
+        connection = get_db_connection()
+        if connection:
+            try:
+                result = idempotency.lookup(session['user_id'], key, connection)
+                return money_done(result or ledger.deposit(connection, session['user_id'], amount, key))
+            except idempotency.Replayed as e:
+                return money_done(e.result)
+            except idempotency.RequestInProgress:
+                flash(IN_PROGRESS, 'info')
+            except (Error, ledger.LedgerError) as e:
+                flash(f'Deposit failed! Error: {e}', 'danger')
+                print(f"Database error: {e}")
+            finally:
+                connection.close()
+        else:
+            flash('Database connection failed!', 'danger')
     
     return render_template('deposit.html', balance=balance)
 
@@ -235,57 +253,31 @@ def withdraw():
         return redirect(url_for('login'))
     
     # Get current balance for display
-    connection = get_db_connection()
-    balance = 0.00
-    if connection:
-        try:
-            cursor = connection.cursor(dictionary=True)
-            cursor.execute("SELECT balance FROM users WHERE id = %s", (session['user_id'],))
-            user = cursor.fetchone()
-            if user:
-                balance = user['balance']
-        except Error as e:
-            print(f"Error fetching balance: {e}")
-        finally:
-            cursor.close()
-            connection.close()
+    summary = account_summary(session['user_id'])
+    balance = summary['balance'] if summary else 0
     
     if request.method == 'POST':
-        amount = float(request.form['amount'])
+        amount = money.parse(request.form.get('amount'))
         
-        if amount <= 0:
-            flash('Amount must be positive!', 'danger')
+        if amount is None:
+            flash(INVALID_AMOUNT, 'danger')
             return render_template('withdraw.html', balance=balance)
         
+        key = idempotency.get_key(request)
         connection = get_db_connection()
         if connection:
             try:
-                cursor = connection.cursor(dictionary=True)
-                # Check current balance
-                cursor.execute("SELECT balance FROM users WHERE id = %s", (session['user_id'],))
-                user = cursor.fetchone()
-                
-                if user['balance'] < amount:
-                    flash('Insufficient balance!', 'danger')
-                    return render_template('withdraw.html', balance=balance)
-                
-                # Update balance
-                cursor.execute(
-                    "UPDATE users SET balance = balance - %s WHERE id = %s",
-                    (amount, session['user_id'])
-                )
-                # Record transaction
-                cursor.execute(
-                    "INSERT INTO transactions (user_id, type, amount, description) VALUES (%s, 'withdraw', %s, %s)",
-                    (session['user_id'], amount, f'Withdrew ₹{amount:.2f}')
-                )
-                connection.commit()
-                flash(f'Successfully withdrew ₹{amount:.2f}!', 'success')
-                return redirect(url_for('dashboard'))
+                result = idempotency.lookup(session['user_id'], key, connection)
+                return money_done(result or ledger.withdraw(connection, session['user_id'], amount, key))
+            except idempotency.Replayed as e:
+                return money_done(e.result)
+            except idempotency.RequestInProgress:
+                flash(IN_PROGRESS, 'info')
+            except ledger.InsufficientFunds:
+                flash('Insufficient balance!', 'danger')
             except Error as e:
                 flash('Withdrawal failed! Please try again.', 'danger')
             finally:
-                cursor.close()
                 connection.close()
     
     return render_template('withdraw.html', balance=balance)
@@ -297,118 +289,210 @@ def transfer():
         return redirect(url_for('login'))
     
     # Get current balance for display
-    connection = get_db_connection()
-    balance = 0.00
-    if connection:
-        try:
-            cursor = connection.cursor(dictionary=True)
-            cursor.execute("SELECT balance FROM users WHERE id = %s", (session['user_id'],))
-            user = cursor.fetchone()
-            if user:
-                balance = user['balance']
-        except Error as e:
-            print(f"Error fetching balance: {e}")
-        finally:
-            cursor.close()
-            connection.close()
+    summary = account_summary(session['user_id'])
+    balance = summary['balance'] if summary else 0
     
     if request.method == 'POST':
         receiver_username = request.form['receiver_username']
-        amount = float(request.form['amount'])
+        amount = money.parse(request.form.get('amount'))
         
-        if amount <= 0:
-            flash('Amount must be positive!', 'danger')
+        if amount is None:
+            flash(INVALID_AMOUNT, 'danger')
             return render_template('transfer.html', balance=balance)
         
         if receiver_username == session['username']:
             flash('Cannot transfer to yourself!', 'danger')
             return render_template('transfer.html', balance=balance)
         
+        key = idempotency.get_key(request)
         connection = get_db_connection()
         if connection:
             try:
-                cursor = connection.cursor(dictionary=True)
+                result = idempotency.lookup(session['user_id'], key, connection)
+                if result:
+                    return money_done(result)
+                
                 # Check if receiver exists
-                cursor.execute("SELECT id, username FROM users WHERE username = %s", (receiver_username,))
-                receiver = cursor.fetchone()
+                receiver = get_directory().resolve(receiver_username, connection)
                 
                 if not receiver:
                     flash('Receiver not found!', 'danger')
                     return render_template('transfer.html', balance=balance)
                 
-                # Check current balance
-                cursor.execute("SELECT balance FROM users WHERE id = %s", (session['user_id'],))
-                sender = cursor.fetchone()
-                
-                if sender['balance'] < amount:
-                    flash('Insufficient balance!', 'danger')
-                    return render_template('transfer.html', balance=balance)
-                
-                # Update sender balance
-                cursor.execute(
-                    "UPDATE users SET balance = balance - %s WHERE id = %s",
-                    (amount, session['user_id'])
-                )
-                # Update receiver balance
-                cursor.execute(
-                    "UPDATE users SET balance = balance + %s WHERE id = %s",
-                    (amount, receiver['id'])
-                )
-                # Record transaction for sender
-                cursor.execute(
-                    "INSERT INTO transactions (user_id, type, amount, description) VALUES (%s, 'transfer', %s, %s)",
-                    (session['user_id'], amount, f'Transferred ₹{amount:.2f} to {receiver_username}')
-                )
-                # Record transaction for receiver
-                cursor.execute(
-                    "INSERT INTO transactions (user_id, type, amount, description) VALUES (%s, 'transfer', %s, %s)",
-                    (receiver['id'], amount, f'Received ₹{amount:.2f} from {session["username"]}')
-                )
-                connection.commit()
-                flash(f'Successfully transferred ₹{amount:.2f} to {receiver_username}!', 'success')
-                return redirect(url_for('dashboard'))
-            except Error as e:
+                return money_done(ledger.transfer(
+                    connection, session['user_id'], session['username'],
+                    receiver[0], receiver[1], amount, key
+                ))
+            except idempotency.Replayed as e:
+                return money_done(e.result)
+            except idempotency.RequestInProgress:
+                flash(IN_PROGRESS, 'info')
+            except ledger.InsufficientFunds:
+                flash('Insufficient balance!', 'danger')
+            except (Error, ledger.LedgerError) as e:
                 flash('Transfer failed! Please try again.', 'danger')
             finally:
-                cursor.close()
                 connection.close()
     
     return render_template('transfer.html', balance=balance)
 
+# Receiver autocomplete for the transfer form
+@app.route('/users/autocomplete')
+def autocomplete_users():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Login required'}), 401
+    
+    prefix = request.args.get('q', '').strip()
+    if not prefix:
+        return jsonify([])
+    try:
+        names = get_directory().complete(prefix, Config.AUTOCOMPLETE_LIMIT + 1)
+    except Error as e:
+        print(f"Autocomplete error: {e}")
+        return jsonify([]), 503
+    names = [name for name in names if name != session['username']]
+    return jsonify(names[:Config.AUTOCOMPLETE_LIMIT])
+
+# Batch transfer API: pay many receivers from one JSON body or CSV upload
+@app.route('/transfer/batch', methods=['POST'])
+def transfer_batch():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Login required'}), 401
+    
+    try:
+        rows = batch.read_rows(request, Config.BATCH_MAX_ROWS)
+    except batch.BatchError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    key = idempotency.get_key(request)
+    connection = get_db_connection()
+    if not connection:
+        return jsonify({'error': 'Database connection failed'}), 503
+    
+    try:
+        if key:
+            stored = idempotency.reserve(connection, session['user_id'], key)
+            if stored is not None:
+                return jsonify(stored), 200, {'Idempotent-Replayed': 'true'}
+        
+        try:
+            report = batch.run(connection, session['user_id'], session['username'], rows)
+        except batch.BatchInterrupted as e:
+            # Some transfers were made: keep the key with the partial report,
+            # so that a retry gets the report instead of paying them again
+            if key:
+                idempotency.complete(connection, session['user_id'], key, e.report)
+            return jsonify(e.report), 500
+        except Exception:
+            if key:
+                idempotency.release(connection, session['user_id'], key)
+            raise
+        
+        if key:
+            idempotency.complete(connection, session['user_id'], key, report)
+        return jsonify(report)
+    except idempotency.RequestInProgress:
+        return jsonify({'error': 'A batch with this idempotency key is still running'}), 409
+    except Error as e:
+        print(f"Batch transfer error: {e}")
+        return jsonify({'error': 'Batch transfer failed'}), 500
+    finally:
+        connection.close()
+
 # Transaction history page
 @app.route('/history')
 def history():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    connection = get_db_connection()
+    connection = get_read_connection(session['user_id'])
     if connection:
         try:
-            cursor = connection.cursor(dictionary=True)
-            cursor.execute(
-                "SELECT type, amount, description, created_at FROM transactions WHERE user_id = %s ORDER BY created_at DESC",
-                (session['user_id'],)
+            filters = transactions.parse_filters(request.args)
+            page, next_cursor = transactions.fetch_page(
+                connection, session['user_id'], filters, request.args.get('cursor')
             )
-            transactions = cursor.fetchall()
-            
-            # Format date for display
-            for txn in transactions:
-                txn['date'] = txn['created_at'].strftime('%Y-%m-%d %H:%M:%S')
-            
-            return render_template('history.html', transactions=transactions)
+            today = date.today()
+            month = snapshots.monthly_statement(connection, session['user_id'], today.year, today.month)
+            return render_template('history.html', transactions=page, next_cursor=next_cursor,
+                                   filters=filters, paged='cursor' in request.args, month=month)
         except Error as e:
             flash('Error loading transaction history!', 'danger')
         finally:
-            cursor.close()
             connection.close()
     
     return redirect(url_for('dashboard'))
 
+# Monthly statement, built from the daily balance snapshots
+@app.route('/statement')
+def statement():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    
+    try:
+        month = datetime.strptime(request.args.get('month', ''), '%Y-%m').date()
+    except ValueError:
+        month = date.today().replace(day=1)
+    
+    connection = get_read_connection(session['user_id'])
+    if connection:
+        try:
+            report = snapshots.monthly_statement(connection, session['user_id'], month.year, month.month)
+            previous_month = (month - timedelta(days=1)).replace(day=1)
+            next_month = (month + timedelta(days=32)).replace(day=1)
+            return render_template('statement.html', statement=report,
+                                   previous_month=previous_month, next_month=next_month)
+        except Error as e:
+            flash('Error loading statement!', 'danger')
+        finally:
+            connection.close()
+    
+    return redirect(url_for('dashboard'))
+
+# Transaction history export (CSV or JSON), streamed row by row
+@app.route('/history/export')
+def export_history():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'json'):
+        return jsonify({'error': 'Unsupported export format'}), 400
+    
+    connection = get_read_connection(session['user_id'])
+    if not connection:
+        flash('Database connection failed!', 'danger')
+        return redirect(url_for('history'))
+    
+    filters = transactions.parse_filters(request.args)
+    rows = transactions.iter_rows(connection, session['user_id'], filters)
+    
+    def generate():
+        try:
+            if export_format == 'csv':
+                yield from transactions.csv_lines(rows)
+            else:
+                yield from transactions.json_chunks(rows)
+        finally:
+            rows.close()
+            connection.close()
+    
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/json'
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=transactions.{export_format}'
+    return response
+
 # About page
 @app.route('/about')
+@pagecache.cached_page
 def about():
     return render_template('about.html')
 
+# Prometheus metrics for this worker process
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 # Logout
 @app.route('/logout')
 def logout():
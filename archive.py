@@ -0,0 +1,104 @@
+# Moves old transactions to transactions_archive.
+#
+#   python archive.py run       # move everything older than ARCHIVE_AFTER_DAYS
+#   python archive.py status    # row counts and date ranges of both tables
+#
+# Rows are moved oldest first, in batches of ARCHIVE_BATCH_SIZE, each batch
+# copied and deleted in one short transaction, so the job can run while the
+# app is serving traffic and be stopped at any time. Because of that order,
+# every archived row is older than every row left in transactions, which is
+# what lets history reads skip the archive until they run past the recent
+# rows (see transactions.fetch_page).
+#
+# Rows that the daily balance snapshots have not rolled up yet are left in
+# place until snapshots.py has seen them.
+import argparse
+import time
+from datetime import datetime, timedelta
+from config import Config
+from db import get_db_connection
+import ledger
+from transactions import ARCHIVE_TABLE
+
+FIELDS = 'id, user_id, type, direction, counterparty_id, amount, description, created_at'
+
+
+# Move one batch; returns the number of rows moved
+def move_batch(connection, cutoff, batch_size=None):
+    batch_size = batch_size or Config.ARCHIVE_BATCH_SIZE
+
+    def operation(cursor):
+        cursor.execute("SELECT last_transaction_id FROM snapshot_state WHERE id = 1")
+        state = cursor.fetchall()
+        if not state:
+            return 0
+        cursor.execute(
+            "SELECT id FROM transactions WHERE created_at < %s AND id <= %s "
+            "ORDER BY created_at, id LIMIT %s FOR UPDATE",
+            (cutoff, state[0][0], batch_size)
+        )
+        ids = [row[0] for row in cursor.fetchall()]
+        if not ids:
+            return 0
+        placeholders = ', '.join(['%s'] * len(ids))
+        cursor.execute(
+            f"INSERT INTO {ARCHIVE_TABLE} ({FIELDS}) "
+            f"SELECT {FIELDS} FROM transactions WHERE id IN ({placeholders})",
+            ids
+        )
+        cursor.execute(f"DELETE FROM transactions WHERE id IN ({placeholders})", ids)
+        return len(ids)
+
+    return ledger.run_transaction(connection, operation)
+
+
+def run(connection, older_than_days=None, batch_size=None, pause=0.0, verbose=False):
+    days = Config.ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    cutoff = datetime.now() - timedelta(days=days)
+    total = 0
+    start = time.perf_counter()
+    while True:
+        moved = move_batch(connection, cutoff, batch_size)
+        if not moved:
+            return total
+        total += moved
+        if verbose:
+            rate = total / (time.perf_counter() - start)
+            print(f"Archived {total} rows ({rate:.0f} rows/s)")
+        if pause:
+            time.sleep(pause)
+
+
+def status(connection):
+    cursor = connection.cursor(buffered=True)
+    try:
+        for table in ('transactions', ARCHIVE_TABLE):
+            cursor.execute(f"SELECT COUNT(*), MIN(created_at), MAX(created_at) FROM {table}")
+            count, oldest, newest = cursor.fetchone()
+            print(f"{table:<22}{count:>12} rows  {oldest} .. {newest}")
+    finally:
+        cursor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['run', 'status'])
+    parser.add_argument('--older-than-days', type=int, default=Config.ARCHIVE_AFTER_DAYS)
+    parser.add_argument('--batch', type=int, default=Config.ARCHIVE_BATCH_SIZE)
+    parser.add_argument('--pause', type=float, default=0.05, help='seconds to sleep between batches')
+    args = parser.parse_args()
+
+    connection = get_db_connection()
+    if not connection:
+        return
+    try:
+        if args.command == 'run':
+            total = run(connection, args.older_than_days, args.batch, args.pause, verbose=True)
+            print(f"Done, {total} rows archived")
+        status(connection)
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,502 @@
+# ASGI serving mode.
+#
+#   pip install quart==0.22.0        # optional; installs hypercorn with it
+#   hypercorn -w 4 -b 0.0.0.0:8000 asgi:app
+#
+# The pages people use most (login, register, dashboard, history, statement,
+# deposit, withdraw and transfer, plus home, about and logout) are async
+# Quart views here. They render the same templates, share the session
+# cookie, account cache, idempotency keys and ledger statements with
+# app.py, and reach MySQL through the async pool in aiodb.py. A request
+# waiting for MySQL, a password hash or a group commit yields the event loop
+# instead of a worker, so each worker serves many concurrent users on
+# MYSQL_ASYNC_POOL_SIZE connections.
+#
+# Every other route (the JSON API, batch transfers, exports, autocomplete,
+# /metrics and static files) is handed to the Flask app from app.py, which
+# hypercorn runs in a thread pool, so the whole site is served by one
+# server. Requests to the async views go through the same rate limits,
+# MAX_INFLIGHT cap and per-request metrics as the Flask app's.
+#
+# Calls to the kvstore server (shared cache, server-side sessions) stay
+# blocking: they are short round trips on a local socket.
+import asyncio
+from datetime import date, datetime, timedelta
+from hypercorn.middleware import AsyncioWSGIMiddleware
+from mysql.connector import Error
+from quart import Quart, flash, g, jsonify, make_response, redirect, render_template, request, session, url_for
+from quart.sessions import SessionInterface
+from quart.signals import before_render_template, template_rendered
+from werkzeug.exceptions import HTTPException
+from config import Config
+from app import app as flask_app, DEPOSIT_PENDING, INVALID_AMOUNT, IN_PROGRESS
+from cache import get_account_summary_async
+from directory import get_directory
+import aiodb
+import groupcommit
+import hashing
+import idempotency
+import ledger
+import metrics
+import money
+import pagecache
+import ratelimit
+import sessions
+import snapshots
+import transactions
+
+# Static files are left to the Flask app, which serves the fingerprinted,
+# pre-compressed copies built by assets.py
+web = Quart(__name__, static_folder=None)
+web.config.from_object(Config)
+web.secret_key = Config.SECRET_KEY
+
+money.init_app(web)
+idempotency.init_app(web)
+pagecache.init_app(web)
+
+
+# sessions.ServerSideSessionInterface behind Quart's async interface
+class ServerSideSessions(SessionInterface):
+    def __init__(self):
+        self._sessions = sessions.ServerSideSessionInterface()
+
+    async def open_session(self, app, request):
+        return self._sessions.open_session(app, request)
+
+    async def save_session(self, app, session, response):
+        self._sessions.save_session(app, session, response)
+
+
+if Config.SESSION_BACKEND in ('local', 'shared'):
+    web.session_interface = ServerSideSessions()
+
+
+async def account_summary(user_id):
+    return await sessions.account_summary_async(session, user_id, get_account_summary_async)
+
+
+async def money_done(result):
+    amount = money.format_paise(result['amount'])
+    if result['type'] == 'deposit':
+        await flash(f'Successfully deposited ₹{amount}!', 'success')
+    elif result['type'] == 'withdraw':
+        await flash(f'Successfully withdrew ₹{amount}!', 'success')
+    else:
+        await flash(f"Successfully transferred ₹{amount} to {result['receiver']}!", 'success')
+    return redirect(url_for('dashboard'))
+
+
+# The rate limits and request metrics that ratelimit.init_app() and
+# metrics.init_app() install on the Flask app
+@web.before_request
+async def start_request():
+    metrics.start_async_request()
+    if request.method != 'POST':
+        return None
+    limiter = ratelimit.get_limiter()
+    if request.endpoint not in limiter.limits:
+        return None
+    rejected = limiter.admit(request.endpoint, request.remote_addr, session.get('user_id'))
+    if rejected:
+        return await reject(*rejected)
+    g._admitted = True
+    return None
+
+
+async def reject(message, status, wait):
+    if ratelimit.wants_page(request):
+        await flash(message, 'danger')
+        context = {}
+        if request.endpoint in ratelimit.BALANCE_PAGES:
+            context['balance'] = ratelimit.known_balance(session)
+        response = await make_response(await render_template(ratelimit.PAGES[request.endpoint], **context), status)
+    else:
+        response = jsonify({'error': message})
+        response.status_code = status
+    response.headers['Retry-After'] = ratelimit.retry_after(wait)
+    return response
+
+
+@web.after_request
+async def finish_request(response):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.finish_async_request(route, request.method, response.status_code)
+    return response
+
+
+@web.teardown_request
+async def release(exc=None):
+    if g.pop('_admitted', False):
+        ratelimit.get_limiter().leave()
+    # Only left unrecorded when the view raised
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.finish_async_request(route, request.method, 500)
+
+
+before_render_template.connect(metrics._before_render, web)
+template_rendered.connect(metrics._after_render, web)
+
+
+# Home page
+@web.route('/')
+@pagecache.cached_page_async
+async def index():
+    return await render_template('index.html')
+
+# Register page
+@web.route('/register', methods=['GET', 'POST'])
+async def register():
+    if request.method == 'POST':
+        form = await request.form
+        username = form['username']
+        aadhar = form['aadhar']
+        password = form['password']
+
+        if not username or not aadhar or not password:
+            await flash('All fields are required!', 'danger')
+            return await render_template('register.html')
+
+        if len(aadhar) != 12 or not aadhar.isdigit():
+            await flash('Aadhar must be 12 digits!', 'danger')
+            return await render_template('register.html')
+
+        try:
+            hashed_password = await asyncio.to_thread(hashing.hash_password, password)
+        except hashing.HashingBusy:
+            await flash('The server is busy, please try again in a moment.', 'danger')
+            return await render_template('register.html'), 503
+
+        connection = await aiodb.get_db_connection()
+        if connection:
+            cursor = await connection.cursor()
+            try:
+                await cursor.execute(
+                    "INSERT INTO users (username, aadhar, password) VALUES (%s, %s, %s)",
+                    (username, aadhar, hashed_password)
+                )
+                await connection.commit()
+                get_directory().add(cursor.lastrowid, username)
+                await flash('Registration successful! Please login.', 'success')
+                return redirect(url_for('login'))
+            except Error as e:
+                if 'Duplicate entry' in str(e):
+                    if 'username' in str(e):
+                        await flash('Username already exists!', 'danger')
+                    else:
+                        await flash('Aadhar already registered!', 'danger')
+                else:
+                    await flash('Registration failed! Please try again.', 'danger')
+            finally:
+                await cursor.close()
+                await connection.close()
+
+    return await render_template('register.html')
+
+# Login page
+@web.route('/login', methods=['GET', 'POST'])
+async def login():
+    if request.method == 'POST':
+        form = await request.form
+        username = form['username']
+        password = form['password']
+
+        connection = await aiodb.get_db_connection()
+        if connection:
+            try:
+                cursor = await connection.cursor(dictionary=True)
+                try:
+                    await cursor.execute("SELECT id, username, password FROM users WHERE username = %s", (username,))
+                    rows = await cursor.fetchall()
+                finally:
+                    await cursor.close()
+            except Error:
+                await flash('Login failed! Please try again.', 'danger')
+                return await render_template('login.html')
+            finally:
+                await connection.close()
+            user = rows[0] if rows else None
+
+            try:
+                if user and await asyncio.to_thread(hashing.verify_password, user['password'], password):
+                    if hashing.needs_rehash(user['password']):
+                        await rehash_password(user['id'], password)
+                    session['user_id'] = user['id']
+                    session['username'] = user['username']
+                    await flash('Login successful!', 'success')
+                    return redirect(url_for('dashboard'))
+                else:
+                    await flash('Invalid username or password!', 'danger')
+            except hashing.HashingBusy:
+                await flash('The server is busy, please try again in a moment.', 'danger')
+                return await render_template('login.html'), 503
+
+    return await render_template('login.html')
+
+async def rehash_password(user_id, password):
+    try:
+        new_hash = await asyncio.to_thread(hashing.hash_password, password)
+    except hashing.HashingBusy:
+        return
+    connection = await aiodb.get_db_connection()
+    if connection:
+        try:
+            cursor = await connection.cursor()
+            await cursor.execute("UPDATE users SET password = %s WHERE id = %s", (new_hash, user_id))
+            await connection.commit()
+            await cursor.close()
+            hashing.metrics['rehashed'] += 1
+        except Error as e:
+            print(f"Error upgrading password hash: {e}")
+        finally:
+            await connection.close()
+
+# Dashboard page
+@web.route('/dashboard')
+async def dashboard():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+
+    summary = await account_summary(session['user_id'])
+    if summary:
+        return await render_template('dashboard.html', username=session['username'],
+                                     balance=summary['balance'], summary=summary)
+
+    await flash('Error loading dashboard!', 'danger')
+    return redirect(url_for('login'))
+
+# Deposit page
+@web.route('/deposit', methods=['GET', 'POST'])
+async def deposit():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+
+    summary = await account_summary(session['user_id'])
+    balance = summary['balance'] if summary else 0
+
+    if request.method == 'POST':
+        form = await request.form
+        amount = money.parse(form.get('amount'))
+        if amount is None:
+            await flash(INVALID_AMOUNT, 'danger')
+            return await render_template('deposit.html', balance=balance)
+
+        key = idempotency.get_key(request, form)
+        if Config.DEPOSIT_GROUP_COMMIT:
+            try:
+                result = idempotency.lookup(session['user_id'], key)
+                return await money_done(result or await groupcommit.deposit_async(session['user_id'], amount, key))
+            except idempotency.Replayed as e:
+                return await money_done(e.result)
+            except idempotency.RequestInProgress:
+                await flash(IN_PROGRESS, 'info')
+            except groupcommit.DepositPending:
+                await flash(DEPOSIT_PENDING, 'info')
+            except (Error, ledger.LedgerError, groupcommit.GroupCommitUnavailable) as e:
+                await flash(f'Deposit failed! Error: {e}', 'danger')
+            return await render_template('deposit.html', balance=balance)
+
+        connection = await aiodb.get_db_connection()
+        if connection:
+            try:
+                result = await idempotency.lookup_async(session['user_id'], key, connection)
+                return await money_done(
+                    result or await ledger.deposit_async(connection, session['user_id'], amount, key)
+                )
+            except idempotency.Replayed as e:
+                return await money_done(e.result)
+            except idempotency.RequestInProgress:
+                await flash(IN_PROGRESS, 'info')
+            except (Error, ledger.LedgerError) as e:
+                await flash(f'Deposit failed! Error: {e}', 'danger')
+                print(f"Database error: {e}")
+            finally:
+                await connection.close()
+        else:
+            await flash('Database connection failed!', 'danger')
+
+    return await render_template('deposit.html', balance=balance)
+
+# Withdraw page
+@web.route('/withdraw', methods=['GET', 'POST'])
+async def withdraw():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+
+    summary = await account_summary(session['user_id'])
+    balance = summary['balance'] if summary else 0
+
+    if request.method == 'POST':
+        form = await request.form
+        amount = money.parse(form.get('amount'))
+        if amount is None:
+            await flash(INVALID_AMOUNT, 'danger')
+            return await render_template('withdraw.html', balance=balance)
+
+        key = idempotency.get_key(request, form)
+        connection = await aiodb.get_db_connection()
+        if connection:
+            try:
+                result = await idempotency.lookup_async(session['user_id'], key, connection)
+                return await money_done(
+                    result or await ledger.withdraw_async(connection, session['user_id'], amount, key)
+                )
+            except idempotency.Replayed as e:
+                return await money_done(e.result)
+            except idempotency.RequestInProgress:
+                await flash(IN_PROGRESS, 'info')
+            except ledger.InsufficientFunds:
+                await flash('Insufficient balance!', 'danger')
+            except Error:
+                await flash('Withdrawal failed! Please try again.', 'danger')
+            finally:
+                await connection.close()
+
+    return await render_template('withdraw.html', balance=balance)
+
+# Transfer page
+@web.route('/transfer', methods=['GET', 'POST'])
+async def transfer():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+
+    summary = await account_summary(session['user_id'])
+    balance = summary['balance'] if summary else 0
+
+    if request.method == 'POST':
+        form = await request.form
+        receiver_username = form['receiver_username']
+        amount = money.parse(form.get('amount'))
+
+        if amount is None:
+            await flash(INVALID_AMOUNT, 'danger')
+            return await render_template('transfer.html', balance=balance)
+
+        if receiver_username == session['username']:
+            await flash('Cannot transfer to yourself!', 'danger')
+            return await render_template('transfer.html', balance=balance)
+
+        key = idempotency.get_key(request, form)
+        connection = await aiodb.get_db_connection()
+        if connection:
+            try:
+                result = await idempotency.lookup_async(session['user_id'], key, connection)
+                if result:
+                    return await money_done(result)
+
+                receiver = await get_directory().resolve_async(receiver_username, connection)
+                if not receiver:
+                    await flash('Receiver not found!', 'danger')
+                    return await render_template('transfer.html', balance=balance)
+
+                return await money_done(await ledger.transfer_async(
+                    connection, session['user_id'], session['username'],
+                    receiver[0], receiver[1], amount, key
+                ))
+            except idempotency.Replayed as e:
+                return await money_done(e.result)
+            except idempotency.RequestInProgress:
+                await flash(IN_PROGRESS, 'info')
+            except ledger.InsufficientFunds:
+                await flash('Insufficient balance!', 'danger')
+            except (Error, ledger.LedgerError):
+                await flash('Transfer failed! Please try again.', 'danger')
+            finally:
+                await connection.close()
+
+    return await render_template('transfer.html', balance=balance)
+
+# Transaction history page
+@web.route('/history')
+async def history():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+
+    connection = await aiodb.get_db_connection()
+    if connection:
+        try:
+            filters = transactions.parse_filters(request.args)
+            page, next_cursor = await transactions.fetch_page_async(
+                connection, session['user_id'], filters, request.args.get('cursor')
+            )
+            today = date.today()
+            month = await snapshots.monthly_statement_async(connection, session['user_id'], today.year, today.month)
+            return await render_template('history.html', transactions=page, next_cursor=next_cursor,
+                                         filters=filters, paged='cursor' in request.args, month=month)
+        except Error:
+            await flash('Error loading transaction history!', 'danger')
+        finally:
+            await connection.close()
+
+    return redirect(url_for('dashboard'))
+
+# Monthly statement, built from the daily balance snapshots
+@web.route('/statement')
+async def statement():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+
+    try:
+        month = datetime.strptime(request.args.get('month', ''), '%Y-%m').date()
+    except ValueError:
+        month = date.today().replace(day=1)
+
+    connection = await aiodb.get_db_connection()
+    if connection:
+        try:
+            report = await snapshots.monthly_statement_async(connection, session['user_id'], month.year, month.month)
+            previous_month = (month - timedelta(days=1)).replace(day=1)
+            next_month = (month + timedelta(days=32)).replace(day=1)
+            return await render_template('statement.html', statement=report,
+                                         previous_month=previous_month, next_month=next_month)
+        except Error:
+            await flash('Error loading statement!', 'danger')
+        finally:
+            await connection.close()
+
+    return redirect(url_for('dashboard'))
+
+# About page
+@web.route('/about')
+@pagecache.cached_page_async
+async def about():
+    return await render_template('about.html')
+
+# Logout
+@web.route('/logout')
+async def logout():
+    session.clear()
+    await flash('You have been logged out!', 'info')
+    return redirect(url_for('index'))
+
+
+# Make url_for() in templates build links to the routes only the Flask app
+# has, with the same fingerprinted static URLs
+for rule in flask_app.url_map.iter_rules():
+    if rule.endpoint not in web.view_functions:
+        web.url_map.add(web.url_rule_class(rule.rule, endpoint=rule.endpoint, methods=rule.methods))
+web.url_default_functions.setdefault(None, []).extend(flask_app.url_default_functions.get(None, []))
+
+
+# Sends each HTTP request to the Quart view for its path, or to the Flask
+# app when there is none
+class Dispatcher:
+    def __init__(self, asgi_app, wsgi_app):
+        self.asgi_app = asgi_app
+        self.wsgi_app = AsyncioWSGIMiddleware(wsgi_app, max_body_size=Config.ASGI_MAX_BODY_SIZE)
+        self._urls = asgi_app.url_map.bind('')
+
+    def is_async(self, scope):
+        try:
+            endpoint, _ = self._urls.match(scope['path'], method=scope['method'])
+        except HTTPException:
+            return False
+        return endpoint in self.asgi_app.view_functions
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and not self.is_async(scope):
+            return await self.wsgi_app(scope, receive, send)
+        return await self.asgi_app(scope, receive, send)
+
+
+app = Dispatcher(web, flask_app)
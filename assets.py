@@ -0,0 +1,228 @@
+# Static asset pipeline.
+#
+#   python assets.py build     # write static/dist/ and its manifest
+#   python assets.py report    # bytes per page load, before and after
+#
+# build copies every file in static/ to static/dist/ under a name that
+# contains a hash of its content (style.3f9a1c2e.css), rewrites url(...)
+# references in stylesheets to the hashed names, and stores .gz and, with
+# the optional brotli package, .br copies of text assets next to them.
+# Images are resized to the largest size the pages show them at and
+# re-encoded when Pillow is installed; without it they are copied as-is.
+#
+# At runtime init_app() makes url_for('static', filename=...) return the
+# hashed URL whenever the manifest has the file. Those URLs never change
+# content, so they are served with a one-year "immutable" Cache-Control and
+# browsers stop revalidating them; the pre-compressed copy matching the
+# request's Accept-Encoding is sent when there is one.
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import re
+import shutil
+from flask import request, send_from_directory
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+ONE_YEAR = 365 * 24 * 3600
+
+TEXT_TYPES = ('.css', '.js', '.svg', '.json', '.txt')
+# Largest (width, height) each image is displayed at, doubled for high-DPI
+# screens: the logo is 50px high in the header, bank.jpg is the page
+# background
+IMAGE_SIZES = {
+    'logo.png': (None, 100),
+    'bank.jpg': (2560, None),
+}
+JPEG_QUALITY = 82
+
+_CSS_URL = re.compile(r"url\((['\"]?)([^'\")]+)\1\)")
+_STATIC_REF = re.compile(r"url_for\('static',\s*filename='([^']+)'\)")
+
+
+def _hashed_name(name, content):
+    digest = hashlib.sha256(content).hexdigest()[:8]
+    stem, ext = os.path.splitext(name)
+    return f'{stem}.{digest}{ext}'
+
+
+def _optimize_image(name, content):
+    if Image is None or name not in IMAGE_SIZES:
+        return content
+    image = Image.open(io.BytesIO(content))
+    width, height = IMAGE_SIZES[name]
+    bound_width = width or image.width
+    bound_height = height or image.height
+    if image.width > bound_width or image.height > bound_height:
+        image.thumbnail((bound_width, bound_height), Image.LANCZOS)
+    output = io.BytesIO()
+    if name.endswith(('.jpg', '.jpeg')):
+        image.convert('RGB').save(output, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    else:
+        image.save(output, image.format or 'PNG', optimize=True)
+    optimized = output.getvalue()
+    return optimized if len(optimized) < len(content) else content
+
+
+def _rewrite_css(content, names):
+    def replace(match):
+        target = names.get(match.group(2))
+        return f'url({match.group(1)}{target}{match.group(1)})' if target else match.group(0)
+    return _CSS_URL.sub(replace, content.decode('utf-8')).encode('utf-8')
+
+
+def build(static_dir=STATIC_DIR, verbose=True):
+    dist = os.path.join(static_dir, DIST)
+    if os.path.isdir(dist):
+        shutil.rmtree(dist)
+    os.makedirs(dist)
+
+    sources = sorted(
+        name for name in os.listdir(static_dir)
+        if os.path.isfile(os.path.join(static_dir, name))
+    )
+    # Stylesheets last, so that the images they reference already have
+    # their final names
+    sources.sort(key=lambda name: name.endswith('.css'))
+
+    names = {}
+    files = {}
+    for name in sources:
+        with open(os.path.join(static_dir, name), 'rb') as f:
+            original = f.read()
+        content = _optimize_image(name, original)
+        if name.endswith('.css'):
+            content = _rewrite_css(content, names)
+        hashed = _hashed_name(name, content)
+        names[name] = hashed
+        with open(os.path.join(dist, hashed), 'wb') as f:
+            f.write(content)
+
+        entry = {'path': hashed, 'original_bytes': len(original), 'bytes': len(content), 'encodings': {}}
+        if name.endswith(TEXT_TYPES):
+            compressed = {'gzip': gzip.compress(content, 9, mtime=0)}
+            if brotli is not None:
+                compressed['br'] = brotli.compress(content, quality=11)
+            for encoding, data in compressed.items():
+                suffix = '.br' if encoding == 'br' else '.gz'
+                with open(os.path.join(dist, hashed + suffix), 'wb') as f:
+                    f.write(data)
+                entry['encodings'][encoding] = len(data)
+        files[name] = entry
+        if verbose:
+            sizes = ', '.join(f'{encoding} {size}' for encoding, size in entry['encodings'].items())
+            print(f"{name:<12} -> {hashed:<24} {len(original):>9} -> {len(content):>9} bytes"
+                  + (f" ({sizes})" if sizes else ''))
+
+    with open(os.path.join(dist, MANIFEST), 'w') as f:
+        json.dump({'files': files}, f, indent=2)
+    if verbose:
+        if brotli is None:
+            print("brotli is not installed; only gzip copies were written")
+        if Image is None:
+            print("Pillow is not installed; images were copied without resizing")
+    return files
+
+
+def load_manifest(static_dir=STATIC_DIR):
+    try:
+        with open(os.path.join(static_dir, DIST, MANIFEST)) as f:
+            return json.load(f)['files']
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+# Static files a page load fetches: the ones base.html links to and the
+# ones those stylesheets reference
+def page_assets(static_dir=STATIC_DIR, template='base.html'):
+    with open(os.path.join(TEMPLATE_DIR, template)) as f:
+        assets = _STATIC_REF.findall(f.read())
+    for name in list(assets):
+        if name.endswith('.css'):
+            with open(os.path.join(static_dir, name), 'rb') as f:
+                assets.extend(ref for _, ref in _CSS_URL.findall(f.read().decode('utf-8'))
+                              if os.path.isfile(os.path.join(static_dir, ref)))
+    return assets
+
+
+def report(static_dir=STATIC_DIR):
+    manifest = load_manifest(static_dir)
+    if not manifest:
+        print("No manifest; run `python assets.py build` first")
+        return None
+    before = after = 0
+    print(f"{'asset':<12}{'before':>12}{'after':>12}")
+    for name in page_assets(static_dir):
+        entry = manifest[name]
+        sent = min([entry['bytes']] + list(entry['encodings'].values()))
+        before += entry['original_bytes']
+        after += sent
+        print(f"{name:<12}{entry['original_bytes']:>12}{sent:>12}")
+    saved = before - after
+    print(f"{'first visit':<12}{before:>12}{after:>12}  ({saved} bytes, {saved / before:.0%} saved)")
+    count = len(page_assets(static_dir))
+    print(f"repeat visits: {count} revalidation requests per page before, none after (immutable)")
+    return {'before': before, 'after': after, 'saved': saved}
+
+
+def init_app(app):
+    manifest = load_manifest(app.static_folder)
+    if not manifest:
+        return
+
+    @app.url_defaults
+    def fingerprint(endpoint, values):
+        if endpoint == 'static':
+            entry = manifest.get(values.get('filename'))
+            if entry:
+                values['filename'] = f"{DIST}/{entry['path']}"
+
+    encodings_by_path = {f"{DIST}/{entry['path']}": entry['encodings'] for entry in manifest.values()}
+
+    def static(filename):
+        encodings = encodings_by_path.get(filename)
+        if encodings is None:
+            return app.send_static_file(filename)
+        accepted = request.accept_encodings
+        encoding = next((name for name in ('br', 'gzip') if name in encodings and accepted[name]), None)
+        suffix = {'br': '.br', 'gzip': '.gz'}.get(encoding, '')
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = send_from_directory(app.static_folder, filename + suffix, mimetype=mimetype, max_age=ONE_YEAR)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        if encodings:
+            response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+    app.view_functions['static'] = static
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['build', 'report'])
+    args = parser.parse_args()
+    if args.command == 'build':
+        build()
+    report()
+
+
+if __name__ == '__main__':
+    main()
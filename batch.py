@@ -0,0 +1,97 @@
+import csv
+import io
+import time
+import ledger
+import money
+
+
+class BatchError(ValueError):
+    pass
+
+
+# Some transfers of the batch were made before it failed; report says which
+class BatchInterrupted(Exception):
+    def __init__(self, report):
+        super().__init__('Batch interrupted')
+        self.report = report
+
+
+def _rows_from_csv(stream):
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    rows = []
+    for record in csv.reader(text):
+        if not record or (not rows and record[0].strip().lower() == 'receiver_username'):
+            continue
+        rows.append(record)
+    return rows
+
+
+def _rows_from_json(payload):
+    rows = payload.get('rows') if isinstance(payload, dict) else payload
+    if not isinstance(rows, list):
+        raise BatchError('Expected a list of rows')
+    parsed = []
+    for row in rows:
+        if isinstance(row, dict):
+            parsed.append([row.get('receiver_username'), row.get('amount')])
+        elif isinstance(row, (list, tuple)):
+            parsed.append(list(row))
+        else:
+            parsed.append([None, None])
+    return parsed
+
+
+# Read (receiver_username, amount) rows from an uploaded CSV file or a JSON
+# body. Rows that cannot be parsed keep their place with an amount of None.
+def read_rows(request, max_rows):
+    upload = request.files.get('file')
+    if upload:
+        raw_rows = _rows_from_csv(upload.stream)
+    elif request.is_json:
+        raw_rows = _rows_from_json(request.get_json(silent=True))
+    else:
+        raise BatchError('Send a JSON body or upload a CSV file')
+
+    if not raw_rows:
+        raise BatchError('The batch is empty')
+    if len(raw_rows) > max_rows:
+        raise BatchError(f'A batch can contain at most {max_rows} rows')
+
+    rows = []
+    for record in raw_rows:
+        username = str(record[0]).strip() if len(record) > 0 and record[0] is not None else ''
+        amount = money.parse(record[1]) if len(record) > 1 and record[1] is not None else None
+        rows.append((username, amount))
+    return rows
+
+
+def run(connection, sender_id, sender_name, rows):
+    start = time.perf_counter()
+    valid = [(index, row) for index, row in enumerate(rows) if row[0] and row[1] is not None]
+    statuses = ['invalid_row'] * len(rows)
+    try:
+        applied = ledger.transfer_batch(connection, sender_id, sender_name, [row for _, row in valid])
+    except ledger.BatchInterrupted as e:
+        for (index, _), status in zip(valid, e.statuses):
+            statuses[index] = status
+        report = _report(rows, statuses, time.perf_counter() - start)
+        report['interrupted'] = True
+        raise BatchInterrupted(report) from e
+    for (index, _), status in zip(valid, applied):
+        statuses[index] = status
+    return _report(rows, statuses, time.perf_counter() - start)
+
+
+def _report(rows, statuses, elapsed):
+    return {
+        'rows': [
+            {'row': index, 'receiver_username': username, 'status': status}
+            for index, ((username, _), status) in enumerate(zip(rows, statuses))
+        ],
+        'total': len(rows),
+        'succeeded': statuses.count('ok'),
+        'failed': len(rows) - statuses.count('ok'),
+        'total_amount': money.format_paise(sum(amount for (_, amount), status in zip(rows, statuses) if status == 'ok')),
+        'elapsed_seconds': round(elapsed, 3),
+        'rows_per_sec': round(len(rows) / elapsed, 1) if elapsed else None,
+    }
@@ -0,0 +1,134 @@
+# Insert and recent-history latency on a large transactions table, before
+# and after moving old rows to transactions_archive.
+#
+#   python migrate.py upgrade
+#   python -m benchmarks.archive_bench --rows 10000000
+#   python -m benchmarks.archive_bench --skip-seed      # reuse the seeded rows
+#
+# Seeds --rows transactions spread evenly over --years for --users accounts,
+# rolls them up with snapshots.py (the mover only takes rows the snapshots
+# have seen), then times single-row inserts and the first history page for
+# random users. archive.run() then moves everything older than
+# ARCHIVE_AFTER_DAYS and the same measurements are repeated.
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+from config import Config
+from db import get_db_connection
+from benchmarks.common import summarize, write_results
+import archive
+import ledger
+import snapshots
+import transactions
+
+SEED_BATCH = 10000
+
+
+def seed_users(connection, users):
+    cursor = connection.cursor(buffered=True)
+    rows = [(f'archive_{i}', f'82{i:010d}', '!') for i in range(users)]
+    for start in range(0, len(rows), 5000):
+        cursor.executemany(
+            "INSERT IGNORE INTO users (username, aadhar, password) VALUES (%s, %s, %s)",
+            rows[start:start + 5000]
+        )
+    cursor.execute("SELECT id FROM users WHERE username LIKE %s", ('archive\\_%',))
+    ids = [row[0] for row in cursor.fetchall()]
+    connection.commit()
+    cursor.close()
+    return ids
+
+
+# Rows go in in created_at order, like real traffic, so ids and timestamps
+# increase together
+def seed_transactions(connection, ids, rows, years):
+    cursor = connection.cursor()
+    now = datetime.now()
+    span = timedelta(days=365 * years).total_seconds()
+    start = time.perf_counter()
+    for offset in range(0, rows, SEED_BATCH):
+        batch = []
+        for number in range(offset, min(rows, offset + SEED_BATCH)):
+            created_at = now - timedelta(seconds=span * (1 - number / rows))
+            batch.append((random.choice(ids), 'deposit', 'credit', 1000, 'Deposited ₹10.00', created_at))
+        cursor.executemany(
+            "INSERT INTO transactions (user_id, type, direction, amount, description, created_at) "
+            "VALUES (%s, %s, %s, %s, %s, %s)",
+            batch
+        )
+        connection.commit()
+        done = offset + len(batch)
+        if done % (SEED_BATCH * 50) == 0:
+            print(f"Seeded {done} rows ({done / (time.perf_counter() - start):.0f} rows/s)")
+    cursor.close()
+
+
+def table_sizes(connection):
+    cursor = connection.cursor(buffered=True)
+    cursor.execute("ANALYZE TABLE transactions, transactions_archive")
+    cursor.fetchall()
+    cursor.execute(
+        "SELECT table_name, table_rows, ROUND((data_length + index_length) / 1048576, 1) "
+        "FROM information_schema.tables "
+        "WHERE table_schema = DATABASE() AND table_name IN ('transactions', 'transactions_archive')"
+    )
+    sizes = {name: {'rows': count, 'size_mb': float(size)} for name, count, size in cursor.fetchall()}
+    cursor.close()
+    return sizes
+
+
+def measure(connection, ids, samples):
+    inserts, history = [], []
+    for _ in range(samples):
+        start = time.perf_counter()
+        ledger.deposit(connection, random.choice(ids), 100)
+        inserts.append(time.perf_counter() - start)
+    for _ in range(samples):
+        start = time.perf_counter()
+        transactions.fetch_page(connection, random.choice(ids), {})
+        history.append(time.perf_counter() - start)
+    return {'insert': summarize(inserts), 'recent_history': summarize(history)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--samples', type=int, default=2000)
+    parser.add_argument('--skip-seed', action='store_true')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    connection = get_db_connection()
+    ids = seed_users(connection, args.users)
+    if not args.skip_seed:
+        seed_transactions(connection, ids, args.rows, args.years)
+    snapshots.refresh(connection)
+
+    results = {'before': measure(connection, ids, args.samples)}
+    results['before']['tables'] = table_sizes(connection)
+
+    start = time.perf_counter()
+    moved = archive.run(connection, batch_size=Config.ARCHIVE_BATCH_SIZE)
+    results['archive'] = {'rows': moved, 'seconds': round(time.perf_counter() - start, 1)}
+
+    results['after'] = measure(connection, ids, args.samples)
+    results['after']['tables'] = table_sizes(connection)
+    connection.close()
+
+    print(f"Archived {moved} rows in {results['archive']['seconds']}s")
+    print(f"{'':<16}{'insert p50':>12}{'insert p99':>12}{'history p50':>13}{'history p99':>13}")
+    for phase in ('before', 'after'):
+        stats = results[phase]
+        print(f"{phase:<16}{stats['insert']['p50_ms']:>12}{stats['insert']['p99_ms']:>12}"
+              f"{stats['recent_history']['p50_ms']:>13}{stats['recent_history']['p99_ms']:>13}")
+        for table, size in stats['tables'].items():
+            print(f"  {table:<22}{size['rows']:>12} rows {size['size_mb']:>10} MB")
+    if args.output:
+        write_results(args.output, 'archive', results, vars(args))
+
+
+if __name__ == '__main__':
+    main()
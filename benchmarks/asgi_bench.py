@@ -0,0 +1,226 @@
+# Sync workers (gunicorn + app.py) against the async app (hypercorn +
+# asgi.py) under many concurrent connections.
+#
+#   MYSQL_DB=janseva_bench python -m benchmarks.loadtest seed --users 1000 --transactions 50
+#   MYSQL_DB=janseva_bench python -m benchmarks.asgi_bench --connections 1000 --workers 4 \
+#       --duration 30 --output results/asgi.json
+#
+# For each mode the benchmark starts the server itself, opens --connections
+# client connections, logs each in as a seeded load_* user and then requests
+# dashboard and history pages on all of them at once for --duration
+# seconds. It reports requests/sec and latency, the resident memory of the
+# server's processes (peak, and per 1k connections) and the most MySQL
+# connections open at any time. Sync workers close the connection after
+# every response, so their clients reconnect for each request. Every client
+# logs in from one address, so the servers are started with RATE_LIMITS=off
+# unless the environment sets it.
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+from urllib.parse import urlencode
+from db import get_db_connection
+from benchmarks.common import summarize, write_results
+from benchmarks.loadtest import PASSWORD
+
+HOST = '127.0.0.1'
+
+COMMANDS = {
+    'sync': lambda args: [sys.executable, '-m', 'gunicorn', '-w', str(args.workers), '-b', f'{HOST}:{args.port}',
+                          '--backlog', str(max(2048, args.connections)), 'app:app'],
+    'async': lambda args: [sys.executable, '-m', 'hypercorn', '-w', str(args.workers), '-b', f'{HOST}:{args.port}',
+                           '--backlog', str(max(2048, args.connections)), 'asgi:app'],
+}
+
+# Relative weights of the pages each client requests
+PAGES = {'/dashboard': 3, '/history': 1}
+
+
+class Client:
+    def __init__(self, port):
+        self.port = port
+        self.cookie = None
+        self.reader = self.writer = None
+
+    async def _open(self):
+        self.reader, self.writer = await asyncio.open_connection(HOST, self.port)
+
+    def _close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def _read_body(self, headers):
+        if headers.get('transfer-encoding') == 'chunked':
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                await self.reader.readexactly(size + 2)
+                if size == 0:
+                    return
+        else:
+            await self.reader.readexactly(int(headers.get('content-length', 0)))
+
+    async def request(self, method, path, form=None):
+        body = urlencode(form).encode() if form else b''
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {HOST}:{self.port}', f'Content-Length: {len(body)}']
+        if form:
+            lines.append('Content-Type: application/x-www-form-urlencoded')
+        if self.cookie:
+            lines.append(f'Cookie: {self.cookie}')
+        payload = ('\r\n'.join(lines) + '\r\n\r\n').encode() + body
+        for attempt in (0, 1):
+            try:
+                if self.writer is None:
+                    await self._open()
+                self.writer.write(payload)
+                status_line = await self.reader.readline()
+                if not status_line:
+                    raise ConnectionError('server closed the connection')
+                headers = {}
+                while True:
+                    line = (await self.reader.readline()).decode('latin-1').strip()
+                    if not line:
+                        break
+                    name, _, value = line.partition(':')
+                    name, value = name.lower(), value.strip()
+                    if name == 'set-cookie' and value.startswith('session='):
+                        self.cookie = value.split(';', 1)[0]
+                    headers[name] = value
+                await self._read_body(headers)
+                if headers.get('connection', '').lower() == 'close':
+                    self._close()
+                return int(status_line.split()[1])
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                self._close()
+                if attempt:
+                    return 599
+
+
+def server_rss(pid):
+    # The server's master process and every worker under it
+    pids = [pid]
+    total = 0
+    while pids:
+        current = pids.pop()
+        try:
+            with open(f'/proc/{current}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+            with open(f'/proc/{current}/task/{current}/children') as f:
+                pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return total
+
+
+def mysql_connections():
+    connection = get_db_connection()
+    cursor = connection.cursor(buffered=True)
+    cursor.execute("SHOW STATUS LIKE 'Threads_connected'")
+    count = int(cursor.fetchone()[1])
+    cursor.close()
+    connection.close()
+    return count
+
+
+async def wait_for_server(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection(HOST, port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f'Server did not start on port {port}')
+
+
+async def drive(args, server):
+    baseline_connections = mysql_connections()
+    rng = random.Random(args.seed)
+    clients = [Client(args.port) for _ in range(args.connections)]
+    login = [client.request('POST', '/login', {'username': f'load_{n % args.users}', 'password': PASSWORD})
+             for n, client in enumerate(clients)]
+    login_statuses = await asyncio.gather(*login)
+
+    samples = []
+    errors = 0
+    peak = {'rss': server_rss(server.pid), 'mysql': 0}
+    deadline = time.monotonic() + args.duration
+
+    async def client_loop(client, seed):
+        nonlocal errors
+        pick = random.Random(seed)
+        while time.monotonic() < deadline:
+            path = pick.choices(list(PAGES), list(PAGES.values()))[0]
+            started = time.perf_counter()
+            status = await client.request('GET', path)
+            samples.append(time.perf_counter() - started)
+            if status >= 400:
+                errors += 1
+
+    async def sample():
+        while time.monotonic() < deadline:
+            peak['rss'] = max(peak['rss'], server_rss(server.pid))
+            peak['mysql'] = max(peak['mysql'], await asyncio.to_thread(mysql_connections) - baseline_connections)
+            await asyncio.sleep(1)
+
+    started = time.perf_counter()
+    await asyncio.gather(sample(), *(client_loop(client, rng.random()) for client in clients))
+    elapsed = time.perf_counter() - started
+    for client in clients:
+        client._close()
+
+    results = summarize(samples, elapsed)
+    results['errors'] = errors
+    results['failed_logins'] = sum(1 for status in login_statuses if status != 302)
+    results['peak_rss_mb'] = round(peak['rss'] / 2 ** 20, 1)
+    results['rss_mb_per_1k_connections'] = round(peak['rss'] / 2 ** 20 / args.connections * 1000, 1)
+    results['peak_mysql_connections'] = peak['mysql']
+    return results
+
+
+def run_mode(mode, args):
+    server = subprocess.Popen(COMMANDS[mode](args), env={'RATE_LIMITS': 'off', **os.environ}, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL if not args.verbose else None)
+    try:
+        asyncio.run(wait_for_server(args.port))
+        return asyncio.run(drive(args, server))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modes', nargs='+', choices=sorted(COMMANDS), default=['sync', 'async'])
+    parser.add_argument('--connections', type=int, default=1000, help='concurrent client connections')
+    parser.add_argument('--workers', type=int, default=4, help='server worker processes')
+    parser.add_argument('--duration', type=float, default=30, help='seconds')
+    parser.add_argument('--users', type=int, default=1000, help='seeded users to log in as')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--verbose', action='store_true', help="show the servers' logs")
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    results = {}
+    for mode in args.modes:
+        print(f"{mode}: {args.workers} workers, {args.connections} connections, {args.duration:.0f}s", file=sys.stderr)
+        results[mode] = run_mode(mode, args)
+
+    print(f"{'mode':<7}{'req/s':>9}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}{'RSS MB':>9}"
+          f"{'MB/1k conn':>12}{'MySQL conn':>12}")
+    for mode, stats in results.items():
+        print(f"{mode:<7}{stats['throughput']:>9}{stats['p50_ms']:>10}{stats['p99_ms']:>10}{stats['errors']:>8}"
+              f"{stats['peak_rss_mb']:>9}{stats['rss_mb_per_1k_connections']:>12}{stats['peak_mysql_connections']:>12}")
+    if args.output:
+        write_results(args.output, 'asgi', results, vars(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+# Throughput of the batch transfer path.
+#
+# Creates a sender and a pool of receivers, then pays out batches of 10k and
+# 100k rows through batch.run() and prints rows/sec for each size.
+#
+#   python -m benchmarks.batch_bench --sizes 10000 100000
+import argparse
+import random
+from db import get_db_connection
+import batch
+
+
+def seed(receivers, balance):
+    connection = get_db_connection()
+    cursor = connection.cursor(buffered=True)
+    cursor.execute(
+        "INSERT IGNORE INTO users (username, aadhar, password) VALUES ('batch_sender', '800000000000', '!')"
+    )
+    rows = [(f'batch_recv_{i}', f'81{i:010d}', '!') for i in range(receivers)]
+    for start in range(0, len(rows), 5000):
+        cursor.executemany(
+            "INSERT IGNORE INTO users (username, aadhar, password) VALUES (%s, %s, %s)",
+            rows[start:start + 5000]
+        )
+    cursor.execute("UPDATE users SET balance = %s WHERE username = 'batch_sender'", (balance,))
+    cursor.execute("SELECT id FROM users WHERE username = 'batch_sender'")
+    sender_id = cursor.fetchone()[0]
+    connection.commit()
+    cursor.close()
+    connection.close()
+    return sender_id
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--receivers', type=int, default=5000)
+    args = parser.parse_args()
+
+    sender_id = seed(args.receivers, 99_999_999_00)
+    rng = random.Random(1)
+    for size in args.sizes:
+        rows = [
+            (f'batch_recv_{rng.randrange(args.receivers)}', rng.randint(100, 999))
+            for _ in range(size)
+        ]
+        connection = get_db_connection()
+        try:
+            report = batch.run(connection, sender_id, 'batch_sender', rows)
+        finally:
+            connection.close()
+        print(f"{size:>7} rows: {report['rows_per_sec']:>10.1f} rows/sec  "
+              f"({report['elapsed_seconds']}s, {report['succeeded']} ok, {report['failed']} failed)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+import json
+import platform
+import subprocess
+import time
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+# Latency summary in milliseconds for a list of durations in seconds
+def summarize(samples, elapsed=None):
+    summary = {
+        'count': len(samples),
+        'p50_ms': round(percentile(samples, 50) * 1000, 3) if samples else None,
+        'p95_ms': round(percentile(samples, 95) * 1000, 3) if samples else None,
+        'p99_ms': round(percentile(samples, 99) * 1000, 3) if samples else None,
+    }
+    if elapsed:
+        summary['throughput'] = round(len(samples) / elapsed, 1)
+    return summary
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Write results with enough context to compare runs between commits
+def write_results(path, name, results, settings=None):
+    document = {
+        'benchmark': name,
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'settings': settings or {},
+        'results': results,
+    }
+    with open(path, 'w') as f:
+        json.dump(document, f, indent=2)
+    print(f"Results written to {path}")
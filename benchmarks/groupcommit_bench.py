@@ -0,0 +1,84 @@
+# Deposits per second with one commit per request vs group commit.
+#
+#   python -m benchmarks.groupcommit_bench --threads 32 --deposits 200
+import argparse
+import threading
+import time
+from config import Config
+from db import get_db_connection, get_pool
+from benchmarks.common import summarize, write_results
+import groupcommit
+import ledger
+
+
+def seed(accounts):
+    connection = get_db_connection()
+    cursor = connection.cursor(buffered=True)
+    cursor.executemany(
+        "INSERT IGNORE INTO users (username, aadhar, password) VALUES (%s, %s, %s)",
+        [(f'gc_{i}', f'82{i:010d}', '!') for i in range(accounts)]
+    )
+    connection.commit()
+    cursor.execute("SELECT id FROM users WHERE username LIKE 'gc\\_%'")
+    ids = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    connection.close()
+    return ids
+
+
+def run(mode, ids, threads, deposits):
+    latencies = []
+    lock = threading.Lock()
+    amount = 100
+
+    def worker(number):
+        user_id = ids[number % len(ids)]
+        for _ in range(deposits):
+            start = time.perf_counter()
+            if mode == 'group':
+                groupcommit.deposit(user_id, amount)
+            else:
+                connection = get_db_connection()
+                try:
+                    ledger.deposit(connection, user_id, amount)
+                finally:
+                    connection.close()
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--deposits', type=int, default=200, help='per thread')
+    parser.add_argument('--accounts', type=int, default=100)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    Config.MYSQL_POOL_SIZE = args.threads + 1
+    get_pool()
+    ids = seed(args.accounts)
+
+    results = {}
+    for mode in ('per-request', 'group'):
+        results[mode] = run(mode, ids, args.threads, args.deposits)
+        print(f"{mode:>12}: {results[mode]['throughput']:>9} deposits/sec  "
+              f"p50={results[mode]['p50_ms']}ms p99={results[mode]['p99_ms']}ms")
+    writer = groupcommit.get_writer().stats()
+    results['group']['commits'] = writer['batches']
+    print(f"group commit used {writer['batches']} commits for {writer['committed']} deposits "
+          f"(largest batch {writer['largest_batch']})")
+    if args.output:
+        write_results(args.output, 'groupcommit', results, vars(args))
+
+
+if __name__ == '__main__':
+    main()
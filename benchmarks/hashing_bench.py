@@ -0,0 +1,74 @@
+# Login latency under a burst, with password hashing inline or on the pool.
+#
+# A thread pool plays the part of a threaded gunicorn worker. Clients send a
+# burst of logins (a password check) mixed with cheap page requests, and the
+# script reports p50/p99 for both, plus how many logins were shed with 503.
+#
+#   python -m benchmarks.hashing_bench --logins 200 --threads 8
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import generate_password_hash
+from config import Config
+from benchmarks.common import summarize, write_results
+import hashing
+
+
+def run(mode, args, password_hash):
+    Config.PASSWORD_HASH_WORKERS = 0 if mode == 'inline' else args.hash_workers
+    Config.PASSWORD_HASH_QUEUE_DEPTH = args.queue_depth
+    lock = threading.Lock()
+    logins, pages, shed = [], [], [0]
+
+    def login(queued_at):
+        try:
+            hashing.verify_password(password_hash, 'secret')
+        except hashing.HashingBusy:
+            with lock:
+                shed[0] += 1
+        with lock:
+            logins.append(time.perf_counter() - queued_at)
+
+    def page(queued_at):
+        time.sleep(0.001)
+        with lock:
+            pages.append(time.perf_counter() - queued_at)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as worker:
+        for i in range(args.logins):
+            worker.submit(login, time.perf_counter())
+            if i % 2 == 0:
+                worker.submit(page, time.perf_counter())
+    elapsed = time.perf_counter() - start
+    return {
+        'login': summarize(logins, elapsed),
+        'other_routes': summarize(pages, elapsed),
+        'shed_503': shed[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--hash-workers', type=int, default=Config.PASSWORD_HASH_WORKERS or 2)
+    parser.add_argument('--queue-depth', type=int, default=2)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    password_hash = generate_password_hash('secret', Config.PASSWORD_HASH_METHOD)
+    results = {}
+    for mode in ('inline', 'pool'):
+        results[mode] = run(mode, args, password_hash)
+        print(f"{mode:>6}: login p50={results[mode]['login']['p50_ms']}ms "
+              f"p99={results[mode]['login']['p99_ms']}ms  "
+              f"other p99={results[mode]['other_routes']['p99_ms']}ms  "
+              f"shed={results[mode]['shed_503']}")
+    if args.output:
+        write_results(args.output, 'hashing', results, vars(args))
+
+
+if __name__ == '__main__':
+    main()
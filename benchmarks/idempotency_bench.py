@@ -0,0 +1,162 @@
+# Idempotency keys under a retry storm.
+#
+#   python -m benchmarks.idempotency_bench --ops 2000 --retries 5 --threads 16
+#
+# Every withdrawal gets its own key and is sent --retries times, all copies
+# shuffled across --threads threads, the way a proxy retrying timed-out
+# POSTs would send them. Checks that each key moved money exactly once, and
+# reports the latency of requests that did the work against those answered
+# from memory or replayed from idempotency_keys. Then ages the keys and
+# times the sweep.
+import argparse
+import random
+import threading
+import time
+import uuid
+from mysql.connector import Error
+from config import Config
+from db import get_db_connection, get_pool
+from benchmarks.common import summarize, write_results
+import idempotency
+import ledger
+
+
+def setup_accounts(accounts, initial):
+    connection = get_db_connection()
+    cursor = connection.cursor(buffered=True)
+    ids = []
+    for i in range(accounts):
+        username = f'idem_{i}'
+        cursor.execute(
+            "INSERT IGNORE INTO users (username, aadhar, password) VALUES (%s, %s, %s)",
+            (username, f'83{i:010d}', '!')
+        )
+        cursor.execute("SELECT id FROM users WHERE username = %s", (username,))
+        ids.append(cursor.fetchone()[0])
+    placeholders = ', '.join(['%s'] * len(ids))
+    cursor.execute(f"UPDATE users SET balance = %s WHERE id IN ({placeholders})", [initial] + ids)
+    cursor.execute(f"DELETE FROM idempotency_keys WHERE user_id IN ({placeholders})", ids)
+    connection.commit()
+    cursor.close()
+    connection.close()
+    return ids
+
+
+def storm(ids, ops, retries, threads):
+    rng = random.Random(0)
+    operations = [(rng.choice(ids), rng.randint(1, 50), uuid.uuid4().hex) for _ in range(ops)]
+    attempts = [op for op in operations for _ in range(retries)]
+    rng.shuffle(attempts)
+    samples = {'applied': [], 'memory': [], 'replayed': []}
+    errors = []
+    lock = threading.Lock()
+    position = iter(attempts)
+
+    def worker():
+        while True:
+            with lock:
+                op = next(position, None)
+            if op is None:
+                return
+            user_id, amount, key = op
+            start = time.perf_counter()
+            outcome = 'applied'
+            if idempotency.lookup(user_id, key) is not None:
+                outcome = 'memory'
+            else:
+                connection = get_db_connection()
+                try:
+                    if idempotency.lookup(user_id, key, connection) is not None:
+                        outcome = 'replayed'
+                    else:
+                        ledger.withdraw(connection, user_id, amount, key)
+                except idempotency.Replayed:
+                    outcome = 'replayed'
+                except (Error, ledger.LedgerError, idempotency.RequestInProgress) as e:
+                    outcome = None
+                    with lock:
+                        errors.append(repr(e))
+                finally:
+                    connection.close()
+            if outcome:
+                with lock:
+                    samples[outcome].append(time.perf_counter() - start)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    expected = sum(amount for _, amount, _ in operations)
+    return samples, errors, elapsed, expected
+
+
+def withdrawn(ids, initial):
+    connection = get_db_connection()
+    cursor = connection.cursor(buffered=True)
+    placeholders = ', '.join(['%s'] * len(ids))
+    cursor.execute(f"SELECT SUM(balance) FROM users WHERE id IN ({placeholders})", ids)
+    total = int(cursor.fetchone()[0])
+    cursor.close()
+    connection.close()
+    return initial * len(ids) - total
+
+
+def time_sweep(ids):
+    connection = get_db_connection()
+    cursor = connection.cursor()
+    placeholders = ', '.join(['%s'] * len(ids))
+    cursor.execute(
+        f"UPDATE idempotency_keys SET created_at = NOW() - INTERVAL 2 DAY WHERE user_id IN ({placeholders})",
+        ids
+    )
+    connection.commit()
+    cursor.close()
+    start = time.perf_counter()
+    swept = idempotency.sweep(connection, ttl=86400)
+    elapsed = time.perf_counter() - start
+    connection.close()
+    return swept, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--accounts', type=int, default=50)
+    parser.add_argument('--initial', type=int, default=10 ** 9, help='starting balance in paise')
+    parser.add_argument('--ops', type=int, default=2000, help='distinct keyed withdrawals')
+    parser.add_argument('--retries', type=int, default=5, help='copies of each request')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    Config.MYSQL_POOL_SIZE = args.threads
+    get_pool()
+
+    ids = setup_accounts(args.accounts, args.initial)
+    samples, errors, elapsed, expected = storm(ids, args.ops, args.retries, args.threads)
+    actual = withdrawn(ids, args.initial)
+    swept, sweep_elapsed = time_sweep(ids)
+
+    requests = sum(len(values) for values in samples.values())
+    results = {name: summarize(values) for name, values in samples.items()}
+    results['requests_per_sec'] = round(requests / elapsed, 1)
+    results['errors'] = len(errors)
+    results['withdrawn'] = {'expected': expected, 'actual': actual}
+    results['sweep'] = {'keys': swept, 'keys_per_sec': round(swept / sweep_elapsed, 1) if sweep_elapsed else None}
+    results['counters'] = idempotency.stats()
+
+    print(f"{requests} requests for {args.ops} keys in {elapsed:.1f}s ({results['requests_per_sec']}/s), "
+          f"{len(errors)} errors")
+    for name in ('applied', 'memory', 'replayed'):
+        stats = results[name]
+        print(f"{name:>9}: {stats['count']:>7}  p50={stats['p50_ms']}ms  p99={stats['p99_ms']}ms")
+    print(f"withdrawn {actual} paise, expected {expected}: {'OK' if actual == expected else 'DUPLICATES APPLIED'}")
+    print(f"swept {swept} keys ({results['sweep']['keys_per_sec']} keys/s)")
+    if args.output:
+        write_results(args.output, 'idempotency', results, vars(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+# Concurrency stress test for the ledger operations.
+#
+# Runs the same random mix of withdrawals and transfers over a small set of
+# hot accounts twice: once with the old check-then-update statements and once
+# through ledger.py, then checks that no balance went negative and that money
+# was conserved.
+#
+#   python -m benchmarks.ledger_stress --threads 16 --ops 500
+import argparse
+import random
+import threading
+import time
+from mysql.connector import Error
+from config import Config
+from db import get_db_connection, get_pool
+import ledger
+from money import format_paise
+
+
+def setup_accounts(accounts, initial):
+    connection = get_db_connection()
+    cursor = connection.cursor(buffered=True)
+    ids = []
+    for i in range(accounts):
+        username = f'stress_{i}'
+        cursor.execute(
+            "INSERT IGNORE INTO users (username, aadhar, password) VALUES (%s, %s, %s)",
+            (username, f'9{i:011d}', '!')
+        )
+        cursor.execute("SELECT id FROM users WHERE username = %s", (username,))
+        ids.append(cursor.fetchone()[0])
+    placeholders = ', '.join(['%s'] * len(ids))
+    cursor.execute(f"DELETE FROM transactions WHERE user_id IN ({placeholders})", ids)
+    cursor.execute(f"UPDATE users SET balance = %s WHERE id IN ({placeholders})", [initial] + ids)
+    connection.commit()
+    cursor.close()
+    connection.close()
+    return ids
+
+
+def legacy_withdraw(connection, user_id, amount):
+    cursor = connection.cursor(buffered=True)
+    cursor.execute("SELECT balance FROM users WHERE id = %s", (user_id,))
+    if cursor.fetchone()[0] < amount:
+        cursor.close()
+        raise ledger.InsufficientFunds(user_id)
+    cursor.execute("UPDATE users SET balance = balance - %s WHERE id = %s", (amount, user_id))
+    cursor.execute(
+        "INSERT INTO transactions (user_id, type, direction, amount, description) VALUES (%s, 'withdraw', 'debit', %s, %s)",
+        (user_id, amount, f'Withdrew ₹{format_paise(amount)}')
+    )
+    connection.commit()
+    cursor.close()
+
+
+def legacy_transfer(connection, sender_id, sender_name, receiver_id, receiver_name, amount):
+    cursor = connection.cursor(buffered=True)
+    cursor.execute("SELECT balance FROM users WHERE id = %s", (sender_id,))
+    if cursor.fetchone()[0] < amount:
+        cursor.close()
+        raise ledger.InsufficientFunds(sender_id)
+    cursor.execute("UPDATE users SET balance = balance - %s WHERE id = %s", (amount, sender_id))
+    cursor.execute("UPDATE users SET balance = balance + %s WHERE id = %s", (amount, receiver_id))
+    cursor.execute(
+        "INSERT INTO transactions (user_id, type, direction, amount, description) VALUES (%s, 'transfer', 'debit', %s, %s)",
+        (sender_id, amount, f'Transferred ₹{format_paise(amount)} to {receiver_name}')
+    )
+    cursor.execute(
+        "INSERT INTO transactions (user_id, type, direction, amount, description) VALUES (%s, 'transfer', 'credit', %s, %s)",
+        (receiver_id, amount, f'Received ₹{format_paise(amount)} from {sender_name}')
+    )
+    connection.commit()
+    cursor.close()
+
+
+def run(mode, ids, threads, ops):
+    withdraw = ledger.withdraw if mode == 'ledger' else legacy_withdraw
+    transfer = ledger.transfer if mode == 'ledger' else legacy_transfer
+    lock = threading.Lock()
+    totals = {'ok': 0, 'rejected': 0, 'errors': 0, 'withdrawn': 0}
+
+    def worker(seed):
+        rng = random.Random(seed)
+        for _ in range(ops):
+            amount = rng.randint(1, 50)
+            connection = get_db_connection()
+            try:
+                if rng.random() < 0.5:
+                    withdraw(connection, rng.choice(ids), amount)
+                    withdrawn = amount
+                else:
+                    sender, receiver = rng.sample(ids, 2)
+                    transfer(connection, sender, 'stress', receiver, 'stress', amount)
+                    withdrawn = 0
+                result = 'ok'
+            except ledger.InsufficientFunds:
+                result, withdrawn = 'rejected', 0
+            except Error:
+                connection.rollback()
+                result, withdrawn = 'errors', 0
+            finally:
+                connection.close()
+            with lock:
+                totals[result] += 1
+                totals['withdrawn'] += withdrawn
+
+    workers = [threading.Thread(target=worker, args=(seed,)) for seed in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    totals['elapsed'] = time.perf_counter() - start
+    return totals
+
+
+def check(ids, initial, totals):
+    connection = get_db_connection()
+    cursor = connection.cursor(buffered=True)
+    placeholders = ', '.join(['%s'] * len(ids))
+    cursor.execute(f"SELECT MIN(balance), SUM(balance) FROM users WHERE id IN ({placeholders})", ids)
+    lowest, total = cursor.fetchone()
+    cursor.close()
+    connection.close()
+    expected = initial * len(ids) - totals['withdrawn']
+    return lowest, total, expected
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--accounts', type=int, default=10)
+    parser.add_argument('--initial', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--ops', type=int, default=300, help='operations per thread')
+    parser.add_argument('--mode', choices=['legacy', 'ledger', 'both'], default='both')
+    args = parser.parse_args()
+
+    Config.MYSQL_POOL_SIZE = args.threads
+    get_pool()
+
+    modes = ['legacy', 'ledger'] if args.mode == 'both' else [args.mode]
+    for mode in modes:
+        ids = setup_accounts(args.accounts, args.initial)
+        totals = run(mode, ids, args.threads, args.ops)
+        lowest, total, expected = check(ids, args.initial, totals)
+        ops = totals['ok'] + totals['rejected'] + totals['errors']
+        print(f"{mode:>7}: {ops / totals['elapsed']:8.1f} ops/sec  "
+              f"ok={totals['ok']} rejected={totals['rejected']} errors={totals['errors']}")
+        print(f"         lowest balance={lowest}  total={total}  expected={expected}  "
+              f"{'OK' if lowest >= 0 and total == expected else 'INCONSISTENT'}")
+
+
+if __name__ == '__main__':
+    main()
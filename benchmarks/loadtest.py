@@ -0,0 +1,244 @@
+# Load test for every route of a running server.
+#
+# Seed a throwaway database, start the app against it, then drive it with
+# one of the traffic mixes below:
+#
+#   MYSQL_DB=janseva_bench python migrate.py recreate
+#   MYSQL_DB=janseva_bench python -m benchmarks.loadtest seed --users 1000 --transactions 50
+#   MYSQL_DB=janseva_bench RATE_LIMITS=off gunicorn -w 4 -b 127.0.0.1:8000 app:app
+#   python -m benchmarks.loadtest run --url http://127.0.0.1:8000 --mix read-heavy \
+#       --concurrency 32 --duration 60 --output results/read-heavy.json
+#
+# Results hold throughput and p50/p95/p99 latency per route and are written
+# as JSON tagged with the git revision, so runs can be compared across
+# commits. The app's SQL is MySQL-specific, so the target is always MySQL.
+#
+# Every virtual user logs in from the same address, so start the server with
+# RATE_LIMITS=off (or limits above --concurrency); otherwise most logins are
+# refused. Responses of 400 and up count as errors, and a virtual user whose
+# login fails is counted in failed_logins and stops instead of measuring
+# redirects to the login page.
+import argparse
+import http.client
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from urllib.parse import urlencode, urlsplit
+from werkzeug.security import generate_password_hash
+from config import Config
+from db import get_db_connection
+from benchmarks.common import summarize, write_results
+from money import format_paise
+
+PASSWORD = 'load-test-password'
+
+# Relative weights of each action per traffic mix
+MIXES = {
+    'read-heavy': {
+        'dashboard': 50, 'history': 25, 'deposit_form': 10,
+        'deposit': 5, 'withdraw': 4, 'transfer': 5, 'register': 1,
+    },
+    'transfer-heavy': {
+        'dashboard': 10, 'history': 5, 'deposit': 15,
+        'withdraw': 9, 'transfer': 60, 'register': 1,
+    },
+    # Every transfer pays the same account, so its row lock is contended
+    'hot-account': {
+        'dashboard': 20, 'deposit': 10, 'hot_transfer': 69, 'register': 1,
+    },
+}
+
+
+def seed(args):
+    rng = random.Random(args.seed)
+    password_hash = generate_password_hash(PASSWORD, Config.PASSWORD_HASH_METHOD)
+    connection = get_db_connection()
+    cursor = connection.cursor(buffered=True)
+
+    users = [(f'load_{i}', f'7{i:011d}', password_hash, args.balance) for i in range(args.users)]
+    for start in range(0, len(users), 5000):
+        cursor.executemany(
+            "INSERT IGNORE INTO users (username, aadhar, password, balance) VALUES (%s, %s, %s, %s)",
+            users[start:start + 5000]
+        )
+    connection.commit()
+    cursor.execute("SELECT id FROM users WHERE username LIKE 'load\\_%'")
+    ids = [row[0] for row in cursor.fetchall()]
+
+    now = datetime.now()
+    batch = []
+    for user_id in ids:
+        for _ in range(args.transactions):
+            txn_type = rng.choice(['deposit', 'withdraw', 'transfer'])
+            amount = rng.randint(100, 100000)
+            created_at = now - timedelta(seconds=rng.randint(0, 365 * 86400))
+            direction = 'credit' if txn_type == 'deposit' else 'debit'
+            batch.append((user_id, txn_type, direction, amount, f'Seeded {txn_type} of ₹{format_paise(amount)}', created_at))
+            if len(batch) >= 5000:
+                cursor.executemany(
+                    "INSERT INTO transactions (user_id, type, direction, amount, description, created_at) "
+                    "VALUES (%s, %s, %s, %s, %s, %s)", batch
+                )
+                connection.commit()
+                batch = []
+    if batch:
+        cursor.executemany(
+            "INSERT INTO transactions (user_id, type, direction, amount, description, created_at) "
+            "VALUES (%s, %s, %s, %s, %s, %s)", batch
+        )
+        connection.commit()
+    cursor.close()
+    connection.close()
+    print(f"Seeded {len(ids)} users with {args.transactions} transactions each")
+
+
+# One keep-alive HTTP connection with the Flask session cookie
+class Client:
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.cookie = None
+        self.conn = None
+
+    def request(self, method, path, form=None):
+        body = urlencode(form) if form else None
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'} if form else {}
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        for attempt in (0, 1):
+            try:
+                if self.conn is None:
+                    self.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+                self.conn.request(method, path, body=body, headers=headers)
+                response = self.conn.getresponse()
+                response.read()
+                break
+            except (OSError, http.client.HTTPException):
+                self.conn = None
+                if attempt:
+                    return 599
+        cookie = response.getheader('Set-Cookie')
+        if cookie:
+            self.cookie = cookie.split(';', 1)[0]
+        return response.status
+
+
+def run(args):
+    weights = MIXES[args.mix]
+    actions = list(weights)
+    lock = threading.Lock()
+    samples = {}
+    errors = {}
+    failed_logins = 0
+    deadline = time.monotonic() + args.duration
+
+    def record(route, started, status):
+        elapsed = time.perf_counter() - started
+        with lock:
+            samples.setdefault(route, []).append(elapsed)
+            if status >= 400:
+                errors[route] = errors.get(route, 0) + 1
+
+    def timed(client, route, method, path, form=None):
+        started = time.perf_counter()
+        status = client.request(method, path, form)
+        record(route, started, status)
+        return status
+
+    def virtual_user(number):
+        nonlocal failed_logins
+        rng = random.Random(args.seed + number)
+        client = Client(args.url)
+        username = f'load_{number % args.users}'
+        # A successful login redirects to the dashboard
+        if timed(client, 'POST /login', 'POST', '/login', {'username': username, 'password': PASSWORD}) != 302:
+            with lock:
+                failed_logins += 1
+            return
+        while time.monotonic() < deadline:
+            action = rng.choices(actions, [weights[a] for a in actions])[0]
+            amount = f'{rng.randint(100, 5000) / 100:.2f}'
+            if action == 'dashboard':
+                timed(client, 'GET /dashboard', 'GET', '/dashboard')
+            elif action == 'history':
+                timed(client, 'GET /history', 'GET', '/history')
+            elif action == 'deposit_form':
+                timed(client, 'GET /deposit', 'GET', '/deposit')
+            elif action == 'deposit':
+                timed(client, 'POST /deposit', 'POST', '/deposit', {'amount': amount})
+            elif action == 'withdraw':
+                timed(client, 'POST /withdraw', 'POST', '/withdraw', {'amount': amount})
+            elif action in ('transfer', 'hot_transfer'):
+                if action == 'hot_transfer' and number % args.users != 0:
+                    receiver = 'load_0'
+                else:
+                    receiver = f'load_{rng.randrange(args.users)}'
+                if receiver != username:
+                    timed(client, 'POST /transfer', 'POST', '/transfer',
+                          {'receiver_username': receiver, 'amount': amount})
+            elif action == 'register':
+                anonymous = Client(args.url)
+                name = f'load_new_{uuid.uuid4().hex[:12]}'
+                timed(anonymous, 'POST /register', 'POST', '/register', {
+                    'username': name,
+                    'aadhar': f'6{rng.randrange(10 ** 11):011d}',
+                    'password': PASSWORD,
+                })
+
+    threads = [threading.Thread(target=virtual_user, args=(n,)) for n in range(args.concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    results = {'routes': {}, 'elapsed_seconds': round(elapsed, 2), 'failed_logins': failed_logins}
+    all_samples = []
+    for route in sorted(samples):
+        results['routes'][route] = summarize(samples[route], elapsed)
+        results['routes'][route]['errors'] = errors.get(route, 0)
+        all_samples.extend(samples[route])
+    results['total'] = summarize(all_samples, elapsed)
+
+    print(f"{'route':<18}{'count':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for route, stats in list(results['routes'].items()) + [('total', results['total'])]:
+        print(f"{route:<18}{stats['count']:>8}{stats['throughput']:>9}{stats['p50_ms']:>10}"
+              f"{stats['p95_ms']:>10}{stats['p99_ms']:>10}{stats.get('errors', ''):>8}")
+    if failed_logins:
+        print(f"{failed_logins} of {args.concurrency} virtual users could not log in")
+    if args.output:
+        write_results(args.output, f'loadtest-{args.mix}', results, vars(args))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = commands.add_parser('seed', help='create load_* users and their history')
+    seed_parser.add_argument('--users', type=int, default=1000)
+    seed_parser.add_argument('--transactions', type=int, default=50, help='per user')
+    seed_parser.add_argument('--balance', type=int, default=100000000, help='starting balance in paise')
+    seed_parser.add_argument('--seed', type=int, default=1)
+
+    run_parser = commands.add_parser('run', help='drive a running server')
+    run_parser.add_argument('--url', default='http://127.0.0.1:5000')
+    run_parser.add_argument('--mix', choices=sorted(MIXES), default='read-heavy')
+    run_parser.add_argument('--users', type=int, default=1000, help='seeded users to log in as')
+    run_parser.add_argument('--concurrency', type=int, default=16)
+    run_parser.add_argument('--duration', type=float, default=30, help='seconds')
+    run_parser.add_argument('--seed', type=int, default=1)
+    run_parser.add_argument('--output')
+
+    args = parser.parse_args()
+    if args.command == 'seed':
+        seed(args)
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
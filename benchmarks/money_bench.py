@@ -0,0 +1,98 @@
+# Cost of the money representation: DECIMAL rupees as Decimal against
+# BIGINT paise as int.
+#
+#   python -m benchmarks.money_bench --values 200000
+#
+# Times, per value: parsing form input, summing and comparing amounts,
+# converting a column value the way mysql.connector does for each row it
+# reads, and formatting for display. No database is needed.
+import argparse
+import random
+import time
+from decimal import Decimal, InvalidOperation
+from mysql.connector.constants import FieldType
+from mysql.connector.conversion import MySQLConverter
+from benchmarks.common import write_results
+import money
+
+
+# The parser the app used before money.py
+def parse_decimal(value):
+    try:
+        amount = Decimal(str(value).strip())
+    except (InvalidOperation, ValueError):
+        return None
+    if not amount.is_finite() or amount <= 0 or amount != amount.quantize(Decimal('0.01')):
+        return None
+    return amount
+
+
+def timed(function, values):
+    start = time.perf_counter()
+    function(values)
+    return (time.perf_counter() - start) / len(values) * 1e9
+
+
+def run(values):
+    rng = random.Random(0)
+    paise = [rng.randint(1, 10 ** 7) for _ in range(values)]
+    text = [money.format_paise(amount) for amount in paise]
+    decimals = [Decimal(amount) for amount in text]
+    converter = MySQLConverter()
+    decimal_field = (None, FieldType.NEWDECIMAL)
+    bigint_field = (None, FieldType.LONGLONG)
+    decimal_bytes = [amount.encode() for amount in text]
+    bigint_bytes = [str(amount).encode() for amount in paise]
+
+    def total_and_check(amounts, limit):
+        total = sum(amounts)
+        return [amount for amount in amounts if amount <= limit], total
+
+    cases = {
+        'parse': (
+            lambda vs: [parse_decimal(v) for v in vs],
+            lambda vs: [money.parse(v) for v in vs],
+            text, text,
+        ),
+        'arithmetic': (
+            lambda vs: total_and_check(vs, Decimal('50000.00')),
+            lambda vs: total_and_check(vs, 50000_00),
+            decimals, paise,
+        ),
+        'row_conversion': (
+            lambda vs: [converter.to_python(decimal_field, v) for v in vs],
+            lambda vs: [converter.to_python(bigint_field, v) for v in vs],
+            decimal_bytes, bigint_bytes,
+        ),
+        'format': (
+            lambda vs: [f'{v:.2f}' for v in vs],
+            lambda vs: [money.format_paise(v) for v in vs],
+            decimals, paise,
+        ),
+    }
+    results = {}
+    for name, (as_decimal, as_paise, decimal_values, paise_values) in cases.items():
+        results[name] = {
+            'decimal_ns': round(timed(as_decimal, decimal_values), 1),
+            'paise_ns': round(timed(as_paise, paise_values), 1),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--values', type=int, default=200000)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    results = run(args.values)
+    print(f"{'ns per value':<16}{'Decimal':>10}{'paise':>10}{'speedup':>10}")
+    for name, stats in results.items():
+        speedup = stats['decimal_ns'] / stats['paise_ns']
+        print(f"{name:<16}{stats['decimal_ns']:>10}{stats['paise_ns']:>10}{speedup:>9.1f}x")
+    if args.output:
+        write_results(args.output, 'money', results, vars(args))
+
+
+if __name__ == '__main__':
+    main()
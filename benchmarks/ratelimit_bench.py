@@ -0,0 +1,62 @@
+# Per-request cost of the rate limiter and concurrency cap.
+#
+#   python -m benchmarks.ratelimit_bench --checks 100000
+#   python kvstore.py --address /tmp/janseva-kv.sock &
+#   RATE_LIMIT_KV_ADDRESS=/tmp/janseva-kv.sock python -m benchmarks.ratelimit_bench
+#
+# Times the admission check for a single client over many distinct
+# addresses, with the in-process store and, when the kvstore server is
+# running, the shared one. The budget is 100µs per request.
+import argparse
+import time
+from config import Config
+from kvstore import KVClient, KVError, Store
+from benchmarks.common import summarize, write_results
+from ratelimit import RateLimiter
+
+BUDGET_US = 100
+
+
+def run(store, checks):
+    # Limits high enough that every check is admitted, so each one does the
+    # full read-modify-write
+    limiter = RateLimiter(store, {'transfer': (10 ** 9, 1)}, Config.MAX_INFLIGHT)
+    samples = []
+    for number in range(checks):
+        start = time.perf_counter()
+        limiter.check('transfer', f'10.0.{number % 250}.{number % 200}', number % 5000)
+        limiter.enter()
+        limiter.leave()
+        samples.append(time.perf_counter() - start)
+    summary = summarize(samples)
+    summary['mean_us'] = round(sum(samples) / len(samples) * 1e6, 2)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checks', type=int, default=100000)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    stores = {'local': Store()}
+    client = KVClient(Config.RATE_LIMIT_KV_ADDRESS)
+    try:
+        client.call('ping')
+        stores['shared'] = client
+    except KVError:
+        print(f"kvstore not reachable at {Config.RATE_LIMIT_KV_ADDRESS}, skipping the shared store")
+
+    results = {}
+    for name, store in stores.items():
+        results[name] = run(store, args.checks)
+        stats = results[name]
+        verdict = 'within' if stats['p99_ms'] * 1000 < BUDGET_US else 'over'
+        print(f"{name:>7}: mean={stats['mean_us']}µs p50={stats['p50_ms'] * 1000:.1f}µs "
+              f"p99={stats['p99_ms'] * 1000:.1f}µs ({verdict} the {BUDGET_US}µs budget)")
+    if args.output:
+        write_results(args.output, 'ratelimit', results, vars(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# Render time per route with page and fragment caching off and on.
+#
+#   python -m benchmarks.render_bench --requests 2000
+#
+# Anonymous pages go through the test client. The dashboard needs a
+# database to load its data, so it is rendered directly with a sample
+# account summary, which times the same template work.
+import argparse
+import time
+from flask import render_template, session
+from config import Config
+from benchmarks.common import summarize, write_results
+import pagecache
+from app import app
+
+ROUTES = ('/', '/about', '/login', '/register')
+
+SAMPLE_SUMMARY = {
+    'balance': 12500050,
+    'recent': [
+        {'id': n, 'date': '18 Oct 2026', 'type': 'deposit', 'amount': 50000,
+         'description': 'Deposited ₹500.00', 'incoming': True}
+        for n in range(5)
+    ],
+    'month_in': 250000,
+    'month_out': 120000,
+}
+
+
+def time_route(client, path, requests):
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        client.get(path)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def time_dashboard(requests):
+    samples = []
+    for _ in range(requests):
+        with app.test_request_context('/dashboard'):
+            session['user_id'] = 1
+            session['username'] = 'bench'
+            start = time.perf_counter()
+            render_template('dashboard.html', username='bench',
+                            balance=SAMPLE_SUMMARY['balance'], summary=SAMPLE_SUMMARY)
+            samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def run(requests):
+    client = app.test_client()
+    results = {path: time_route(client, path, requests) for path in ROUTES}
+    results['dashboard.html'] = time_dashboard(requests)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    results = {}
+    for mode, enabled in (('uncached', False), ('cached', True)):
+        Config.PAGE_CACHE = enabled
+        pagecache.clear()
+        results[mode] = run(args.requests)
+
+    print(f"{'route':<16}{'uncached p50':>14}{'cached p50':>12}{'uncached p99':>14}{'cached p99':>12}")
+    for route in results['uncached']:
+        before, after = results['uncached'][route], results['cached'][route]
+        print(f"{route:<16}{before['p50_ms']:>14}{after['p50_ms']:>12}{before['p99_ms']:>14}{after['p99_ms']:>12}")
+    stats = pagecache.stats()
+    print(f"templates precompiled at boot: {stats['templates_compiled']} in {stats.get('warm_up_ms')}ms")
+    if args.output:
+        write_results(args.output, 'render', results, vars(args))
+
+
+if __name__ == '__main__':
+    main()
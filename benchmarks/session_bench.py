@@ -0,0 +1,84 @@
+# Dashboard latency with cookie sessions vs server-side sessions.
+#
+#   MYSQL_DB=janseva_bench python -m benchmarks.loadtest seed --users 100
+#   python kvstore.py --address /tmp/janseva-kv.sock &
+#   SESSION_KV_ADDRESS=/tmp/janseva-kv.sock MYSQL_DB=janseva_bench \
+#       python -m benchmarks.session_bench --requests 2000 --write-every 50
+#
+# Runs the app in-process through Flask's test client, logs in as a seeded
+# user and times GET /dashboard with each session backend. --write-every
+# makes every Nth request a deposit, so cached account state keeps being
+# invalidated the way it is under real traffic. The shared backend is
+# skipped if the kvstore server is not running.
+import argparse
+import time
+from flask.sessions import SecureCookieSessionInterface
+from config import Config
+from kvstore import KVClient, KVError
+from benchmarks.common import summarize, write_results
+from benchmarks.loadtest import PASSWORD
+import metrics
+import sessions
+from app import app
+
+
+def sql_statements():
+    return sum(metrics.SQL_STATEMENTS_TOTAL._values.values())
+
+
+def run(backend, username, requests, write_every):
+    Config.SESSION_BACKEND = backend
+    sessions._store = None
+    if backend == 'cookie':
+        app.session_interface = SecureCookieSessionInterface()
+    else:
+        app.session_interface = sessions.ServerSideSessionInterface()
+
+    client = app.test_client()
+    response = client.post('/login', data={'username': username, 'password': PASSWORD})
+    if response.status_code != 302:
+        raise SystemExit(f'Login as {username} failed')
+
+    latencies = []
+    statements = sql_statements()
+    started = time.perf_counter()
+    for number in range(1, requests + 1):
+        if write_every and number % write_every == 0:
+            client.post('/deposit', data={'amount': '1.00'})
+            continue
+        start = time.perf_counter()
+        client.get('/dashboard')
+        latencies.append(time.perf_counter() - start)
+    elapsed = time.perf_counter() - started
+    summary = summarize(latencies, elapsed)
+    summary['sql_per_request'] = round((sql_statements() - statements) / requests, 2)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--username', default='load_0')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--write-every', type=int, default=0, help='make every Nth request a deposit')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    backends = ['cookie', 'local']
+    try:
+        KVClient(Config.SESSION_KV_ADDRESS).call('ping')
+        backends.append('shared')
+    except KVError:
+        print(f"kvstore not reachable at {Config.SESSION_KV_ADDRESS}, skipping the shared backend")
+
+    results = {}
+    for backend in backends:
+        results[backend] = run(backend, args.username, args.requests, args.write_every)
+        stats = results[backend]
+        print(f"{backend:>7}: {stats['throughput']:>8} req/s  p50={stats['p50_ms']}ms "
+              f"p99={stats['p99_ms']}ms  sql/request={stats['sql_per_request']}")
+    if args.output:
+        write_results(args.output, 'sessions', results, vars(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+# Worker boot time: how long a fresh interpreter takes to import the app.
+#
+#   python -m benchmarks.startup_bench --runs 20
+#   python -m benchmarks.startup_bench --runs 20 --unreachable-db
+#
+# Each run imports app in a new process, the way a gunicorn worker (or a
+# script importing the app) does. With --unreachable-db, MYSQL_HOST points
+# at an address that drops packets; import time should not change, because
+# nothing connects to the database until the first request.
+import argparse
+import os
+import subprocess
+import sys
+import time
+from benchmarks.common import summarize, write_results
+
+IMPORT_APP = 'import time; start = time.perf_counter(); import app; print(time.perf_counter() - start)'
+
+# TEST-NET-1 address; connections to it hang instead of being refused
+UNREACHABLE_HOST = '192.0.2.1'
+
+
+def run(runs, env):
+    import_times = []
+    process_times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, '-c', IMPORT_APP], env=env, capture_output=True, text=True, check=True
+        )
+        process_times.append(time.perf_counter() - start)
+        import_times.append(float(result.stdout.strip().splitlines()[-1]))
+    return {'import': summarize(import_times), 'process': summarize(process_times)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--unreachable-db', action='store_true')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    if args.unreachable_db:
+        env['MYSQL_HOST'] = UNREACHABLE_HOST
+    results = run(args.runs, env)
+    for name, stats in results.items():
+        print(f"{name:>8}: p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms p99={stats['p99_ms']}ms")
+    if args.output:
+        write_results(args.output, 'startup', results, vars(args))
+
+
+if __name__ == '__main__':
+    main()
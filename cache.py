@@ -0,0 +1,310 @@
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from mysql.connector import Error
+from config import Config
+import aiodb
+from db import get_read_connection, pin_primary
+from kvstore import KVClient, KVError
+from sessions import mark_accounts_written
+
+
+# In-process LRU with a per-entry TTL. Each gunicorn worker has its own copy.
+class LocalBackend:
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if item[1] <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return item[0]
+
+    def mget(self, *keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def mset(self, items, ttl):
+        for key, value in items.items():
+            self.set(key, value, ttl)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+
+# Backed by the kvstore server, so every worker sees the same entries and
+# invalidations. An unreachable store behaves like an empty cache.
+class SharedBackend:
+    def __init__(self, address=None):
+        self.client = KVClient(address)
+        self.errors = 0
+
+    def get(self, key):
+        try:
+            return self.client.get(key)
+        except KVError:
+            self.errors += 1
+            return None
+
+    def mget(self, *keys):
+        try:
+            return self.client.mget(*keys)
+        except KVError:
+            self.errors += 1
+            return [None] * len(keys)
+
+    def set(self, key, value, ttl):
+        try:
+            self.client.set(key, value, ttl)
+        except KVError:
+            self.errors += 1
+
+    def mset(self, items, ttl):
+        try:
+            self.client.mset(items, ttl)
+        except KVError:
+            self.errors += 1
+
+    def delete(self, *keys):
+        try:
+            self.client.delete(*keys)
+        except KVError:
+            self.errors += 1
+
+
+# Read-through cache of per-user account summaries. Values are kept
+# JSON-serialisable so that any backend can hold them.
+#
+# Every invalidation gives the user a new generation, and entries are stored
+# with the generation that was current before their loader ran. An entry
+# whose generation is no longer current is a miss, so a loader that read the
+# balance before a ledger commit (or from a lagging replica) cannot put it
+# back in the cache after that commit's invalidation.
+class AccountCache:
+    def __init__(self, backend, ttl=30):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.stale = 0
+
+    # v3: entries are [generation, summary]; v2 entries (amounts in paise,
+    # no generation) are simply left to expire
+    @staticmethod
+    def _key(user_id):
+        return f'account:v3:{user_id}'
+
+    @staticmethod
+    def _generation_key(user_id):
+        return f'account:gen:{user_id}'
+
+    def _lookup(self, user_id):
+        entry, generation = self.backend.mget(self._key(user_id), self._generation_key(user_id))
+        if entry is not None:
+            if entry[0] == generation:
+                self.hits += 1
+                return entry[1], generation
+            self.stale += 1
+        self.misses += 1
+        return None, generation
+
+    def _store(self, user_id, generation, summary):
+        if summary is not None:
+            self.backend.set(self._key(user_id), [generation, summary], self.ttl)
+
+    def get(self, user_id, loader):
+        summary, generation = self._lookup(user_id)
+        if summary is not None:
+            return summary
+        summary = loader()
+        self._store(user_id, generation, summary)
+        return summary
+
+    # get() with a coroutine function as the loader
+    async def get_async(self, user_id, loader):
+        summary, generation = self._lookup(user_id)
+        if summary is not None:
+            return summary
+        summary = await loader()
+        self._store(user_id, generation, summary)
+        return summary
+
+    # The cached summary, or None; never loads
+    def peek(self, user_id):
+        return self._lookup(user_id)[0]
+
+    def invalidate(self, *user_ids):
+        self.invalidations += len(user_ids)
+        # Outlives every entry stored under the previous generation
+        self.backend.mset({self._generation_key(user_id): secrets.token_hex(8) for user_id in user_ids},
+                          2 * self.ttl)
+        self.backend.delete(*[self._key(user_id) for user_id in user_ids])
+
+    def stats(self):
+        stats = {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'stale': self.stale,
+            'db_reads_saved': self.hits,
+        }
+        for name in ('evictions', 'errors'):
+            if hasattr(self.backend, name):
+                stats[name] = getattr(self.backend, name)
+        return stats
+
+
+SUMMARY_BALANCE = "SELECT balance FROM users WHERE id = %s"
+
+SUMMARY_RECENT = (
+    "SELECT id, type, direction, amount, description, DATE_FORMAT(created_at, '%%d %%b %%Y') AS date "
+    "FROM transactions WHERE user_id = %s ORDER BY created_at DESC, id DESC LIMIT %s"
+)
+
+# Incoming money is deposits and transfers received from others
+SUMMARY_MONTH = """
+    SELECT
+        CAST(COALESCE(SUM(CASE WHEN direction = 'credit' THEN amount END), 0) AS SIGNED) AS money_in,
+        CAST(COALESCE(SUM(CASE WHEN direction = 'debit' THEN amount END), 0) AS SIGNED) AS money_out
+    FROM transactions
+    WHERE user_id = %s AND created_at >= %s
+"""
+
+
+def load_account_summary(connection, user_id):
+    cursor = connection.cursor(dictionary=True, buffered=True)
+    try:
+        cursor.execute(SUMMARY_BALANCE, (user_id,))
+        user = cursor.fetchone()
+        if not user:
+            return None
+        cursor.execute(SUMMARY_RECENT, (user_id, Config.ACCOUNT_SUMMARY_RECENT))
+        recent = cursor.fetchall()
+        cursor.execute(SUMMARY_MONTH, (user_id, date.today().replace(day=1)))
+        month = cursor.fetchone()
+    finally:
+        cursor.close()
+    return _summary(user, recent, month)
+
+
+# load_account_summary() on a mysql.connector.aio connection
+async def load_account_summary_async(connection, user_id):
+    cursor = await connection.cursor(dictionary=True)
+    try:
+        await cursor.execute(SUMMARY_BALANCE, (user_id,))
+        users = await cursor.fetchall()
+        if not users:
+            return None
+        await cursor.execute(SUMMARY_RECENT, (user_id, Config.ACCOUNT_SUMMARY_RECENT))
+        recent = await cursor.fetchall()
+        await cursor.execute(SUMMARY_MONTH, (user_id, date.today().replace(day=1)))
+        month = (await cursor.fetchall())[0]
+    finally:
+        await cursor.close()
+    return _summary(users[0], recent, month)
+
+
+def _summary(user, recent, month):
+    return {
+        'balance': user['balance'],
+        'recent': [
+            {
+                'id': txn['id'],
+                'date': txn['date'],
+                'type': txn['type'],
+                'amount': txn['amount'],
+                'description': txn['description'],
+                'incoming': txn['direction'] == 'credit',
+            }
+            for txn in recent
+        ],
+        'month_in': month['money_in'],
+        'month_out': month['money_out'],
+    }
+
+
+_cache = None
+_cache_pid = None
+_cache_lock = threading.Lock()
+
+
+def get_account_cache():
+    global _cache, _cache_pid
+    pid = os.getpid()
+    if _cache is None or _cache_pid != pid:
+        with _cache_lock:
+            if _cache is None or _cache_pid != pid:
+                if Config.ACCOUNT_CACHE_BACKEND == 'shared':
+                    backend = SharedBackend()
+                else:
+                    backend = LocalBackend(Config.ACCOUNT_CACHE_MAX_ENTRIES)
+                _cache = AccountCache(backend, Config.ACCOUNT_CACHE_TTL)
+                _cache_pid = pid
+    return _cache
+
+
+# Balance, recent transactions and this month's totals for the dashboard and
+# the money forms. Returns None if the database is unavailable.
+def get_account_summary(user_id):
+    def loader():
+        connection = get_read_connection(user_id)
+        if not connection:
+            return None
+        try:
+            return load_account_summary(connection, user_id)
+        except Error as e:
+            print(f"Error loading account summary: {e}")
+            return None
+        finally:
+            connection.close()
+
+    return get_account_cache().get(user_id, loader)
+
+
+# get_account_summary() for the ASGI app
+async def get_account_summary_async(user_id):
+    async def loader():
+        connection = await aiodb.get_db_connection()
+        if not connection:
+            return None
+        try:
+            return await load_account_summary_async(connection, user_id)
+        except Error as e:
+            print(f"Error loading account summary: {e}")
+            return None
+        finally:
+            await connection.close()
+
+    return await get_account_cache().get_async(user_id, loader)
+
+
+# The summary if the account cache holds one, without going to the database
+def peek_account_summary(user_id):
+    return get_account_cache().peek(user_id)
+
+
+def invalidate_accounts(*user_ids):
+    get_account_cache().invalidate(*user_ids)
+    mark_accounts_written(*user_ids)
+    pin_primary(*user_ids)
@@ -2,8 +2,104 @@ import os
 
 class Config:
     SECRET_KEY = 'India@12345'
-    MYSQL_HOST = 'localhost'
-    MYSQL_USER = 'root'
-    MYSQL_PASSWORD = 'India@12345'
-    MYSQL_DB = 'janseva_bank'
-    MYSQL_CURSORCLASS = 'DictCursor'
\ No newline at end of file
+    MYSQL_HOST = os.environ.get('MYSQL_HOST', 'localhost')
+    MYSQL_PORT = int(os.environ.get('MYSQL_PORT', 3306))
+    MYSQL_USER = os.environ.get('MYSQL_USER', 'root')
+    MYSQL_PASSWORD = os.environ.get('MYSQL_PASSWORD', 'India@12345')
+    MYSQL_DB = os.environ.get('MYSQL_DB', 'janseva_bank')
+    MYSQL_CURSORCLASS = 'DictCursor'
+    MYSQL_POOL_SIZE = int(os.environ.get('MYSQL_POOL_SIZE', 5))
+    MYSQL_POOL_TIMEOUT = float(os.environ.get('MYSQL_POOL_TIMEOUT', 5))
+    MYSQL_POOL_RECYCLE = int(os.environ.get('MYSQL_POOL_RECYCLE', 3600))
+    MYSQL_POOL_PING_AFTER = int(os.environ.get('MYSQL_POOL_PING_AFTER', 30))
+    LEDGER_MAX_RETRIES = int(os.environ.get('LEDGER_MAX_RETRIES', 3))
+    LEDGER_RETRY_BACKOFF = float(os.environ.get('LEDGER_RETRY_BACKOFF', 0.01))
+    HISTORY_PAGE_SIZE = int(os.environ.get('HISTORY_PAGE_SIZE', 50))
+    # 'local' keeps a cache per worker process; use 'shared' (served by
+    # kvstore.py) when running several gunicorn workers
+    ACCOUNT_CACHE_BACKEND = os.environ.get('ACCOUNT_CACHE_BACKEND', 'local')
+    ACCOUNT_CACHE_TTL = int(os.environ.get('ACCOUNT_CACHE_TTL', 30))
+    ACCOUNT_CACHE_MAX_ENTRIES = int(os.environ.get('ACCOUNT_CACHE_MAX_ENTRIES', 10000))
+    ACCOUNT_SUMMARY_RECENT = 5
+    KV_ADDRESS = os.environ.get('KV_ADDRESS', '127.0.0.1:7379')
+    BATCH_MAX_ROWS = int(os.environ.get('BATCH_MAX_ROWS', 100000))
+    BATCH_CHUNK_SIZE = int(os.environ.get('BATCH_CHUNK_SIZE', 1000))
+    # Password hashing runs on a process pool; 0 workers hashes inline
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_QUEUE_DEPTH = int(os.environ.get('PASSWORD_HASH_QUEUE_DEPTH', 8))
+    PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 5))
+    # Statements slower than this are logged; 0 turns the slow-query log off
+    SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+    # Group commit for deposits: off by default
+    DEPOSIT_GROUP_COMMIT = os.environ.get('DEPOSIT_GROUP_COMMIT', '0') == '1'
+    GROUP_COMMIT_MAX_BATCH = int(os.environ.get('GROUP_COMMIT_MAX_BATCH', 200))
+    GROUP_COMMIT_INTERVAL_MS = float(os.environ.get('GROUP_COMMIT_INTERVAL_MS', 5))
+    GROUP_COMMIT_QUEUE_SIZE = int(os.environ.get('GROUP_COMMIT_QUEUE_SIZE', 10000))
+    GROUP_COMMIT_TIMEOUT = float(os.environ.get('GROUP_COMMIT_TIMEOUT', 10))
+    SNAPSHOT_CHUNK_SIZE = int(os.environ.get('SNAPSHOT_CHUNK_SIZE', 10000))
+    SNAPSHOT_LAG_SECONDS = int(os.environ.get('SNAPSHOT_LAG_SECONDS', 60))
+    # Lifetime of tokens issued by /api/v1/tokens
+    API_TOKEN_TTL = int(os.environ.get('API_TOKEN_TTL', 86400))
+    # Username directory for transfers and autocomplete
+    DIRECTORY_NEGATIVE_TTL = int(os.environ.get('DIRECTORY_NEGATIVE_TTL', 30))
+    DIRECTORY_NEGATIVE_MAX_ENTRIES = int(os.environ.get('DIRECTORY_NEGATIVE_MAX_ENTRIES', 10000))
+    AUTOCOMPLETE_LIMIT = 10
+    # 'cookie' keeps Flask's signed cookie sessions. 'local' stores sessions
+    # in the worker process (single worker only); 'shared' stores them in
+    # kvstore.py so that every worker sees them.
+    SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'cookie')
+    SESSION_KV_ADDRESS = os.environ.get('SESSION_KV_ADDRESS', KV_ADDRESS)
+    SESSION_TTL = int(os.environ.get('SESSION_TTL', 1800))
+    SESSION_SWEEP_INTERVAL = int(os.environ.get('SESSION_SWEEP_INTERVAL', 60))
+    SESSION_ACCOUNT_TTL = int(os.environ.get('SESSION_ACCOUNT_TTL', 30))
+    # Read replicas as "host:port[*weight],..."; empty sends every read to
+    # the primary
+    MYSQL_REPLICAS = os.environ.get('MYSQL_REPLICAS', '')
+    MYSQL_REPLICA_POOL_SIZE = int(os.environ.get('MYSQL_REPLICA_POOL_SIZE', MYSQL_POOL_SIZE))
+    MYSQL_REPLICA_MAX_LAG = int(os.environ.get('MYSQL_REPLICA_MAX_LAG', 2))
+    MYSQL_REPLICA_CHECK_INTERVAL = float(os.environ.get('MYSQL_REPLICA_CHECK_INTERVAL', 5))
+    MYSQL_PRIMARY_PIN_SECONDS = float(os.environ.get('MYSQL_PRIMARY_PIN_SECONDS', 5))
+    # Cache rendered static pages and layout fragments in each worker
+    PAGE_CACHE = os.environ.get('PAGE_CACHE', '1') == '1'
+    TEMPLATE_WARM_UP = os.environ.get('TEMPLATE_WARM_UP', '1') == '1'
+    # Token buckets for POSTs, as (requests, seconds) per client IP and per
+    # logged-in user. The RATE_LIMITS variable overrides them: 'off' turns
+    # every bucket off, or e.g. 'login=100/60,register=off' per endpoint.
+    RATE_LIMITS = {
+        'login': (10, 60),
+        'register': (5, 300),
+        'deposit': (30, 60),
+        'withdraw': (30, 60),
+        'transfer': (30, 60),
+        'transfer_batch': (5, 60),
+        'api.create_token': (10, 60),
+        'api.deposit': (30, 60),
+        'api.withdraw': (30, 60),
+        'api.transfer': (30, 60),
+    }
+    RATE_LIMIT_OVERRIDES = os.environ.get('RATE_LIMITS', '')
+    # 'local' keeps buckets per worker; 'shared' keeps them in kvstore.py
+    RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'local')
+    RATE_LIMIT_KV_ADDRESS = os.environ.get('RATE_LIMIT_KV_ADDRESS', KV_ADDRESS)
+    # Rate-limited requests a worker handles at once; more are shed with a
+    # 503. 0 turns the cap off.
+    MAX_INFLIGHT = int(os.environ.get('MAX_INFLIGHT', 16))
+    # Transactions older than this are moved to transactions_archive by archive.py
+    ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 365))
+    ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 1000))
+    # Idempotency keys: how long a key is remembered, how many recent results
+    # each worker keeps in memory, and how many keys its bloom filter covers
+    IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL', 86400))
+    IDEMPOTENCY_RECENT_KEYS = int(os.environ.get('IDEMPOTENCY_RECENT_KEYS', 10000))
+    IDEMPOTENCY_BLOOM_CAPACITY = int(os.environ.get('IDEMPOTENCY_BLOOM_CAPACITY', 1000000))
+    IDEMPOTENCY_SWEEP_BATCH = int(os.environ.get('IDEMPOTENCY_SWEEP_BATCH', 5000))
+    # reconcile.py: processes, and users per chunk (one snapshot each)
+    RECONCILE_WORKERS = int(os.environ.get('RECONCILE_WORKERS', 4))
+    RECONCILE_CHUNK_SIZE = int(os.environ.get('RECONCILE_CHUNK_SIZE', 5000))
+    # Connections per worker of the ASGI app (asgi.py); one connection serves
+    # a request only while it is talking to MySQL, so fewer are needed per
+    # concurrent user than with sync workers
+    MYSQL_ASYNC_POOL_SIZE = int(os.environ.get('MYSQL_ASYNC_POOL_SIZE', 20))
+    # Largest request body asgi.py passes on to the Flask app (batch CSVs)
+    ASGI_MAX_BODY_SIZE = int(os.environ.get('ASGI_MAX_BODY_SIZE', 16 * 1024 * 1024))
@@ -0,0 +1,401 @@
+import os
+import random
+import threading
+import time
+import mysql.connector
+from flask import has_request_context, session
+from mysql.connector import Error
+from config import Config
+import metrics
+
+
+class PoolTimeout(Error):
+    pass
+
+
+# Wraps a raw connection so that close() hands it back to the pool
+class PooledConnection:
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def cursor(self, *args, **kwargs):
+        return metrics.InstrumentedCursor(self._raw.cursor(*args, **kwargs))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        if self._raw is not None:
+            raw, self._raw = self._raw, None
+            self._pool.release(raw)
+
+    def discard(self):
+        # Drop a connection that is known to be broken instead of reusing it
+        if self._raw is not None:
+            raw, self._raw = self._raw, None
+            self._pool.release(raw, broken=True)
+
+
+# Thread-safe connection pool, one per worker process
+class ConnectionPool:
+    def __init__(self, connect, size=5, timeout=5.0, recycle=3600, ping_after=30):
+        self._connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+        self._idle = []
+        self._created_at = {}
+        self._last_used = {}
+        self._open = 0
+        self._cond = threading.Condition()
+        self.metrics = {
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'connects': 0,
+            'recycled': 0,
+            'ping_failures': 0,
+        }
+
+    def _new_connection(self):
+        raw = self._connect()
+        now = time.monotonic()
+        self._created_at[id(raw)] = now
+        self._last_used[id(raw)] = now
+        with self._cond:
+            self.metrics['connects'] += 1
+        return raw
+
+    def _forget(self, raw):
+        self._created_at.pop(id(raw), None)
+        self._last_used.pop(id(raw), None)
+        try:
+            raw.close()
+        except Error:
+            pass
+
+    # Returns True if an idle connection can be handed out as-is
+    def _is_usable(self, raw):
+        now = time.monotonic()
+        if self.recycle and now - self._created_at.get(id(raw), now) > self.recycle:
+            with self._cond:
+                self.metrics['recycled'] += 1
+            return False
+        if now - self._last_used.get(id(raw), now) > self.ping_after:
+            # Only pay for a round trip when the connection has been idle a while
+            try:
+                raw.ping(reconnect=False)
+            except Error:
+                with self._cond:
+                    self.metrics['ping_failures'] += 1
+                return False
+        return True
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            self.metrics['checkouts'] += 1
+            waited = False
+            while not self._idle and self._open >= self.size:
+                if not waited:
+                    self.metrics['waits'] += 1
+                    waited = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.metrics['timeouts'] += 1
+                    raise PoolTimeout(msg='Timed out waiting for a database connection')
+                self._cond.wait(remaining)
+            raw = self._idle.pop() if self._idle else None
+            self._open += 1
+
+        try:
+            while raw is not None and not self._is_usable(raw):
+                self._forget(raw)
+                with self._cond:
+                    raw = self._idle.pop() if self._idle else None
+            if raw is None:
+                raw = self._new_connection()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+        return PooledConnection(self, raw)
+
+    def release(self, raw, broken=False):
+        if not broken:
+            try:
+                # Never hand an open transaction to the next request
+                if raw.in_transaction:
+                    raw.rollback()
+            except Error:
+                broken = True
+        if broken:
+            self._forget(raw)
+        else:
+            self._last_used[id(raw)] = time.monotonic()
+        with self._cond:
+            self._open -= 1
+            if not broken:
+                self._idle.append(raw)
+            self._cond.notify()
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for raw in idle:
+            self._forget(raw)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self.metrics)
+            stats['size'] = self.size
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._open
+        return stats
+
+
+def _connect(host=None, port=None):
+    return mysql.connector.connect(
+        host=host or Config.MYSQL_HOST,
+        port=port or Config.MYSQL_PORT,
+        user=Config.MYSQL_USER,
+        password=Config.MYSQL_PASSWORD,
+        database=Config.MYSQL_DB
+    )
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+# The pool is created lazily and re-created after a fork, so gunicorn
+# workers never share sockets inherited from the master process
+def get_pool():
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                _pool = ConnectionPool(
+                    _connect,
+                    size=Config.MYSQL_POOL_SIZE,
+                    timeout=Config.MYSQL_POOL_TIMEOUT,
+                    recycle=Config.MYSQL_POOL_RECYCLE,
+                    ping_after=Config.MYSQL_POOL_PING_AFTER
+                )
+                _pool_pid = pid
+    return _pool
+
+
+# Helper function to get database connection
+def get_db_connection():
+    start = time.perf_counter()
+    try:
+        return get_pool().acquire()
+    except Error as e:
+        print(f"Error connecting to MySQL: {e}")
+        return None
+    finally:
+        metrics.record_acquire(time.perf_counter() - start)
+
+
+# Read replicas.
+#
+# MYSQL_REPLICAS lists replica endpoints as "host:port" or "host:port*weight",
+# comma separated. Reads that can tolerate a little lag (dashboard, history,
+# statements) go through get_read_connection(), which picks a healthy replica
+# by weight and falls back to the primary. A background thread checks every
+# replica each MYSQL_REPLICA_CHECK_INTERVAL seconds and takes it out of
+# rotation while it is unreachable, its replication is stopped or it lags
+# more than MYSQL_REPLICA_MAX_LAG seconds. A server that is not replicating
+# at all counts as up to date, so a second stand-alone MySQL on another port
+# works as a replica for local testing.
+#
+# After a ledger write the accounts involved read from the primary for
+# MYSQL_PRIMARY_PIN_SECONDS (longer than the lag a healthy replica may
+# have), so a user always sees their own writes. The pin is kept per worker
+# and, for the logged-in user, in the session, so it follows them to
+# whichever worker serves their next request.
+class Replica:
+    def __init__(self, host, port, weight=1):
+        self.host = host
+        self.port = port
+        self.weight = weight
+        self.healthy = True
+        self.lag = None
+        self.pool = ConnectionPool(
+            lambda: _connect(host, port),
+            size=Config.MYSQL_REPLICA_POOL_SIZE,
+            timeout=Config.MYSQL_POOL_TIMEOUT,
+            recycle=Config.MYSQL_POOL_RECYCLE,
+            ping_after=Config.MYSQL_POOL_PING_AFTER
+        )
+
+    @property
+    def name(self):
+        return f'{self.host}:{self.port}'
+
+    # Seconds behind the primary, 0 for a server that is not a replica, or
+    # None when replication is broken
+    def check_lag(self):
+        connection = self.pool.acquire()
+        try:
+            cursor = connection.cursor(dictionary=True, buffered=True)
+            try:
+                cursor.execute("SHOW REPLICA STATUS")
+            except Error:
+                # Servers before 8.0.22
+                cursor.execute("SHOW SLAVE STATUS")
+            row = cursor.fetchone()
+            cursor.close()
+        except Error:
+            connection.discard()
+            raise
+        connection.close()
+        if row is None:
+            return 0
+        lag = row.get('Seconds_Behind_Source', row.get('Seconds_Behind_Master'))
+        return int(lag) if lag is not None else None
+
+
+def parse_replicas(value):
+    replicas = []
+    for entry in filter(None, (part.strip() for part in (value or '').split(','))):
+        address, _, weight = entry.partition('*')
+        host, _, port = address.rpartition(':')
+        replicas.append(((host or address).strip('[]'), int(port) if host else Config.MYSQL_PORT, int(weight or 1)))
+    return replicas
+
+
+class ReplicaRouter:
+    def __init__(self, replicas, max_lag=2, check_interval=5, pin_seconds=5):
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.pin_seconds = pin_seconds
+        self._pins = {}
+        self._lock = threading.Lock()
+        self.metrics = {
+            'primary_reads': 0,
+            'replica_reads': 0,
+            'pinned_reads': 0,
+            'fallbacks': 0,
+            'failed_checks': 0,
+        }
+        if replicas:
+            threading.Thread(target=self._check_loop, name='replica-check', daemon=True).start()
+
+    def _check_loop(self):
+        while True:
+            self.check()
+            time.sleep(self.check_interval)
+
+    def check(self):
+        for replica in self.replicas:
+            try:
+                replica.lag = replica.check_lag()
+                replica.healthy = replica.lag is not None and replica.lag <= self.max_lag
+            except Error:
+                replica.lag = None
+                replica.healthy = False
+            if not replica.healthy:
+                self.metrics['failed_checks'] += 1
+
+    def choose(self):
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        return random.choices(healthy, [replica.weight for replica in healthy])[0]
+
+    def pin(self, *user_ids):
+        until = time.time() + self.pin_seconds
+        with self._lock:
+            for user_id in user_ids:
+                self._pins[user_id] = until
+            if len(self._pins) > 10000:
+                now = time.time()
+                self._pins = {key: value for key, value in self._pins.items() if value > now}
+        if has_request_context() and session.get('user_id') in user_ids:
+            session['_primary_until'] = until
+
+    def is_pinned(self, user_id):
+        now = time.time()
+        if self._pins.get(user_id, 0) > now:
+            return True
+        return (has_request_context() and session.get('user_id') == user_id
+                and session.get('_primary_until', 0) > now)
+
+    def acquire(self, user_id=None):
+        if not self.replicas:
+            self.metrics['primary_reads'] += 1
+            return get_pool().acquire()
+        if user_id is not None and self.is_pinned(user_id):
+            self.metrics['pinned_reads'] += 1
+            return get_pool().acquire()
+        replica = self.choose()
+        if replica is not None:
+            try:
+                connection = replica.pool.acquire()
+                self.metrics['replica_reads'] += 1
+                return connection
+            except Error as e:
+                print(f"Replica {replica.name} unavailable: {e}")
+                replica.healthy = False
+        self.metrics['fallbacks'] += 1
+        return get_pool().acquire()
+
+    def stats(self):
+        stats = dict(self.metrics)
+        stats['replicas'] = len(self.replicas)
+        stats['healthy_replicas'] = sum(1 for replica in self.replicas if replica.healthy)
+        return stats
+
+
+_router = None
+_router_pid = None
+_router_lock = threading.Lock()
+
+
+def get_router():
+    global _router, _router_pid
+    pid = os.getpid()
+    if _router is None or _router_pid != pid:
+        with _router_lock:
+            if _router is None or _router_pid != pid:
+                _router = ReplicaRouter(
+                    [Replica(*replica) for replica in parse_replicas(Config.MYSQL_REPLICAS)],
+                    max_lag=Config.MYSQL_REPLICA_MAX_LAG,
+                    check_interval=Config.MYSQL_REPLICA_CHECK_INTERVAL,
+                    pin_seconds=Config.MYSQL_PRIMARY_PIN_SECONDS
+                )
+                _router_pid = pid
+    return _router
+
+
+# Connection for reads that may come from a replica. Pass the id of the
+# account being read so that it stays on the primary right after a write.
+def get_read_connection(user_id=None):
+    start = time.perf_counter()
+    try:
+        return get_router().acquire(user_id)
+    except Error as e:
+        print(f"Error connecting to MySQL: {e}")
+        return None
+    finally:
+        metrics.record_acquire(time.perf_counter() - start)
+
+
+# Send reads of these accounts to the primary for a while after a write
+def pin_primary(*user_ids):
+    if Config.MYSQL_REPLICAS and user_ids:
+        get_router().pin(*user_ids)
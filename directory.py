@@ -0,0 +1,231 @@
+# In-memory username -> id directory used to resolve transfer receivers and
+# to autocomplete usernames.
+#
+# Usernames are never renamed or deleted, so an entry, once loaded, stays
+# correct. The directory is loaded from the users table by a background
+# thread started on first use, and new registrations in this worker are
+# added as they happen; until the load has finished, lookups and
+# autocomplete go to the database. A name that is not in the directory is
+# looked up in the database (it may have been registered through another
+# worker) and, if it does not exist, remembered as unknown for
+# DIRECTORY_NEGATIVE_TTL seconds so that repeated typos cost no query.
+#
+# users.username compares case-insensitively, so names are keyed by their
+# casefolded form and always resolve to the spelling stored in the table.
+import bisect
+import os
+import threading
+import time
+from collections import OrderedDict
+from mysql.connector import Error
+from config import Config
+from db import get_db_connection
+
+LOAD_BATCH_SIZE = 10000
+# Seconds before a failed background load is tried again
+LOAD_RETRY_SECONDS = 30
+
+LOOKUP_QUERY = "SELECT id, username FROM users WHERE username = %s"
+PREFIX_QUERY = "SELECT username FROM users WHERE username LIKE %s ORDER BY username LIMIT %s"
+
+
+class UserDirectory:
+    def __init__(self, negative_ttl=30, negative_max_entries=10000):
+        self.negative_ttl = negative_ttl
+        self.negative_max_entries = negative_max_entries
+        self.loaded = False
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        # casefolded username -> (id, stored username)
+        self._ids = {}
+        # Sorted casefolded usernames for prefix search
+        self._names = []
+        self._negative = OrderedDict()
+        self._lock = threading.RLock()
+        self._loading = False
+        self._load_failed_at = None
+
+    def load(self, connection):
+        ids = {}
+        cursor = connection.cursor()
+        try:
+            cursor.execute("SELECT id, username FROM users")
+            while True:
+                rows = cursor.fetchmany(LOAD_BATCH_SIZE)
+                if not rows:
+                    break
+                for user_id, username in rows:
+                    ids[username.casefold()] = (user_id, username)
+        finally:
+            cursor.close()
+        with self._lock:
+            # Keep names added while the load was running
+            ids.update(self._ids)
+            self._ids = ids
+            self._names = sorted(ids)
+            self.loaded = True
+
+    def add(self, user_id, username):
+        folded = username.casefold()
+        with self._lock:
+            self._negative.pop(folded, None)
+            if folded not in self._ids:
+                self._ids[folded] = (user_id, username)
+                bisect.insort(self._names, folded)
+
+    def _is_known_missing(self, folded):
+        with self._lock:
+            expires = self._negative.get(folded)
+            if expires is None:
+                return False
+            if expires <= time.monotonic():
+                del self._negative[folded]
+                return False
+            return True
+
+    def _remember_missing(self, folded):
+        with self._lock:
+            self._negative[folded] = time.monotonic() + self.negative_ttl
+            self._negative.move_to_end(folded)
+            while len(self._negative) > self.negative_max_entries:
+                self._negative.popitem(last=False)
+
+    # The (id, username) known for a name without a query; found is False
+    # when the database has to be asked
+    def _known(self, username):
+        folded = username.casefold()
+        entry = self._ids.get(folded)
+        if entry is not None:
+            self.hits += 1
+            return True, entry
+        if self._is_known_missing(folded):
+            self.negative_hits += 1
+            return True, None
+        self.misses += 1
+        return False, None
+
+    def _learn(self, username, row):
+        if row is None:
+            self._remember_missing(username.casefold())
+            return None
+        self.add(*row)
+        return row
+
+    # (id, stored username) for a username, or None if there is no such
+    # user. Runs a query only on a miss, on the given connection or a pooled
+    # one.
+    def resolve(self, username, connection=None):
+        self._start_loading()
+        found, entry = self._known(username)
+        if found:
+            return entry
+        return self._learn(username, self._query(username, connection))
+
+    # resolve() for the ASGI app, on a mysql.connector.aio connection. The
+    # bulk load runs on its own thread, so it does not hold up the event loop.
+    async def resolve_async(self, username, connection):
+        self._start_loading()
+        found, entry = self._known(username)
+        if found:
+            return entry
+        cursor = await connection.cursor()
+        try:
+            await cursor.execute(LOOKUP_QUERY, (username,))
+            rows = await cursor.fetchall()
+        finally:
+            await cursor.close()
+        return self._learn(username, (rows[0][0], rows[0][1]) if rows else None)
+
+    def _query(self, username, connection=None):
+        rows = self._fetch(LOOKUP_QUERY, (username,), connection)
+        return (rows[0][0], rows[0][1]) if rows else None
+
+    def _fetch(self, query, params, connection=None):
+        own = connection is None
+        if own:
+            connection = get_db_connection()
+            if not connection:
+                raise Error(msg='Database connection failed')
+        try:
+            cursor = connection.cursor(buffered=True)
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+            cursor.close()
+            return rows
+        finally:
+            if own:
+                connection.close()
+
+    # Start the bulk load on a background thread, once per process (again
+    # after LOAD_RETRY_SECONDS if it failed)
+    def _start_loading(self):
+        if self.loaded or self._loading:
+            return
+        with self._lock:
+            if self.loaded or self._loading:
+                return
+            if self._load_failed_at is not None and time.monotonic() - self._load_failed_at < LOAD_RETRY_SECONDS:
+                return
+            self._loading = True
+        threading.Thread(target=self._load_in_background, name='directory-load', daemon=True).start()
+
+    def _load_in_background(self):
+        try:
+            connection = get_db_connection()
+            if not connection:
+                raise Error(msg='Database connection failed')
+            try:
+                self.load(connection)
+            finally:
+                connection.close()
+        except Error as e:
+            print(f"Error loading the user directory: {e}")
+            self._load_failed_at = time.monotonic()
+        finally:
+            self._loading = False
+
+    # Up to limit usernames starting with prefix (in any case), in
+    # alphabetical order
+    def complete(self, prefix, limit=10, connection=None):
+        self._start_loading()
+        if not self.loaded:
+            pattern = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            return [row[0] for row in self._fetch(PREFIX_QUERY, (pattern, limit), connection)]
+        folded = prefix.casefold()
+        with self._lock:
+            start = bisect.bisect_left(self._names, folded)
+            matches = []
+            for name in self._names[start:start + limit]:
+                if not name.startswith(folded):
+                    break
+                matches.append(self._ids[name][1])
+        return matches
+
+    def stats(self):
+        return {
+            'loaded': int(self.loaded),
+            'users': len(self._ids),
+            'hits': self.hits,
+            'misses': self.misses,
+            'negative_hits': self.negative_hits,
+            'negative_entries': len(self._negative),
+        }
+
+
+_directory = None
+_directory_pid = None
+_directory_lock = threading.Lock()
+
+
+def get_directory():
+    global _directory, _directory_pid
+    pid = os.getpid()
+    if _directory is None or _directory_pid != pid:
+        with _directory_lock:
+            if _directory is None or _directory_pid != pid:
+                _directory = UserDirectory(
+                    Config.DIRECTORY_NEGATIVE_TTL, Config.DIRECTORY_NEGATIVE_MAX_ENTRIES
+                )
+                _directory_pid = pid
+    return _directory
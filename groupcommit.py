@@ -0,0 +1,188 @@
+# Group commit for deposits.
+#
+# With DEPOSIT_GROUP_COMMIT on, deposit requests hand their ledger write to a
+# writer thread instead of committing on their own. The writer collects
+# deposits for up to GROUP_COMMIT_INTERVAL_MS (or GROUP_COMMIT_MAX_BATCH of
+# them) and writes the whole group in one transaction, so the database pays
+# one fsync for many deposits. Each request still waits until its deposit is
+# committed before it answers.
+#
+# A request that stops waiting after GROUP_COMMIT_TIMEOUT cancels its deposit
+# if the writer has not picked it up yet, and the writer drops cancelled
+# deposits, so "failed" really means no money moved. A deposit the writer is
+# already writing cannot be taken back; the request reports it as pending
+# (DepositPending) and the client should check its balance, or retry with
+# the same idempotency key, rather than deposit again.
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+from mysql.connector import Error
+from config import Config
+from db import get_db_connection, pin_primary
+import idempotency
+import ledger
+
+
+class GroupCommitUnavailable(Exception):
+    pass
+
+
+# The deposit was being written when the request stopped waiting; it may
+# still commit
+class DepositPending(Exception):
+    pass
+
+
+class DepositWriter:
+    def __init__(self, max_batch, interval, queue_size):
+        self.max_batch = max_batch
+        self.interval = interval
+        self._queue = queue.Queue(maxsize=queue_size)
+        self.metrics = {
+            'submitted': 0,
+            'rejected': 0,
+            'batches': 0,
+            'committed': 0,
+            'failed': 0,
+            'fallbacks': 0,
+            'cancelled': 0,
+            'replayed': 0,
+            'largest_batch': 0,
+        }
+        self._thread = threading.Thread(target=self._run, name='deposit-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, user_id, amount, key=None):
+        future = Future()
+        try:
+            self._queue.put_nowait((user_id, amount, key, future))
+        except queue.Full:
+            self.metrics['rejected'] += 1
+            raise GroupCommitUnavailable('Deposit queue is full')
+        self.metrics['submitted'] += 1
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._flush(batch)
+
+    def _flush(self, batch):
+        # Drop deposits whose request gave up waiting; the rest can no longer
+        # be cancelled
+        live = [op for op in batch if op[3].set_running_or_notify_cancel()]
+        self.metrics['cancelled'] += len(batch) - len(live)
+        batch = live
+        if not batch:
+            return
+        self.metrics['batches'] += 1
+        self.metrics['largest_batch'] = max(self.metrics['largest_batch'], len(batch))
+        connection = get_db_connection()
+        if not connection:
+            self._fail(batch, GroupCommitUnavailable('Database connection failed'))
+            return
+        try:
+            try:
+                ledger.deposit_many(connection, [(user_id, amount, key) for user_id, amount, key, _ in batch])
+            except (Error, ledger.LedgerError):
+                # Retry one by one so that a single bad deposit, or a repeated
+                # idempotency key, only affects itself
+                self.metrics['fallbacks'] += 1
+                for op in batch:
+                    user_id, amount, key, future = op
+                    try:
+                        ledger.deposit(connection, user_id, amount, key)
+                    except idempotency.Replayed as e:
+                        self.metrics['replayed'] += 1
+                        future.set_exception(e)
+                    except (Error, ledger.LedgerError, idempotency.RequestInProgress) as e:
+                        self._fail([op], e)
+                    else:
+                        self._succeed([op])
+            else:
+                self._succeed(batch)
+        except Exception as e:
+            self._fail([op for op in batch if not op[3].done()], e)
+        finally:
+            connection.close()
+
+    def _succeed(self, ops):
+        self.metrics['committed'] += len(ops)
+        for _, amount, _, future in ops:
+            future.set_result({'type': 'deposit', 'amount': amount})
+
+    def _fail(self, ops, error):
+        self.metrics['failed'] += len(ops)
+        for *_, future in ops:
+            future.set_exception(error)
+
+    def stats(self):
+        stats = dict(self.metrics)
+        stats['queue_depth'] = self._queue.qsize()
+        stats['max_batch'] = self.max_batch
+        stats['interval_ms'] = self.interval * 1000
+        return stats
+
+
+_writer = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+
+# One writer thread per worker process, started on first use
+def get_writer():
+    global _writer, _writer_pid
+    pid = os.getpid()
+    if _writer is None or _writer_pid != pid:
+        with _writer_lock:
+            if _writer is None or _writer_pid != pid:
+                _writer = DepositWriter(
+                    Config.GROUP_COMMIT_MAX_BATCH,
+                    Config.GROUP_COMMIT_INTERVAL_MS / 1000,
+                    Config.GROUP_COMMIT_QUEUE_SIZE
+                )
+                _writer_pid = pid
+    return _writer
+
+
+# Queue a deposit and wait until it is committed. Raises
+# idempotency.Replayed like ledger.deposit() for a repeated key.
+def deposit(user_id, amount, key=None):
+    future = get_writer().submit(user_id, amount, key)
+    try:
+        result = future.result(timeout=Config.GROUP_COMMIT_TIMEOUT)
+    except TimeoutError:
+        _give_up(future)
+    # The writer thread has no session; pin the depositor's reads from here
+    pin_primary(user_id)
+    return result
+
+
+# deposit() for the ASGI app: waits for the writer without holding a thread.
+# Shielded, so that the wait running out leaves the decision to _give_up().
+async def deposit_async(user_id, amount, key=None):
+    future = get_writer().submit(user_id, amount, key)
+    try:
+        result = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), Config.GROUP_COMMIT_TIMEOUT)
+    except asyncio.TimeoutError:
+        _give_up(future)
+    pin_primary(user_id)
+    return result
+
+
+def _give_up(future):
+    if future.cancel():
+        raise GroupCommitUnavailable('Timed out waiting for the deposit to be confirmed')
+    raise DepositPending('The deposit is still being confirmed')
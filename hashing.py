@@ -0,0 +1,104 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import generate_password_hash, check_password_hash
+from config import Config
+
+
+# Raised instead of queueing when every hashing slot is taken; handlers turn
+# it into a fast 503 so a login burst cannot tie up the worker
+class HashingBusy(Exception):
+    pass
+
+
+_executor = None
+_executor_pid = None
+_slots = None
+_lock = threading.Lock()
+
+metrics = {
+    'submitted': 0,
+    'rejected': 0,
+    'timeouts': 0,
+    'rehashed': 0,
+}
+
+
+def _get_executor():
+    global _executor, _executor_pid, _slots
+    pid = os.getpid()
+    if _executor is None or _executor_pid != pid:
+        with _lock:
+            if _executor is None or _executor_pid != pid:
+                # forkserver children start from a clean process rather than a
+                # copy of a (possibly threaded) gunicorn worker
+                _executor = ProcessPoolExecutor(
+                    max_workers=Config.PASSWORD_HASH_WORKERS,
+                    mp_context=multiprocessing.get_context('forkserver')
+                )
+                _slots = threading.BoundedSemaphore(
+                    Config.PASSWORD_HASH_WORKERS + Config.PASSWORD_HASH_QUEUE_DEPTH
+                )
+                _executor_pid = pid
+    return _executor
+
+
+def _reset_executor(executor):
+    global _executor
+    with _lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False)
+
+
+def _run(func, *args):
+    # PASSWORD_HASH_WORKERS = 0 hashes inline in the request thread
+    if not Config.PASSWORD_HASH_WORKERS:
+        return func(*args)
+
+    executor = _get_executor()
+    slots = _slots
+    if not slots.acquire(blocking=False):
+        metrics['rejected'] += 1
+        raise HashingBusy()
+    try:
+        future = executor.submit(func, *args)
+    except BrokenProcessPool:
+        slots.release()
+        _reset_executor(executor)
+        raise HashingBusy()
+    # The slot is held until the hash has actually finished, even when the
+    # request stops waiting for it, so the queue depth bounds pending work
+    future.add_done_callback(lambda _: slots.release())
+    metrics['submitted'] += 1
+    try:
+        return future.result(timeout=Config.PASSWORD_HASH_TIMEOUT)
+    except TimeoutError:
+        metrics['timeouts'] += 1
+        raise HashingBusy()
+    except BrokenProcessPool:
+        # A pool process died; start a fresh pool for the next request
+        _reset_executor(executor)
+        raise HashingBusy()
+
+
+def hash_password(password):
+    return _run(generate_password_hash, password, Config.PASSWORD_HASH_METHOD)
+
+
+def verify_password(password_hash, password):
+    return _run(check_password_hash, password_hash, password)
+
+
+# True when a stored hash was made with other parameters than the configured ones
+def needs_rehash(password_hash):
+    return password_hash.split('$', 1)[0] != Config.PASSWORD_HASH_METHOD
+
+
+def stats():
+    stats = dict(metrics)
+    stats['workers'] = Config.PASSWORD_HASH_WORKERS
+    stats['queue_depth'] = Config.PASSWORD_HASH_QUEUE_DEPTH
+    return stats
@@ -0,0 +1,396 @@
+# Idempotency keys for money operations.
+#
+# Clients send a key with each POST, either in an Idempotency-Key header or,
+# from the web forms, in a hidden idempotency_key field that every render of
+# the form fills with a new value. A request that repeats a key gets the
+# result of the first one back instead of moving money again.
+#
+# For deposits, withdrawals and transfers the key is claimed inside the
+# ledger transaction, before the users table is touched: claim() inserts it
+# into idempotency_keys together with the result, and if the key is already
+# there it raises Replayed with the stored result and the transaction is
+# rolled back having done nothing. The primary key on (user_id, key) makes
+# that exact across workers; a duplicate that arrives while the first request
+# is still running waits on the key's row lock and then replays.
+#
+# Each worker also remembers the results of recent keys in memory (an LRU),
+# and which keys it has seen over the last IDEMPOTENCY_KEY_TTL in a bloom
+# filter. lookup() answers double clicks and retries from the LRU without a
+# database round trip, and only reads idempotency_keys when the bloom filter
+# says the key may have been used. Rows older than the TTL are removed by
+#
+#   python idempotency.py sweep
+#
+# The batch transfer endpoint uses reserve() / complete() / release(), since
+# a batch commits in several transactions.
+#
+# Keys are stored prefixed with the operation they were sent to (deposit,
+# withdraw, transfer or transfer_batch; the web form and the API share
+# one), so a key reused on another endpoint is a new request rather than a
+# replay of a result of another shape.
+import argparse
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from mysql.connector import Error, errorcode
+from config import Config
+from db import get_db_connection
+
+# Longest key a client may send; longer keys are rejected. Stored keys are
+# up to 15 characters longer with the operation prefix.
+MAX_KEY_LENGTH = 64
+
+CLAIM_INSERT = "INSERT INTO idempotency_keys (user_id, idempotency_key, response) VALUES (%s, %s, %s)"
+RESPONSE_SELECT = "SELECT response FROM idempotency_keys WHERE user_id = %s AND idempotency_key = %s"
+
+metrics = {
+    'claimed': 0,
+    'replayed': 0,
+    'memory_hits': 0,
+    'bloom_skips': 0,
+    'db_lookups': 0,
+    'db_hits': 0,
+    'swept': 0,
+}
+
+
+class RequestInProgress(Exception):
+    pass
+
+
+# The key was used before; result is what the first request returned
+class Replayed(Exception):
+    def __init__(self, result):
+        super().__init__('Request already processed')
+        self.result = result
+
+
+# Bloom filter in two generations that are rotated every `period` seconds,
+# so that a key is remembered for between one and two periods
+class RotatingBloomFilter:
+    def __init__(self, capacity, period, error_rate=0.01):
+        self.bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.period = period
+        self._current = bytearray((self.bits + 7) // 8)
+        self._previous = bytearray(len(self._current))
+        self._rotated_at = time.monotonic()
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.bits for i in range(self.hashes)]
+
+    def _rotate(self):
+        if time.monotonic() - self._rotated_at >= self.period:
+            self._previous = self._current
+            self._current = bytearray(len(self._previous))
+            self._rotated_at = time.monotonic()
+
+    def add(self, item):
+        self._rotate()
+        for position in self._positions(item):
+            self._current[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        self._rotate()
+        positions = self._positions(item)
+        return any(
+            all(bits[position >> 3] & (1 << (position & 7)) for position in positions)
+            for bits in (self._current, self._previous)
+        )
+
+
+class RecentKeys:
+    def __init__(self, max_entries, bloom_capacity, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._results = OrderedDict()
+        self._seen = RotatingBloomFilter(bloom_capacity, ttl)
+        self._lock = threading.Lock()
+
+    def get(self, user_id, key):
+        item = f'{user_id}:{key}'
+        with self._lock:
+            entry = self._results.get(item)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[1] > self.ttl:
+                del self._results[item]
+                return None
+            self._results.move_to_end(item)
+            return entry[0]
+
+    def may_contain(self, user_id, key):
+        with self._lock:
+            return f'{user_id}:{key}' in self._seen
+
+    def add(self, user_id, key, result):
+        item = f'{user_id}:{key}'
+        with self._lock:
+            self._seen.add(item)
+            self._results[item] = (result, time.monotonic())
+            self._results.move_to_end(item)
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+
+
+_recent = None
+_recent_pid = None
+_recent_lock = threading.Lock()
+
+
+def get_recent_keys():
+    global _recent, _recent_pid
+    pid = os.getpid()
+    if _recent is None or _recent_pid != pid:
+        with _recent_lock:
+            if _recent is None or _recent_pid != pid:
+                _recent = RecentKeys(
+                    Config.IDEMPOTENCY_RECENT_KEYS,
+                    Config.IDEMPOTENCY_BLOOM_CAPACITY,
+                    Config.IDEMPOTENCY_KEY_TTL
+                )
+                _recent_pid = pid
+    return _recent
+
+
+# The client's key scoped to the endpoint's operation, or None. Quart
+# requests read their form asynchronously, so asgi.py passes it in.
+def get_key(request, form=None):
+    values = request.values if form is None else form
+    key = request.headers.get('Idempotency-Key') or values.get('idempotency_key')
+    if key and len(key) <= MAX_KEY_LENGTH:
+        return f"{request.endpoint.rpartition('.')[2]}:{key}"
+    return None
+
+
+def new_key():
+    return uuid.uuid4().hex
+
+
+def _dumps(result):
+    return json.dumps(result, separators=(',', ':'))
+
+
+# The stored result for a key this user has already used, or None. Checks
+# the in-memory LRU first; the database only when a connection is given and
+# the bloom filter has seen the key. None does not mean the key is unused:
+# claim() is what decides.
+def lookup(user_id, key, connection=None):
+    result, check_db = _lookup_memory(user_id, key, connection)
+    if not check_db:
+        return result
+    cursor = connection.cursor(buffered=True)
+    try:
+        cursor.execute(RESPONSE_SELECT, (user_id, key))
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+    return _found(user_id, key, row)
+
+
+def _lookup_memory(user_id, key, connection):
+    if not key:
+        return None, False
+    recent = get_recent_keys()
+    result = recent.get(user_id, key)
+    if result is not None:
+        metrics['memory_hits'] += 1
+        return result, False
+    if connection is None:
+        return None, False
+    if not recent.may_contain(user_id, key):
+        metrics['bloom_skips'] += 1
+        return None, False
+    metrics['db_lookups'] += 1
+    return None, True
+
+
+def _found(user_id, key, row):
+    if row is None or row[0] is None:
+        return None
+    metrics['db_hits'] += 1
+    result = json.loads(row[0])
+    get_recent_keys().add(user_id, key, result)
+    return result
+
+
+# Claim a key inside the caller's transaction, storing the result the
+# operation will have once it commits. Raises Replayed if the key is taken.
+def claim(cursor, user_id, key, result):
+    try:
+        cursor.execute(CLAIM_INSERT, (user_id, key, _dumps(result)))
+    except Error as e:
+        if e.errno != errorcode.ER_DUP_ENTRY:
+            raise
+        # A locking read, so that it sees the row the other request just
+        # committed even if this transaction already has an older snapshot
+        cursor.execute(RESPONSE_SELECT + " LOCK IN SHARE MODE", (user_id, key))
+        _replay(user_id, key, cursor.fetchall())
+    metrics['claimed'] += 1
+
+
+def _replay(user_id, key, rows):
+    if not rows or rows[0][0] is None:
+        raise RequestInProgress(key)
+    metrics['replayed'] += 1
+    stored = json.loads(rows[0][0])
+    get_recent_keys().add(user_id, key, stored)
+    raise Replayed(stored)
+
+
+# lookup() and claim() on a mysql.connector.aio connection, for the ASGI app
+async def lookup_async(user_id, key, connection=None):
+    result, check_db = _lookup_memory(user_id, key, connection)
+    if not check_db:
+        return result
+    cursor = await connection.cursor()
+    try:
+        await cursor.execute(RESPONSE_SELECT, (user_id, key))
+        rows = await cursor.fetchall()
+    finally:
+        await cursor.close()
+    return _found(user_id, key, rows[0] if rows else None)
+
+
+async def claim_async(cursor, user_id, key, result):
+    try:
+        await cursor.execute(CLAIM_INSERT, (user_id, key, _dumps(result)))
+    except Error as e:
+        if e.errno != errorcode.ER_DUP_ENTRY:
+            raise
+        await cursor.execute(RESPONSE_SELECT + " LOCK IN SHARE MODE", (user_id, key))
+        _replay(user_id, key, await cursor.fetchall())
+    metrics['claimed'] += 1
+
+
+# Claim many (user_id, key, result) at once; a taken key fails the whole
+# statement with ER_DUP_ENTRY, and the caller falls back to claim()
+def claim_many(cursor, claims):
+    cursor.executemany(
+        CLAIM_INSERT,
+        [(user_id, key, _dumps(result)) for user_id, key, result in claims]
+    )
+    metrics['claimed'] += len(claims)
+
+
+# Called once the claiming transaction has committed
+def remember(user_id, key, result):
+    get_recent_keys().add(user_id, key, result)
+
+
+# Claim a key for this user. Returns None when the key is new and the caller
+# should go ahead, or the stored response of the earlier request otherwise.
+def reserve(connection, user_id, key):
+    cursor = connection.cursor(buffered=True)
+    try:
+        cursor.execute(
+            "INSERT INTO idempotency_keys (user_id, idempotency_key) VALUES (%s, %s)",
+            (user_id, key)
+        )
+        connection.commit()
+        return None
+    except Error as e:
+        connection.rollback()
+        if e.errno != errorcode.ER_DUP_ENTRY:
+            raise
+        cursor.execute(
+            "SELECT response FROM idempotency_keys WHERE user_id = %s AND idempotency_key = %s",
+            (user_id, key)
+        )
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+
+    if row is None or row[0] is None:
+        raise RequestInProgress(key)
+    return json.loads(row[0])
+
+
+def complete(connection, user_id, key, response):
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            "UPDATE idempotency_keys SET response = %s WHERE user_id = %s AND idempotency_key = %s",
+            (_dumps(response), user_id, key)
+        )
+        connection.commit()
+    finally:
+        cursor.close()
+
+
+# Give up a key whose request failed so that the client can retry it
+def release(connection, user_id, key):
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            "DELETE FROM idempotency_keys WHERE user_id = %s AND idempotency_key = %s AND response IS NULL",
+            (user_id, key)
+        )
+        connection.commit()
+    finally:
+        cursor.close()
+
+
+# Delete keys older than the TTL, oldest first, one short transaction per
+# batch. Returns the number of keys removed.
+def sweep(connection, ttl=None, batch_size=None, pause=0.0):
+    ttl = Config.IDEMPOTENCY_KEY_TTL if ttl is None else ttl
+    batch_size = batch_size or Config.IDEMPOTENCY_SWEEP_BATCH
+    total = 0
+    cursor = connection.cursor()
+    try:
+        while True:
+            cursor.execute(
+                "DELETE FROM idempotency_keys WHERE created_at < NOW() - INTERVAL %s SECOND "
+                "ORDER BY created_at LIMIT %s",
+                (ttl, batch_size)
+            )
+            deleted = cursor.rowcount
+            connection.commit()
+            total += deleted
+            metrics['swept'] += deleted
+            if deleted < batch_size:
+                return total
+            if pause:
+                time.sleep(pause)
+    finally:
+        cursor.close()
+
+
+def stats():
+    return dict(metrics)
+
+
+def init_app(app):
+    app.jinja_env.globals['idempotency_key'] = new_key
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['sweep'])
+    parser.add_argument('--ttl', type=int, default=Config.IDEMPOTENCY_KEY_TTL, help='seconds to keep a key')
+    parser.add_argument('--batch', type=int, default=Config.IDEMPOTENCY_SWEEP_BATCH)
+    parser.add_argument('--pause', type=float, default=0.05, help='seconds to sleep between batches')
+    args = parser.parse_args()
+
+    connection = get_db_connection()
+    if not connection:
+        return
+    try:
+        start = time.perf_counter()
+        total = sweep(connection, args.ttl, args.batch, args.pause)
+        print(f"Swept {total} idempotency keys in {time.perf_counter() - start:.1f}s")
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+# Minimal shared key/value store for state that has to be visible to every
+# gunicorn worker (account cache, sessions, rate limits). It stands in for
+# Redis/memcached on a single host: run it next to the app with
+#
+#   python kvstore.py --address 127.0.0.1:7379
+#
+# Requests and responses are single lines of JSON over a TCP or unix socket.
+import argparse
+import json
+import os
+import select
+import socket
+import socketserver
+import threading
+import time
+from config import Config
+
+
+def _parse_address(address):
+    if address.startswith('/'):
+        return socket.AF_UNIX, address
+    host, port = address.rsplit(':', 1)
+    return socket.AF_INET, (host, int(port))
+
+
+class Store:
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key, now):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if item[1] is not None and item[1] <= now:
+            del self._data[key]
+            return None
+        return item
+
+    def get(self, key):
+        with self._lock:
+            item = self._live(key, time.time())
+        return item[0] if item else None
+
+    def mget(self, *keys):
+        now = time.time()
+        with self._lock:
+            items = [self._live(key, now) for key in keys]
+        return [item[0] if item else None for item in items]
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+        return True
+
+    def mset(self, items, ttl=None):
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            for key, value in items.items():
+                self._data[key] = (value, expires)
+        return True
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(1 for key in keys if self._data.pop(key, None) is not None)
+
+    def incr(self, key, amount=1, ttl=None):
+        now = time.time()
+        with self._lock:
+            item = self._live(key, now)
+            if item is None:
+                item = (0, now + ttl if ttl else None)
+            value = item[0] + amount
+            self._data[key] = (value, item[1])
+        return value
+
+    def expire(self, key, ttl):
+        with self._lock:
+            item = self._live(key, time.time())
+            if item is None:
+                return False
+            self._data[key] = (item[0], time.time() + ttl)
+        return True
+
+    # Token buckets, each given as [key, tokens per second, burst]. Takes a
+    # token from every bucket, or from none if any of them is empty. Returns
+    # 0 when the tokens were taken, otherwise the seconds until they would be.
+    def take(self, buckets):
+        now = time.time()
+        with self._lock:
+            states = []
+            wait = 0.0
+            for key, rate, burst in buckets:
+                item = self._live(key, now)
+                tokens, stamp = item[0] if item else (burst, now)
+                tokens = min(burst, tokens + (now - stamp) * rate)
+                if tokens < 1:
+                    wait = max(wait, (1 - tokens) / rate)
+                states.append((key, rate, burst, tokens))
+            if wait:
+                return wait
+            for key, rate, burst, tokens in states:
+                # A bucket left alone until it is full again can be dropped
+                self._data[key] = ([tokens - 1, now], now + burst / rate)
+        return 0
+
+    # Remove every expired key in one pass
+    def sweep(self):
+        now = time.time()
+        with self._lock:
+            expired = [key for key, item in self._data.items() if item[1] is not None and item[1] <= now]
+            for key in expired:
+                del self._data[key]
+        return len(expired)
+
+    def ping(self):
+        return True
+
+
+COMMANDS = ('get', 'mget', 'set', 'mset', 'delete', 'incr', 'expire', 'take', 'ping')
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                command, *args = json.loads(line)
+                if command not in COMMANDS:
+                    raise ValueError(f'unknown command {command}')
+                reply = {'ok': getattr(self.server.store, command)(*args)}
+            except Exception as e:
+                reply = {'error': str(e)}
+            self.wfile.write(json.dumps(reply, separators=(',', ':')).encode() + b'\n')
+
+
+def serve(address, sweep_interval=1.0):
+    family, bind_to = _parse_address(address)
+    if family == socket.AF_UNIX:
+        if os.path.exists(bind_to):
+            os.unlink(bind_to)
+        server_class = socketserver.ThreadingUnixStreamServer
+    else:
+        server_class = socketserver.ThreadingTCPServer
+    server_class.daemon_threads = True
+    server_class.allow_reuse_address = True
+    server = server_class(bind_to, _Handler)
+    server.store = Store()
+
+    def sweeper():
+        while True:
+            time.sleep(sweep_interval)
+            server.store.sweep()
+
+    threading.Thread(target=sweeper, daemon=True).start()
+    print(f"kvstore listening on {address}")
+    server.serve_forever()
+
+
+class KVError(Exception):
+    pass
+
+
+# Client with one persistent socket per thread
+class KVClient:
+    def __init__(self, address=None, timeout=1.0):
+        self.address = address or Config.KV_ADDRESS
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        # The server never writes unprompted, so an idle socket that is
+        # readable has been closed by it (e.g. the server restarted)
+        if conn is not None and conn[2] == os.getpid() and select.select([conn[0]], [], [], 0)[0]:
+            self._reset()
+            conn = None
+        if conn is None or conn[2] != os.getpid():
+            family, connect_to = _parse_address(self.address)
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(connect_to)
+            if family == socket.AF_INET:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = (sock, sock.makefile('rb'), os.getpid())
+            self._local.conn = conn
+        return conn
+
+    def _reset(self):
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn[0].close()
+            except OSError:
+                pass
+
+    def call(self, command, *args):
+        payload = json.dumps([command, *args], separators=(',', ':')).encode() + b'\n'
+        # Only a failed connect is retried: once the request has been written
+        # the server may have applied it, and take/incr must not run twice
+        for attempt in (0, 1):
+            try:
+                sock, reader, _ = self._connection()
+                break
+            except OSError as e:
+                self._reset()
+                if attempt:
+                    raise KVError(str(e))
+        try:
+            sock.sendall(payload)
+            line = reader.readline()
+            if not line:
+                raise ConnectionError('kvstore closed the connection')
+        except OSError as e:
+            self._reset()
+            raise KVError(str(e))
+        reply = json.loads(line)
+        if 'error' in reply:
+            raise KVError(reply['error'])
+        return reply['ok']
+
+    def get(self, key):
+        return self.call('get', key)
+
+    def mget(self, *keys):
+        return self.call('mget', *keys)
+
+    def set(self, key, value, ttl=None):
+        return self.call('set', key, value, ttl)
+
+    def mset(self, items, ttl=None):
+        return self.call('mset', items, ttl)
+
+    def delete(self, *keys):
+        return self.call('delete', *keys)
+
+    def incr(self, key, amount=1, ttl=None):
+        return self.call('incr', key, amount, ttl)
+
+    def expire(self, key, ttl):
+        return self.call('expire', key, ttl)
+
+    def take(self, buckets):
+        return self.call('take', buckets)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--address', default=Config.KV_ADDRESS,
+                        help='host:port, or a path for a unix socket')
+    args = parser.parse_args()
+    serve(args.address)
@@ -0,0 +1,365 @@
+import asyncio
+import random
+import time
+from mysql.connector import Error
+from config import Config
+from cache import invalidate_accounts
+from money import format_paise
+import idempotency
+
+DEPOSIT_UPDATE = "UPDATE users SET balance = balance + %s WHERE id = %s"
+DEPOSIT_INSERT = (
+    "INSERT INTO transactions (user_id, type, direction, amount, description) "
+    "VALUES (%s, 'deposit', 'credit', %s, %s)"
+)
+
+# The balance check and the debit happen in the same statement, so two
+# concurrent withdrawals can never both pass the check
+WITHDRAW_UPDATE = "UPDATE users SET balance = balance - %s WHERE id = %s AND balance >= %s"
+WITHDRAW_INSERT = (
+    "INSERT INTO transactions (user_id, type, direction, amount, description) "
+    "VALUES (%s, 'withdraw', 'debit', %s, %s)"
+)
+
+# Lock both rows in primary key order so that A->B and B->A transfers
+# running at the same time queue up instead of deadlocking
+TRANSFER_LOCK = "SELECT id, balance FROM users WHERE id IN (%s, %s) ORDER BY id FOR UPDATE"
+TRANSFER_UPDATE = (
+    "UPDATE users SET balance = balance + CASE id WHEN %s THEN -%s ELSE %s END WHERE id IN (%s, %s)"
+)
+
+# Each transfer is two rows, a debit for the sender and a credit for the
+# receiver, each naming the other account as counterparty
+TRANSFER_INSERT = (
+    "INSERT INTO transactions (user_id, type, direction, counterparty_id, amount, description) "
+    "VALUES (%s, 'transfer', %s, %s, %s, %s)"
+)
+
+# Lock wait timeout and deadlock: the transaction was rolled back and can simply be retried
+RETRYABLE_ERRNOS = (1205, 1213)
+
+
+class LedgerError(Exception):
+    pass
+
+
+class InsufficientFunds(LedgerError):
+    pass
+
+
+class AccountNotFound(LedgerError):
+    pass
+
+
+# A batch stopped on an unexpected error after some of its chunks had
+# committed. statuses covers every row; rows it did not finish are 'failed'.
+class BatchInterrupted(LedgerError):
+    def __init__(self, statuses):
+        super().__init__('Batch interrupted after some transfers were made')
+        self.statuses = statuses
+
+
+# Run one money movement as a single transaction, retrying on lock contention
+def run_transaction(connection, operation):
+    retries = Config.LEDGER_MAX_RETRIES
+    for attempt in range(retries + 1):
+        cursor = connection.cursor()
+        try:
+            result = operation(cursor)
+            connection.commit()
+            return result
+        except Error as e:
+            connection.rollback()
+            if e.errno not in RETRYABLE_ERRNOS or attempt == retries:
+                raise
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+        time.sleep(random.uniform(0, Config.LEDGER_RETRY_BACKOFF * 2 ** attempt))
+
+
+# The single-account operations return a small result dict, which is also
+# what a repeat of the same idempotency key gets back (see idempotency.py)
+def deposit(connection, user_id, amount, key=None):
+    result = {'type': 'deposit', 'amount': amount}
+
+    def operation(cursor):
+        if key:
+            idempotency.claim(cursor, user_id, key, result)
+        cursor.execute(DEPOSIT_UPDATE, (amount, user_id))
+        if cursor.rowcount == 0:
+            raise AccountNotFound(user_id)
+        cursor.execute(DEPOSIT_INSERT, (user_id, amount, f'Deposited ₹{format_paise(amount)}'))
+    run_transaction(connection, operation)
+    invalidate_accounts(user_id)
+    if key:
+        idempotency.remember(user_id, key, result)
+    return result
+
+
+# Apply many deposits (user_id, amount, key) in one transaction with a
+# single commit; key may be None. Fails as a whole if any of the accounts
+# does not exist or any of the keys was used before.
+def deposit_many(connection, deposits):
+    credits = {}
+    for user_id, amount, _ in deposits:
+        credits[user_id] = credits.get(user_id, 0) + amount
+    claims = [(user_id, key, {'type': 'deposit', 'amount': amount}) for user_id, amount, key in deposits if key]
+
+    def operation(cursor):
+        if claims:
+            idempotency.claim_many(cursor, claims)
+        cases = ' '.join(['WHEN %s THEN %s'] * len(credits))
+        placeholders = ', '.join(['%s'] * len(credits))
+        params = [value for credit in credits.items() for value in credit] + list(credits)
+        cursor.execute(
+            f"UPDATE users SET balance = balance + CASE id {cases} END WHERE id IN ({placeholders})",
+            params
+        )
+        if cursor.rowcount != len(credits):
+            raise AccountNotFound()
+        cursor.executemany(
+            DEPOSIT_INSERT,
+            [(user_id, amount, f'Deposited ₹{format_paise(amount)}') for user_id, amount, _ in deposits]
+        )
+    run_transaction(connection, operation)
+    invalidate_accounts(*credits)
+    for user_id, key, result in claims:
+        idempotency.remember(user_id, key, result)
+
+
+def withdraw(connection, user_id, amount, key=None):
+    result = {'type': 'withdraw', 'amount': amount}
+
+    def operation(cursor):
+        if key:
+            idempotency.claim(cursor, user_id, key, result)
+        cursor.execute(WITHDRAW_UPDATE, (amount, user_id, amount))
+        if cursor.rowcount == 0:
+            raise InsufficientFunds(user_id)
+        cursor.execute(WITHDRAW_INSERT, (user_id, amount, f'Withdrew ₹{format_paise(amount)}'))
+    run_transaction(connection, operation)
+    invalidate_accounts(user_id)
+    if key:
+        idempotency.remember(user_id, key, result)
+    return result
+
+
+def _check_transfer(balances, sender_id, receiver_id, amount):
+    if receiver_id not in balances:
+        raise AccountNotFound(receiver_id)
+    if balances.get(sender_id, 0) < amount:
+        raise InsufficientFunds(sender_id)
+
+
+def _transfer_rows(sender_id, sender_name, receiver_id, receiver_name, amount):
+    return [
+        (sender_id, 'debit', receiver_id, amount, f'Transferred ₹{format_paise(amount)} to {receiver_name}'),
+        (receiver_id, 'credit', sender_id, amount, f'Received ₹{format_paise(amount)} from {sender_name}'),
+    ]
+
+
+def transfer(connection, sender_id, sender_name, receiver_id, receiver_name, amount, key=None):
+    if sender_id == receiver_id:
+        raise LedgerError('Cannot transfer to the same account')
+    result = {'type': 'transfer', 'amount': amount, 'receiver': receiver_name}
+
+    def operation(cursor):
+        if key:
+            idempotency.claim(cursor, sender_id, key, result)
+        cursor.execute(TRANSFER_LOCK, (sender_id, receiver_id))
+        _check_transfer(dict(cursor.fetchall()), sender_id, receiver_id, amount)
+        cursor.execute(TRANSFER_UPDATE, (sender_id, amount, amount, sender_id, receiver_id))
+        cursor.executemany(TRANSFER_INSERT, _transfer_rows(sender_id, sender_name, receiver_id, receiver_name, amount))
+    run_transaction(connection, operation)
+    invalidate_accounts(sender_id, receiver_id)
+    if key:
+        idempotency.remember(sender_id, key, result)
+    return result
+
+
+# Look up many receivers at once. Returns {username.casefold(): (id, stored
+# username)} for those that exist: users.username compares case-insensitively,
+# so Alice finds alice.
+def resolve_usernames(connection, usernames, chunk_size=1000):
+    usernames = list({username.casefold(): username for username in usernames}.values())
+    found = {}
+    cursor = connection.cursor()
+    try:
+        for start in range(0, len(usernames), chunk_size):
+            chunk = usernames[start:start + chunk_size]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(f"SELECT id, username FROM users WHERE username IN ({placeholders})", chunk)
+            for user_id, username in cursor.fetchall():
+                found[username.casefold()] = (user_id, username)
+    finally:
+        cursor.close()
+    return found
+
+
+# Pay many receivers from one account. rows is a list of
+# (receiver_username, amount) with amounts already validated, in paise.
+# Rows are applied in chunks of one transaction each; every row gets a
+# status in the returned list: ok, receiver_not_found, self_transfer,
+# insufficient_funds or failed.
+def transfer_batch(connection, sender_id, sender_name, rows, chunk_size=None):
+    chunk_size = chunk_size or Config.BATCH_CHUNK_SIZE
+    receivers = resolve_usernames(connection, [username for username, _ in rows])
+    statuses = [None] * len(rows)
+    pending = []
+    for index, (username, amount) in enumerate(rows):
+        receiver = receivers.get(username.casefold())
+        if receiver is None:
+            statuses[index] = 'receiver_not_found'
+        elif receiver[0] == sender_id:
+            statuses[index] = 'self_transfer'
+        else:
+            pending.append((index, receiver[0], receiver[1], amount))
+
+    committed = False
+    for start in range(0, len(pending), chunk_size):
+        chunk = pending[start:start + chunk_size]
+
+        def operation(cursor):
+            # Lock the sender and every receiver in primary key order, the
+            # same order single transfers use
+            ids = sorted({sender_id} | {receiver_id for _, receiver_id, _, _ in chunk})
+            placeholders = ', '.join(['%s'] * len(ids))
+            cursor.execute(
+                f"SELECT id, balance FROM users WHERE id IN ({placeholders}) ORDER BY id FOR UPDATE",
+                ids
+            )
+            available = dict(cursor.fetchall()).get(sender_id, 0)
+
+            accepted = []
+            credits = {}
+            for index, receiver_id, username, amount in chunk:
+                if amount > available:
+                    continue
+                available -= amount
+                accepted.append(index)
+                credits[receiver_id] = credits.get(receiver_id, 0) + amount
+            if not accepted:
+                return accepted
+
+            debit = sum(credits.values())
+            deltas = [(sender_id, -debit)] + list(credits.items())
+            cases = ' '.join(['WHEN %s THEN %s'] * len(deltas))
+            placeholders = ', '.join(['%s'] * len(deltas))
+            params = [value for delta in deltas for value in delta] + [user_id for user_id, _ in deltas]
+            cursor.execute(
+                f"UPDATE users SET balance = balance + CASE id {cases} END WHERE id IN ({placeholders})",
+                params
+            )
+
+            records = []
+            accepted_set = set(accepted)
+            for index, receiver_id, username, amount in chunk:
+                if index in accepted_set:
+                    records.append((sender_id, 'debit', receiver_id, amount,
+                                    f'Transferred ₹{format_paise(amount)} to {username}'))
+                    records.append((receiver_id, 'credit', sender_id, amount,
+                                    f'Received ₹{format_paise(amount)} from {sender_name}'))
+            cursor.executemany(TRANSFER_INSERT, records)
+            return accepted
+
+        try:
+            accepted = set(run_transaction(connection, operation))
+        except Error as e:
+            print(f"Batch chunk failed: {e}")
+            for index, _, _, _ in chunk:
+                statuses[index] = 'failed'
+            continue
+        except Exception as e:
+            if not committed:
+                raise
+            invalidate_accounts(sender_id, *{receiver_id for _, receiver_id, _, _ in pending})
+            raise BatchInterrupted([status or 'failed' for status in statuses]) from e
+        committed = committed or bool(accepted)
+        for index, _, _, _ in chunk:
+            statuses[index] = 'ok' if index in accepted else 'insufficient_funds'
+
+    touched = {receiver_id for _, receiver_id, _, _ in pending}
+    invalidate_accounts(sender_id, *touched)
+    return statuses
+
+
+# Async versions of run_transaction and the single-account operations for
+# the ASGI app (asgi.py), on a mysql.connector.aio connection. They run the
+# same statements and return the same results; operation is a coroutine
+# function taking the cursor.
+async def run_transaction_async(connection, operation):
+    retries = Config.LEDGER_MAX_RETRIES
+    for attempt in range(retries + 1):
+        cursor = await connection.cursor()
+        try:
+            result = await operation(cursor)
+            await connection.commit()
+            return result
+        except Error as e:
+            await connection.rollback()
+            if e.errno not in RETRYABLE_ERRNOS or attempt == retries:
+                raise
+        except Exception:
+            await connection.rollback()
+            raise
+        finally:
+            await cursor.close()
+        await asyncio.sleep(random.uniform(0, Config.LEDGER_RETRY_BACKOFF * 2 ** attempt))
+
+
+async def deposit_async(connection, user_id, amount, key=None):
+    result = {'type': 'deposit', 'amount': amount}
+
+    async def operation(cursor):
+        if key:
+            await idempotency.claim_async(cursor, user_id, key, result)
+        await cursor.execute(DEPOSIT_UPDATE, (amount, user_id))
+        if cursor.rowcount == 0:
+            raise AccountNotFound(user_id)
+        await cursor.execute(DEPOSIT_INSERT, (user_id, amount, f'Deposited ₹{format_paise(amount)}'))
+    await run_transaction_async(connection, operation)
+    invalidate_accounts(user_id)
+    if key:
+        idempotency.remember(user_id, key, result)
+    return result
+
+
+async def withdraw_async(connection, user_id, amount, key=None):
+    result = {'type': 'withdraw', 'amount': amount}
+
+    async def operation(cursor):
+        if key:
+            await idempotency.claim_async(cursor, user_id, key, result)
+        await cursor.execute(WITHDRAW_UPDATE, (amount, user_id, amount))
+        if cursor.rowcount == 0:
+            raise InsufficientFunds(user_id)
+        await cursor.execute(WITHDRAW_INSERT, (user_id, amount, f'Withdrew ₹{format_paise(amount)}'))
+    await run_transaction_async(connection, operation)
+    invalidate_accounts(user_id)
+    if key:
+        idempotency.remember(user_id, key, result)
+    return result
+
+
+async def transfer_async(connection, sender_id, sender_name, receiver_id, receiver_name, amount, key=None):
+    if sender_id == receiver_id:
+        raise LedgerError('Cannot transfer to the same account')
+    result = {'type': 'transfer', 'amount': amount, 'receiver': receiver_name}
+
+    async def operation(cursor):
+        if key:
+            await idempotency.claim_async(cursor, sender_id, key, result)
+        await cursor.execute(TRANSFER_LOCK, (sender_id, receiver_id))
+        _check_transfer(dict(await cursor.fetchall()), sender_id, receiver_id, amount)
+        await cursor.execute(TRANSFER_UPDATE, (sender_id, amount, amount, sender_id, receiver_id))
+        await cursor.executemany(
+            TRANSFER_INSERT, _transfer_rows(sender_id, sender_name, receiver_id, receiver_name, amount)
+        )
+    await run_transaction_async(connection, operation)
+    invalidate_accounts(sender_id, receiver_id)
+    if key:
+        idempotency.remember(sender_id, key, result)
+    return result
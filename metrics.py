@@ -0,0 +1,321 @@
+# Request instrumentation exported in the Prometheus text format at /metrics.
+#
+# Every request records its wall time, the number of SQL statements it ran,
+# the time spent in the database, waiting for a pooled connection and
+# rendering templates. Metrics are kept per worker process, the way the
+# Prometheus client does without its multiprocess mode; scrape each worker
+# or put them behind a single-worker exporter.
+import bisect
+import contextvars
+import logging
+import threading
+import time
+from flask import g, has_request_context, request, before_render_template, template_rendered
+from config import Config
+
+slow_query_log = logging.getLogger('janseva.slow_query')
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64)
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        for label_values, (counts, total, count) in sorted(series.items()):
+            labels = _labels(self.labels, label_values)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total}')
+            lines.append(f'{self.name}_count{{{labels}}} {count}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            labels = _labels(self.labels, label_values)
+            lines.append(f'{self.name}{{{labels}}} {value}' if labels else f'{self.name} {value}')
+        return lines
+
+
+def _labels(names, values):
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for value in values)
+    return ','.join(f'{name}="{value}"' for name, value in zip(names, escaped))
+
+
+REQUEST_SECONDS = Histogram(
+    'janseva_request_duration_seconds', 'Wall time of each request', ('route', 'method'))
+REQUEST_SQL_STATEMENTS = Histogram(
+    'janseva_request_sql_statements', 'SQL statements executed per request', ('route',), COUNT_BUCKETS)
+REQUEST_DB_SECONDS = Histogram(
+    'janseva_request_db_seconds', 'Time spent executing SQL and reading results per request', ('route',))
+REQUEST_ACQUIRE_SECONDS = Histogram(
+    'janseva_request_connection_acquire_seconds', 'Time spent waiting for pooled connections per request',
+    ('route',))
+REQUEST_RENDER_SECONDS = Histogram(
+    'janseva_request_render_seconds', 'Time spent rendering templates per request', ('route',))
+REQUESTS_TOTAL = Counter(
+    'janseva_requests_total', 'Requests handled', ('route', 'method', 'status'))
+SQL_STATEMENTS_TOTAL = Counter(
+    'janseva_sql_statements_total', 'SQL statements executed, including outside requests')
+SLOW_QUERIES_TOTAL = Counter(
+    'janseva_slow_queries_total', 'Statements slower than SLOW_QUERY_MS')
+
+REGISTRY = [
+    REQUEST_SECONDS, REQUEST_SQL_STATEMENTS, REQUEST_DB_SECONDS, REQUEST_ACQUIRE_SECONDS,
+    REQUEST_RENDER_SECONDS, REQUESTS_TOTAL, SQL_STATEMENTS_TOTAL, SLOW_QUERIES_TOTAL,
+]
+
+# Callables returning {name: value} for subsystems that keep their own counters
+_collectors = {}
+
+
+def register_collector(prefix, collect):
+    _collectors[prefix] = collect
+
+
+# Per-request counters of the ASGI app's views, which run outside Flask's
+# request context
+_async_request = contextvars.ContextVar('janseva_async_request', default=None)
+
+
+def _current():
+    if has_request_context():
+        return g.get('_metrics')
+    return _async_request.get()
+
+
+def record_query(statement, elapsed):
+    SQL_STATEMENTS_TOTAL.inc()
+    current = _current()
+    if current is not None:
+        current['sql_count'] += 1
+        current['db_time'] += elapsed
+    if Config.SLOW_QUERY_MS and elapsed * 1000 >= Config.SLOW_QUERY_MS:
+        SLOW_QUERIES_TOTAL.inc()
+        if isinstance(statement, bytes):
+            statement = statement.decode('utf-8', 'replace')
+        slow_query_log.warning('%.1f ms: %s', elapsed * 1000, ' '.join(str(statement).split()))
+
+
+def record_fetch(elapsed):
+    current = _current()
+    if current is not None:
+        current['db_time'] += elapsed
+
+
+def record_acquire(elapsed):
+    current = _current()
+    if current is not None:
+        current['acquire_time'] += elapsed
+
+
+# Cursor wrapper that times statements and row fetches
+class InstrumentedCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._cursor.close()
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._cursor.execute(operation, params, *args, **kwargs)
+        finally:
+            record_query(operation, time.perf_counter() - start)
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._cursor.executemany(operation, seq_params, *args, **kwargs)
+        finally:
+            record_query(operation, time.perf_counter() - start)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        try:
+            return self._cursor.fetchone()
+        finally:
+            record_fetch(time.perf_counter() - start)
+
+    def fetchmany(self, size=1):
+        start = time.perf_counter()
+        try:
+            return self._cursor.fetchmany(size)
+        finally:
+            record_fetch(time.perf_counter() - start)
+
+    def fetchall(self):
+        start = time.perf_counter()
+        try:
+            return self._cursor.fetchall()
+        finally:
+            record_fetch(time.perf_counter() - start)
+
+
+# InstrumentedCursor for mysql.connector.aio cursors
+class AsyncInstrumentedCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    async def execute(self, operation, params=None, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await self._cursor.execute(operation, params, *args, **kwargs)
+        finally:
+            record_query(operation, time.perf_counter() - start)
+
+    async def executemany(self, operation, seq_params, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await self._cursor.executemany(operation, seq_params, *args, **kwargs)
+        finally:
+            record_query(operation, time.perf_counter() - start)
+
+    async def fetchall(self):
+        start = time.perf_counter()
+        try:
+            return await self._cursor.fetchall()
+        finally:
+            record_fetch(time.perf_counter() - start)
+
+    async def close(self):
+        return await self._cursor.close()
+
+
+def _new_request():
+    return {
+        'start': time.perf_counter(),
+        'sql_count': 0,
+        'db_time': 0.0,
+        'acquire_time': 0.0,
+        'render_time': 0.0,
+    }
+
+
+def _observe(current, route, method, status):
+    REQUEST_SECONDS.observe(time.perf_counter() - current['start'], route, method)
+    REQUEST_SQL_STATEMENTS.observe(current['sql_count'], route)
+    REQUEST_DB_SECONDS.observe(current['db_time'], route)
+    REQUEST_ACQUIRE_SECONDS.observe(current['acquire_time'], route)
+    REQUEST_RENDER_SECONDS.observe(current['render_time'], route)
+    REQUESTS_TOTAL.inc(route, method, status)
+
+
+def _start_request():
+    g._metrics = _new_request()
+
+
+def _finish_request(response):
+    _record_request(response.status_code)
+    return response
+
+
+# after_request does not run when a view raises, so requests that end in a
+# 500 are recorded on teardown
+def _teardown_request(exc=None):
+    _record_request(500)
+
+
+def _record_request(status):
+    current = g.pop('_metrics', None)
+    if current is None:
+        return
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    _observe(current, route, request.method, status)
+
+
+# The same for a request to the ASGI app; each request runs in its own task,
+# so its counters stay separate from those of other requests
+def start_async_request():
+    _async_request.set(_new_request())
+
+
+def finish_async_request(route, method, status):
+    current = _async_request.get()
+    if current is not None:
+        _async_request.set(None)
+        _observe(current, route, method, status)
+
+
+def _before_render(sender, template, context, **extra):
+    current = _current()
+    if current is not None:
+        current['render_started'] = time.perf_counter()
+
+
+def _after_render(sender, template, context, **extra):
+    current = _current()
+    if current is not None and 'render_started' in current:
+        current['render_time'] += time.perf_counter() - current.pop('render_started')
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    for prefix, collect in sorted(_collectors.items()):
+        for name, value in sorted(collect().items()):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f'# TYPE janseva_{prefix}_{name} gauge')
+                lines.append(f'janseva_{prefix}_{name} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def init_app(app):
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_teardown_request)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
@@ -0,0 +1,130 @@
+# Schema migrations.
+#
+#   python migrate.py status     # list applied and pending migrations
+#   python migrate.py upgrade    # apply pending migrations
+#   python migrate.py recreate   # drop the database, create it and upgrade
+#
+# Run upgrade once per deploy, before starting the workers. The app never
+# touches the schema itself, so a worker boots without a database round trip.
+# Applied versions are recorded in schema_migrations; an advisory lock keeps
+# two deploys from migrating at the same time.
+import argparse
+import sys
+import time
+import mysql.connector
+from mysql.connector import Error
+from config import Config
+import migrations
+
+LOCK_NAME = 'janseva_migrate'
+LOCK_TIMEOUT = 60
+
+
+def connect(database=True):
+    return mysql.connector.connect(
+        host=Config.MYSQL_HOST,
+        port=Config.MYSQL_PORT,
+        user=Config.MYSQL_USER,
+        password=Config.MYSQL_PASSWORD,
+        database=Config.MYSQL_DB if database else None
+    )
+
+
+def ensure_version_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def applied_versions(cursor):
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def upgrade(connection, verbose=True):
+    cursor = connection.cursor(buffered=True)
+    try:
+        cursor.execute("SELECT GET_LOCK(%s, %s)", (LOCK_NAME, LOCK_TIMEOUT))
+        if cursor.fetchone()[0] != 1:
+            raise RuntimeError('Another migration is running')
+        try:
+            ensure_version_table(cursor)
+            done = applied_versions(cursor)
+            applied = 0
+            for version, name, module in migrations.load():
+                if version in done:
+                    continue
+                start = time.perf_counter()
+                module.upgrade(cursor)
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name)
+                )
+                connection.commit()
+                applied += 1
+                if verbose:
+                    print(f"Applied {version:04d}_{name} ({time.perf_counter() - start:.2f}s)")
+            return applied
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+            cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def status(connection):
+    cursor = connection.cursor(buffered=True)
+    try:
+        ensure_version_table(cursor)
+        done = applied_versions(cursor)
+    finally:
+        cursor.close()
+    pending = 0
+    for version, name, _ in migrations.load():
+        state = 'applied' if version in done else 'pending'
+        pending += version not in done
+        print(f"{version:04d}_{name:<32}{state}")
+    return pending
+
+
+def recreate():
+    connection = connect(database=False)
+    try:
+        cursor = connection.cursor()
+        cursor.execute(f"DROP DATABASE IF EXISTS {Config.MYSQL_DB}")
+        print(f"Dropped database {Config.MYSQL_DB}")
+        cursor.execute(f"CREATE DATABASE {Config.MYSQL_DB}")
+        print(f"Created database {Config.MYSQL_DB}")
+        cursor.close()
+    finally:
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['status', 'upgrade', 'recreate'])
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'recreate':
+            recreate()
+        connection = connect()
+        try:
+            if args.command == 'status':
+                # A non-zero exit status lets deploy scripts check for pending migrations
+                return 1 if status(connection) else 0
+            applied = upgrade(connection)
+            print(f"Schema up to date ({applied} migrations applied)")
+        finally:
+            connection.close()
+    except Error as e:
+        print(f"Migration failed: {e}")
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
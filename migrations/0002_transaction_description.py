@@ -0,0 +1,8 @@
+# Databases created before transactions had a description column (this was
+# fix_database.py)
+from migrations import column_exists
+
+
+def upgrade(cursor):
+    if not column_exists(cursor, 'transactions', 'description'):
+        cursor.execute("ALTER TABLE transactions ADD COLUMN description TEXT AFTER amount")
@@ -0,0 +1,7 @@
+# History pages and exports read one user's transactions newest first
+from migrations import index_exists
+
+
+def upgrade(cursor):
+    if not index_exists(cursor, 'transactions', 'idx_transactions_user_created'):
+        cursor.execute("CREATE INDEX idx_transactions_user_created ON transactions (user_id, created_at)")
@@ -0,0 +1,14 @@
+# Stored responses for requests sent with an Idempotency-Key
+
+
+def upgrade(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            user_id INT NOT NULL,
+            idempotency_key VARCHAR(64) NOT NULL,
+            response MEDIUMTEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, idempotency_key),
+            INDEX idx_idempotency_created (created_at)
+        )
+    """)
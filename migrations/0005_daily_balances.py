@@ -0,0 +1,23 @@
+# Daily balance snapshots maintained by snapshots.py
+
+
+def upgrade(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS daily_balances (
+            user_id INT NOT NULL,
+            day DATE NOT NULL,
+            closing_balance DECIMAL(14, 2) NOT NULL,
+            deposit_in DECIMAL(14, 2) NOT NULL DEFAULT 0.00,
+            withdraw_out DECIMAL(14, 2) NOT NULL DEFAULT 0.00,
+            transfer_in DECIMAL(14, 2) NOT NULL DEFAULT 0.00,
+            transfer_out DECIMAL(14, 2) NOT NULL DEFAULT 0.00,
+            PRIMARY KEY (user_id, day)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS snapshot_state (
+            id TINYINT PRIMARY KEY,
+            last_transaction_id INT NOT NULL,
+            last_transaction_at TIMESTAMP NULL
+        )
+    """)
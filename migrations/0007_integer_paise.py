@@ -0,0 +1,28 @@
+# Store money as BIGINT paise instead of DECIMAL rupees (see money.py).
+#
+# Each column is converted through a new <column>_paise column that is
+# swapped in with a single ALTER, so an interrupted run can simply be run
+# again. Stop the app first: old code reads the new columns as rupees.
+from migrations import column_exists, column_type
+
+COLUMNS = [
+    ('users', 'balance', 'NOT NULL DEFAULT 0'),
+    ('transactions', 'amount', 'NOT NULL'),
+    ('transactions_archive', 'amount', 'NOT NULL'),
+    ('daily_balances', 'closing_balance', 'NOT NULL'),
+    ('daily_balances', 'deposit_in', 'NOT NULL DEFAULT 0'),
+    ('daily_balances', 'withdraw_out', 'NOT NULL DEFAULT 0'),
+    ('daily_balances', 'transfer_in', 'NOT NULL DEFAULT 0'),
+    ('daily_balances', 'transfer_out', 'NOT NULL DEFAULT 0'),
+]
+
+
+def upgrade(cursor):
+    for table, column, options in COLUMNS:
+        if column_type(cursor, table, column) != 'decimal':
+            continue
+        paise = f'{column}_paise'
+        if not column_exists(cursor, table, paise):
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {paise} BIGINT {options} AFTER {column}")
+        cursor.execute(f"UPDATE {table} SET {paise} = ROUND({column} * 100)")
+        cursor.execute(f"ALTER TABLE {table} DROP COLUMN {column}, RENAME COLUMN {paise} TO {column}")
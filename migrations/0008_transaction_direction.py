@@ -0,0 +1,88 @@
+# Record which way money moved, and for transfers the other account, as
+# columns instead of only in the description text. Rows written before this
+# are backfilled from the description in id-range chunks, each committed on
+# its own. Counterparties are matched by the username at the end of the
+# description, so an account renamed since has none.
+#
+# Also tables for reconcile.py, and an index that lets it sum a range of
+# users' transactions from the index alone. It takes the place of the
+# single-column index MySQL created for the user_id foreign key, which
+# idx_transactions_user_created already covers.
+from migrations import column_exists, index_exists
+
+CHUNK_SIZE = 50000
+
+TABLES = ('transactions', 'transactions_archive')
+
+
+def _backfill(cursor, table):
+    cursor.execute(f"SELECT COALESCE(MIN(id), 0), COALESCE(MAX(id), 0) FROM {table} WHERE direction IS NULL")
+    first, last = cursor.fetchone()
+    for start in range(first, last + 1, CHUNK_SIZE):
+        end = start + CHUNK_SIZE - 1
+        cursor.execute(
+            f"""
+            UPDATE {table}
+            SET direction = IF(type = 'deposit' OR (type = 'transfer' AND description LIKE 'Received%%'),
+                               'credit', 'debit')
+            WHERE id BETWEEN %s AND %s AND direction IS NULL
+            """,
+            (start, end)
+        )
+        cursor.execute(
+            f"""
+            UPDATE {table} t
+            JOIN users u ON u.username = SUBSTRING_INDEX(
+                t.description, IF(t.direction = 'credit', ' from ', ' to '), -1)
+            SET t.counterparty_id = u.id
+            WHERE t.id BETWEEN %s AND %s AND t.type = 'transfer' AND t.counterparty_id IS NULL
+            """,
+            (start, end)
+        )
+        cursor.execute("COMMIT")
+
+
+def upgrade(cursor):
+    for table in TABLES:
+        if not column_exists(cursor, table, 'direction'):
+            cursor.execute(
+                f"ALTER TABLE {table} ADD COLUMN direction ENUM('credit', 'debit') NULL AFTER type, "
+                "ADD COLUMN counterparty_id INT NULL AFTER direction"
+            )
+        _backfill(cursor, table)
+        cursor.execute(f"ALTER TABLE {table} MODIFY direction ENUM('credit', 'debit') NOT NULL")
+
+    if not index_exists(cursor, 'transactions', 'idx_transactions_user_ledger'):
+        cursor.execute(
+            "CREATE INDEX idx_transactions_user_ledger ON transactions (user_id, direction, amount)"
+        )
+    if index_exists(cursor, 'transactions', 'user_id'):
+        cursor.execute("DROP INDEX user_id ON transactions")
+    if not index_exists(cursor, 'transactions_archive', 'idx_archive_user_ledger'):
+        cursor.execute(
+            "CREATE INDEX idx_archive_user_ledger ON transactions_archive (user_id, direction, amount)"
+        )
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS reconciliation_runs (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            status ENUM('running', 'finished', 'failed') NOT NULL DEFAULT 'running',
+            chunks_total INT NOT NULL,
+            chunks_done INT NOT NULL DEFAULT 0,
+            users_checked BIGINT NOT NULL DEFAULT 0,
+            transactions_scanned BIGINT NOT NULL DEFAULT 0,
+            mismatches INT NOT NULL DEFAULT 0,
+            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS reconciliation_mismatches (
+            run_id INT NOT NULL,
+            user_id INT NOT NULL,
+            balance BIGINT NOT NULL,
+            ledger_balance BIGINT NOT NULL,
+            difference BIGINT NOT NULL,
+            PRIMARY KEY (run_id, user_id)
+        )
+    """)
@@ -0,0 +1,21 @@
+# Idempotency keys are stored with the operation they belong to as a prefix
+# ("deposit:<key>"), so the column grows to fit the longest prefix. Keys
+# stored before this get the prefix of the result they hold; rows without a
+# typed result are batch transfers.
+PREFIXED = "^(deposit|withdraw|transfer|transfer_batch):"
+
+
+def upgrade(cursor):
+    cursor.execute("ALTER TABLE idempotency_keys MODIFY idempotency_key VARCHAR(80) NOT NULL")
+    cursor.execute(
+        """
+        UPDATE idempotency_keys
+        SET idempotency_key = CONCAT(
+            IF(JSON_UNQUOTE(JSON_EXTRACT(response, '$.type')) IN ('deposit', 'withdraw', 'transfer'),
+               JSON_UNQUOTE(JSON_EXTRACT(response, '$.type')), 'transfer_batch'),
+            ':', idempotency_key)
+        WHERE idempotency_key NOT REGEXP %s
+        """,
+        (PREFIXED,)
+    )
+    cursor.execute("COMMIT")
@@ -0,0 +1,54 @@
+# Numbered schema migrations, applied in order by migrate.py.
+#
+# Each migration is a module named NNNN_description.py with an
+# upgrade(cursor) function. MySQL commits DDL implicitly, so a migration can
+# be interrupted after its changes but before it is recorded; write every
+# migration so that running it again is harmless.
+import importlib
+import os
+import re
+
+_NAME = re.compile(r'^(\d{4})_(\w+)\.py$')
+
+
+# [(version, name, module)] sorted by version
+def load():
+    found = []
+    for filename in os.listdir(os.path.dirname(__file__)):
+        match = _NAME.match(filename)
+        if match:
+            module = importlib.import_module(f'{__name__}.{filename[:-3]}')
+            found.append((int(match.group(1)), match.group(2), module))
+    found.sort(key=lambda migration: migration[0])
+    versions = [version for version, _, _ in found]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError('Two migrations share a version number')
+    return found
+
+
+def column_exists(cursor, table, column):
+    cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.columns "
+        "WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s",
+        (table, column)
+    )
+    return cursor.fetchone()[0] > 0
+
+
+def index_exists(cursor, table, index):
+    cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.statistics "
+        "WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s",
+        (table, index)
+    )
+    return cursor.fetchone()[0] > 0
+
+
+def column_type(cursor, table, column):
+    cursor.execute(
+        "SELECT data_type FROM information_schema.columns "
+        "WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s",
+        (table, column)
+    )
+    row = cursor.fetchone()
+    return row[0].lower() if row else None
@@ -1,58 +0,0 @@
-from flask_mysqldb import MySQL
-import mysql.connector
-from mysql.connector import Error
-
-def create_connection():
-    try:
-        connection = mysql.connector.connect(
-            host='localhost',
-            user='root',
-            password='India@12345',
-            database='janseva_bank'
-        )
-        return connection
-    except Error as e:
-        print(f"Error connecting to MySQL: {e}")
-        return None
-
-def init_db():
-    connection = create_connection()
-    if connection:
-        try:
-            cursor = connection.cursor()
-            
-            # Create users table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    username VARCHAR(100) UNIQUE NOT NULL,
-                    aadhar VARCHAR(12) UNIQUE NOT NULL,
-                    password VARCHAR(255) NOT NULL,
-                    balance DECIMAL(10, 2) DEFAULT 0.00,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Create transactions table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS transactions (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    user_id INT NOT NULL,
-                    type ENUM('deposit', 'withdraw', 'transfer') NOT NULL,
-                    amount DECIMAL(10, 2) NOT NULL,
-                    description TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(id)
-                )
-            """)
-            
-            connection.commit()
-            print("Database initialized successfully")
-        except Error as e:
-            print(f"Error initializing database: {e}")
-        finally:
-            cursor.close()
-            connection.close()
-
-# Initialize the database when this module is imported
-init_db()
\ No newline at end of file
@@ -0,0 +1,48 @@
+# Money as integer paise.
+#
+# Balances and amounts are stored in BIGINT columns as paise (₹12.50 is
+# 1250) and every calculation in the app is plain int arithmetic, so there
+# are no float rounding errors, no Decimal contexts and nothing for the
+# driver to convert beyond an int. Rupees only appear at the edges: parse()
+# for what users type in, format_paise() for what they read.
+
+# The largest single amount accepted, ₹9,99,99,999.99 (what the old
+# DECIMAL(10, 2) columns could hold)
+MAX_AMOUNT = 99_999_999_99
+# Rupee digits in MAX_AMOUNT; longer input is rejected before converting it
+MAX_RUPEE_DIGITS = len(str(MAX_AMOUNT // 100))
+
+
+# Paise for a positive amount in rupees with at most 2 decimals, given as a
+# string or number; None if it is not one
+def parse(value):
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, int):
+        paise = value * 100
+    else:
+        rupees, _, fraction = str(value).strip().partition('.')
+        if not (rupees.isdigit() and rupees.isascii()) or len(fraction) > 2:
+            return None
+        rupees = rupees.lstrip('0') or '0'
+        if len(rupees) > MAX_RUPEE_DIGITS:
+            return None
+        paise = int(rupees) * 100
+        if fraction:
+            if not (fraction.isdigit() and fraction.isascii()):
+                return None
+            paise += int(fraction) * 10 if len(fraction) == 1 else int(fraction)
+    if paise <= 0 or paise > MAX_AMOUNT:
+        return None
+    return paise
+
+
+# '1234.50' for 123450, the form used in descriptions, CSV and JSON
+def format_paise(paise):
+    if paise < 0:
+        return '-' + format_paise(-paise)
+    return '%d.%02d' % divmod(paise, 100)
+
+
+def init_app(app):
+    app.jinja_env.filters['money'] = format_paise
@@ -0,0 +1,170 @@
+# Rendered page and fragment caching.
+#
+# Pages that only vary by whether someone is logged in (home, about) are
+# rendered once per variant and served from memory afterwards. Layout pieces
+# shared by every page are wrapped in
+#
+#   {% cache 'header', 'user' if session.user_id else 'anonymous' %}
+#       ...
+#   {% endcache %}
+#
+# and rendered once per key. Flashed messages are never cached: a request
+# with messages waiting renders the page normally, which also pops them.
+# Cached output is kept per worker process and only changes on deploy, so
+# there is nothing to invalidate. PAGE_CACHE=0 turns all of it off.
+import functools
+import threading
+import time
+from collections import OrderedDict
+from flask import request, session
+from jinja2 import nodes
+from jinja2.ext import Extension
+from config import Config
+
+metrics = {
+    'page_hits': 0,
+    'page_misses': 0,
+    'fragment_hits': 0,
+    'fragment_misses': 0,
+    'templates_compiled': 0,
+}
+
+
+class RenderCache:
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_pages = RenderCache()
+_fragments = RenderCache()
+
+
+class FragmentCacheExtension(Extension):
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key_parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key_parts.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        call = self.call_method('_render', [nodes.List(key_parts)])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render(self, key_parts, caller):
+        if not Config.PAGE_CACHE:
+            return caller()
+        key = tuple(key_parts)
+        fragment = _fragments.get(key)
+        if fragment is None:
+            metrics['fragment_misses'] += 1
+            fragment = caller()
+            if self.environment.is_async:
+                # The ASGI app's templates render async and caller() returns
+                # a coroutine; Jinja awaits what this returns
+                return self._store_async(key, fragment)
+            _fragments.set(key, fragment)
+        else:
+            metrics['fragment_hits'] += 1
+        return fragment
+
+    async def _store_async(self, key, pending):
+        fragment = await pending
+        _fragments.set(key, fragment)
+        return fragment
+
+
+# Cache a view's HTML per path and login state. Only for views whose output
+# depends on nothing else.
+def cached_page(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = _page_key(request, session)
+        if key is None:
+            return view(*args, **kwargs)
+        page = _cached(key)
+        if page is None:
+            page = _keep(key, view(*args, **kwargs))
+        return page
+    return wrapper
+
+
+# cached_page() for the ASGI app's coroutine views
+def cached_page_async(view):
+    from quart import request, session
+
+    @functools.wraps(view)
+    async def wrapper(*args, **kwargs):
+        key = _page_key(request, session, 'asgi')
+        if key is None:
+            return await view(*args, **kwargs)
+        page = _cached(key)
+        if page is None:
+            page = _keep(key, await view(*args, **kwargs))
+        return page
+    return wrapper
+
+
+def _page_key(request, session, app='wsgi'):
+    if not Config.PAGE_CACHE or request.method != 'GET' or session.get('_flashes'):
+        return None
+    return (app, request.path, 'user' if session.get('user_id') else 'anonymous')
+
+
+def _cached(key):
+    page = _pages.get(key)
+    if page is not None:
+        metrics['page_hits'] += 1
+        return page
+    metrics['page_misses'] += 1
+    return None
+
+
+def _keep(key, page):
+    if isinstance(page, str):
+        _pages.set(key, page)
+    return page
+
+
+# Compile every template now instead of on the first request that uses it
+def warm_up(app):
+    start = time.perf_counter()
+    for name in app.jinja_env.list_templates(extensions=('html',)):
+        app.jinja_env.get_template(name)
+        metrics['templates_compiled'] += 1
+    metrics['warm_up_ms'] = round((time.perf_counter() - start) * 1000, 1)
+    return metrics['warm_up_ms']
+
+
+def clear():
+    _pages.clear()
+    _fragments.clear()
+
+
+def stats():
+    return dict(metrics)
+
+
+def init_app(app):
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    if Config.TEMPLATE_WARM_UP:
+        warm_up(app)
@@ -0,0 +1,203 @@
+# Rate limiting and admission control for the endpoints that hash passwords
+# or move money.
+#
+# Every POST to an endpoint listed in Config.RATE_LIMITS takes a token from
+# two buckets, one for the client IP and one for the logged-in user, and is
+# answered with 429 and a Retry-After header when either is empty.
+# RATE_LIMITS in the environment changes or turns off the buckets (see
+# parse_limits). The
+# buckets live in a kvstore.Store inside the worker (RATE_LIMIT_BACKEND
+# 'local') or in the kvstore server shared by all workers ('shared'); both
+# buckets are checked in a single call. If the shared store is unreachable
+# requests are let through rather than locking everybody out.
+#
+# Admitted requests also need one of MAX_INFLIGHT slots in the worker; when
+# they are all busy the request is shed with 503 straight away instead of
+# queueing for a database connection. Both checks run in before_request,
+# before any view code touches the database.
+#
+# API clients get the refusal as JSON. A browser posting one of the HTML
+# forms gets the form back with the message flashed, under the same status
+# and Retry-After header.
+import os
+import threading
+import time
+from flask import flash, g, jsonify, make_response, render_template, request, session
+from cache import peek_account_summary
+from config import Config
+from kvstore import KVClient, KVError, Store
+import sessions
+
+metrics = {
+    'admitted': 0,
+    'rate_limited': 0,
+    'shed': 0,
+    'store_errors': 0,
+}
+
+# Form endpoints and the template each is re-rendered with when turned away
+PAGES = {
+    'login': 'login.html',
+    'register': 'register.html',
+    'deposit': 'deposit.html',
+    'withdraw': 'withdraw.html',
+    'transfer': 'transfer.html',
+}
+# Of those, the ones that show the account balance
+BALANCE_PAGES = ('deposit', 'withdraw', 'transfer')
+
+
+# Config.RATE_LIMITS with the overrides applied. overrides is 'off', or a
+# comma-separated list of endpoint=count/seconds and endpoint=off. An
+# endpoint that is off keeps its MAX_INFLIGHT cap but takes no tokens.
+def parse_limits(limits, overrides):
+    limits = dict(limits)
+    overrides = overrides.strip()
+    if overrides == 'off':
+        return dict.fromkeys(limits)
+    for item in filter(None, (part.strip() for part in overrides.split(','))):
+        endpoint, _, limit = item.partition('=')
+        if endpoint not in limits:
+            raise ValueError(f'RATE_LIMITS: unknown endpoint {endpoint!r}')
+        if limit == 'off':
+            limits[endpoint] = None
+        else:
+            count, _, seconds = limit.partition('/')
+            limits[endpoint] = (int(count), float(seconds))
+    return limits
+
+
+class RateLimiter:
+    def __init__(self, store, limits, max_inflight):
+        self.store = store
+        # endpoint -> (tokens per second, burst), or None for no buckets
+        self.limits = {
+            endpoint: (limit[0] / limit[1], limit[0]) if limit else None
+            for endpoint, limit in limits.items()
+        }
+        self.max_inflight = max_inflight
+        self._slots = threading.BoundedSemaphore(max_inflight) if max_inflight else None
+
+    # Seconds the client has to wait, or 0 if the request may go ahead
+    def check(self, endpoint, address, user_id=None):
+        if self.limits[endpoint] is None:
+            return 0
+        rate, burst = self.limits[endpoint]
+        buckets = [[f'rl:{endpoint}:ip:{address}', rate, burst]]
+        if user_id is not None:
+            buckets.append([f'rl:{endpoint}:user:{user_id}', rate, burst])
+        try:
+            return self.store.take(buckets)
+        except KVError:
+            metrics['store_errors'] += 1
+            return 0
+
+    def enter(self):
+        return self._slots is None or self._slots.acquire(blocking=False)
+
+    def leave(self):
+        if self._slots is not None:
+            self._slots.release()
+
+    # None if the request is admitted (call leave() when it is done),
+    # otherwise (message, status, seconds to wait)
+    def admit(self, endpoint, address, user_id=None):
+        wait = self.check(endpoint, address, user_id)
+        if wait:
+            metrics['rate_limited'] += 1
+            return 'Too many requests, slow down', 429, wait
+        if not self.enter():
+            metrics['shed'] += 1
+            return 'Server busy, retry shortly', 503, 1
+        metrics['admitted'] += 1
+        return None
+
+
+_limiter = None
+_limiter_pid = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    global _limiter, _limiter_pid
+    pid = os.getpid()
+    if _limiter is None or _limiter_pid != pid:
+        with _limiter_lock:
+            if _limiter is None or _limiter_pid != pid:
+                if Config.RATE_LIMIT_BACKEND == 'shared':
+                    store = KVClient(Config.RATE_LIMIT_KV_ADDRESS)
+                else:
+                    store = Store()
+                    threading.Thread(target=_sweep, args=(store,), name='rate-limit-sweeper', daemon=True).start()
+                _limiter = RateLimiter(
+                    store, parse_limits(Config.RATE_LIMITS, Config.RATE_LIMIT_OVERRIDES), Config.MAX_INFLIGHT
+                )
+                _limiter_pid = pid
+    return _limiter
+
+
+def _sweep(store, interval=60):
+    while True:
+        time.sleep(interval)
+        store.sweep()
+
+
+def retry_after(seconds):
+    return str(max(1, int(seconds + 0.999)))
+
+
+# True when the refusal should be rendered as the HTML form rather than JSON
+def wants_page(request):
+    if request.endpoint not in PAGES or request.is_json:
+        return False
+    return request.accept_mimetypes.best_match(['text/html', 'application/json']) != 'application/json'
+
+
+# The balance from the session's or the account cache's copy, or None. A
+# refused request never goes to the database: the 503 is there to shed load.
+def known_balance(session):
+    if 'user_id' not in session:
+        return None
+    summary = sessions.account_summary(session, session['user_id'], peek_account_summary)
+    return summary['balance'] if summary else None
+
+
+def _reject(message, status, wait):
+    if wants_page(request):
+        flash(message, 'danger')
+        context = {}
+        if request.endpoint in BALANCE_PAGES:
+            context['balance'] = known_balance(session)
+        response = make_response(render_template(PAGES[request.endpoint], **context), status)
+    else:
+        response = jsonify({'error': message})
+        response.status_code = status
+    response.headers['Retry-After'] = retry_after(wait)
+    return response
+
+
+def _admit():
+    if request.method != 'POST':
+        return None
+    limiter = get_limiter()
+    if request.endpoint not in limiter.limits:
+        return None
+    rejected = limiter.admit(request.endpoint, request.remote_addr, session.get('user_id'))
+    if rejected:
+        return _reject(*rejected)
+    g._admitted = True
+    return None
+
+
+def _release(exc=None):
+    if g.pop('_admitted', False):
+        get_limiter().leave()
+
+
+def stats():
+    return dict(metrics)
+
+
+def init_app(app):
+    app.before_request(_admit)
+    app.teardown_request(_release)
@@ -0,0 +1,206 @@
+# Checks that every balance equals the sum of the account's ledger.
+#
+#   python reconcile.py run       # check every user, report mismatches
+#   python reconcile.py status    # progress of the latest run
+#
+# Users are split into id ranges of RECONCILE_CHUNK_SIZE, and the ranges are
+# checked by RECONCILE_WORKERS processes. For each range a worker opens a
+# read-only consistent snapshot, reads the balances, then sums credits minus
+# debits per user over transactions and transactions_archive. Ledger writes
+# change a balance and add its rows in one transaction, so within a snapshot
+# the two always agree unless something is actually wrong. The reads take
+# no locks and go to a replica when one is configured, so live traffic is
+# not held up; the sums are answered from the (user_id, direction, amount)
+# indexes and read through an unbuffered cursor, a batch of rows at a time.
+#
+# Progress is kept in reconciliation_runs after every chunk, and each
+# mismatch is written to reconciliation_mismatches.
+import argparse
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from config import Config
+from db import get_db_connection, get_read_connection
+
+FETCH_SIZE = 5000
+
+LEDGER_QUERY = """
+    SELECT user_id,
+           CAST(SUM(IF(direction = 'credit', amount, -amount)) AS SIGNED),
+           COUNT(*)
+    FROM {table}
+    WHERE user_id BETWEEN %s AND %s
+    GROUP BY user_id
+"""
+
+
+def _stream(cursor):
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            return
+        yield from rows
+
+
+# Check users first_id..last_id; runs in a worker process
+def check_chunk(first_id, last_id, pause=0.0):
+    start = time.perf_counter()
+    connection = get_read_connection()
+    if not connection:
+        raise RuntimeError('Database connection failed')
+    cursor = connection.cursor()
+    try:
+        cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT, READ ONLY")
+        cursor.execute("SELECT id, balance FROM users WHERE id BETWEEN %s AND %s", (first_id, last_id))
+        balances = dict(_stream(cursor))
+        ledger = {}
+        scanned = 0
+        for table in ('transactions', 'transactions_archive'):
+            cursor.execute(LEDGER_QUERY.format(table=table), (first_id, last_id))
+            for user_id, total, count in _stream(cursor):
+                ledger[user_id] = ledger.get(user_id, 0) + total
+                scanned += count
+        connection.commit()
+    finally:
+        cursor.close()
+        connection.close()
+
+    mismatches = [
+        (user_id, balance, ledger.get(user_id, 0))
+        for user_id, balance in balances.items()
+        if balance != ledger.get(user_id, 0)
+    ]
+    if pause:
+        time.sleep(pause)
+    return {
+        'users': len(balances),
+        'transactions': scanned,
+        'mismatches': mismatches,
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def _chunks(connection, chunk_size):
+    cursor = connection.cursor(buffered=True)
+    try:
+        cursor.execute("SELECT COALESCE(MIN(id), 0), COALESCE(MAX(id), -1) FROM users")
+        first, last = cursor.fetchone()
+    finally:
+        cursor.close()
+    return [(start, min(start + chunk_size - 1, last)) for start in range(first, last + 1, chunk_size)]
+
+
+def _record(connection, run_id, result):
+    cursor = connection.cursor()
+    try:
+        if result['mismatches']:
+            cursor.executemany(
+                "INSERT INTO reconciliation_mismatches (run_id, user_id, balance, ledger_balance, difference) "
+                "VALUES (%s, %s, %s, %s, %s)",
+                [(run_id, user_id, balance, ledger, balance - ledger)
+                 for user_id, balance, ledger in result['mismatches']]
+            )
+        cursor.execute(
+            "UPDATE reconciliation_runs SET chunks_done = chunks_done + 1, "
+            "users_checked = users_checked + %s, transactions_scanned = transactions_scanned + %s, "
+            "mismatches = mismatches + %s WHERE id = %s",
+            (result['users'], result['transactions'], len(result['mismatches']), run_id)
+        )
+        connection.commit()
+    finally:
+        cursor.close()
+
+
+def _finish(connection, run_id, status):
+    cursor = connection.cursor()
+    try:
+        cursor.execute("UPDATE reconciliation_runs SET status = %s WHERE id = %s", (status, run_id))
+        connection.commit()
+    finally:
+        cursor.close()
+
+
+# Reconcile every user; returns the run id
+def run(connection, workers=None, chunk_size=None, pause=0.0, verbose=False):
+    workers = workers or Config.RECONCILE_WORKERS
+    chunks = _chunks(connection, chunk_size or Config.RECONCILE_CHUNK_SIZE)
+    cursor = connection.cursor()
+    cursor.execute("INSERT INTO reconciliation_runs (chunks_total) VALUES (%s)", (len(chunks),))
+    run_id = cursor.lastrowid
+    connection.commit()
+    cursor.close()
+
+    start = time.perf_counter()
+    users = scanned = mismatches = 0
+    status = 'failed'
+    try:
+        context = multiprocessing.get_context('forkserver')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            futures = [executor.submit(check_chunk, first, last, pause) for first, last in chunks]
+            for done, future in enumerate(as_completed(futures), 1):
+                result = future.result()
+                _record(connection, run_id, result)
+                users += result['users']
+                scanned += result['transactions']
+                mismatches += len(result['mismatches'])
+                if verbose:
+                    elapsed = time.perf_counter() - start
+                    print(f"[{done}/{len(chunks)}] {users} users, {scanned} transactions "
+                          f"({scanned / elapsed:.0f} rows/s), {mismatches} mismatches")
+        status = 'finished'
+    finally:
+        _finish(connection, run_id, status)
+    return run_id
+
+
+def status(connection, run_id=None):
+    cursor = connection.cursor(dictionary=True, buffered=True)
+    try:
+        if run_id:
+            cursor.execute("SELECT * FROM reconciliation_runs WHERE id = %s", (run_id,))
+        else:
+            cursor.execute("SELECT * FROM reconciliation_runs ORDER BY id DESC LIMIT 1")
+        report = cursor.fetchone()
+        if report is None:
+            print("No reconciliation runs yet")
+            return None
+        elapsed = max((report['updated_at'] - report['started_at']).total_seconds(), 1)
+        print(f"Run {report['id']} {report['status']}: {report['chunks_done']}/{report['chunks_total']} chunks, "
+              f"{report['users_checked']} users, {report['transactions_scanned']} transactions "
+              f"({report['transactions_scanned'] / elapsed:.0f} rows/s), {report['mismatches']} mismatches")
+        cursor.execute(
+            "SELECT user_id, balance, ledger_balance, difference FROM reconciliation_mismatches "
+            "WHERE run_id = %s ORDER BY ABS(difference) DESC LIMIT 20",
+            (report['id'],)
+        )
+        for row in cursor.fetchall():
+            print(f"  user {row['user_id']}: balance {row['balance']} ledger {row['ledger_balance']} "
+                  f"(off by {row['difference']} paise)")
+        return report
+    finally:
+        cursor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['run', 'status'])
+    parser.add_argument('--workers', type=int, default=Config.RECONCILE_WORKERS)
+    parser.add_argument('--chunk', type=int, default=Config.RECONCILE_CHUNK_SIZE, help='users per chunk')
+    parser.add_argument('--pause', type=float, default=0.0, help='seconds each worker sleeps between chunks')
+    parser.add_argument('--run-id', type=int)
+    args = parser.parse_args()
+
+    connection = get_db_connection()
+    if not connection:
+        return
+    try:
+        run_id = args.run_id
+        if args.command == 'run':
+            run_id = run(connection, args.workers, args.chunk, args.pause, verbose=True)
+        status(connection, run_id)
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
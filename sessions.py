@@ -0,0 +1,242 @@
+# Server-side sessions.
+#
+# With SESSION_BACKEND set to 'local' or 'shared', the session cookie holds
+# only an opaque id and the session itself is kept in a key/value store:
+#
+#   local   a kvstore.Store inside the worker process; only for a single
+#           worker, since other workers cannot see its sessions
+#   shared  the kvstore server (SESSION_KV_ADDRESS, a unix socket or
+#           host:port) shared by every gunicorn worker
+#
+# Sessions are stored as compact JSON with a sliding SESSION_TTL: every
+# request pushes the expiry forward. Expired sessions are removed in bulk by
+# a sweeper thread (local) or by the kvstore server's own sweeper (shared).
+#
+# A session can also hold a copy of the account summary, so that pages only
+# need the session lookup. Ledger writes record when each account was last
+# changed (mark_accounts_written); a copy taken before that time is
+# discarded.
+import json
+import os
+import re
+import secrets
+import threading
+import time
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+from config import Config
+from kvstore import KVClient, KVError, Store
+
+# "<user id>.<random token>"; the user id part is empty before login
+_SID = re.compile(r'^(\d*)\.[A-Za-z0-9_-]{32}$')
+
+
+def _session_key(sid):
+    return f'session:{sid}'
+
+
+def _written_key(user_id):
+    return f'account_written:{user_id}'
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, account_written_at=None):
+        def on_update(session):
+            session.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = sid is None
+        self.modified = False
+        self.account_written_at = account_written_at
+
+
+class ServerSideSessionInterface(SessionInterface):
+    # Without a store, the worker's get_session_store() is looked up on each
+    # request, so the app imports without touching it and gunicorn workers
+    # get their own after the fork
+    def __init__(self, store=None, ttl=None):
+        self._store = store
+        self.ttl = ttl or Config.SESSION_TTL
+
+    @property
+    def store(self):
+        return self._store if self._store is not None else get_session_store()
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        match = _SID.match(sid) if sid else None
+        if not match:
+            return ServerSession()
+
+        user_id = match.group(1)
+        keys = [_session_key(sid)] + ([_written_key(user_id)] if user_id else [])
+        try:
+            # The session and its account's last write time in one round trip
+            values = self.store.mget(*keys)
+        except KVError:
+            metrics['errors'] += 1
+            return ServerSession()
+        if values[0] is None:
+            return ServerSession()
+        data = json.loads(values[0])
+        if str(data.get('user_id', '')) != user_id:
+            return ServerSession()
+        return ServerSession(data, sid, values[1] if user_id else None)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.sid is not None:
+                # Logged out (session.clear())
+                self._call(self.store.delete, _session_key(session.sid))
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        user_id = str(session.get('user_id', ''))
+        set_cookie = False
+        if session.sid is None or session.sid.split('.', 1)[0] != user_id:
+            # New session, or the user logged in: issue a fresh id so that an
+            # id handed out before login is never authenticated
+            if session.sid is not None:
+                self._call(self.store.delete, _session_key(session.sid))
+            session.sid = f'{user_id}.{secrets.token_urlsafe(24)}'
+            set_cookie = True
+
+        key = _session_key(session.sid)
+        if session.modified or set_cookie:
+            payload = json.dumps(dict(session), separators=(',', ':'), default=str)
+            self._call(self.store.set, key, payload, self.ttl)
+        else:
+            self._call(self.store.expire, key, self.ttl)
+
+        if set_cookie:
+            response.set_cookie(
+                name, session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+    def _call(self, method, *args):
+        try:
+            return method(*args)
+        except KVError as e:
+            metrics['errors'] += 1
+            print(f"Session store error: {e}")
+            return None
+
+
+metrics = {
+    'errors': 0,
+    'account_hits': 0,
+    'account_misses': 0,
+}
+
+_store = None
+_store_pid = None
+_store_lock = threading.Lock()
+
+
+def _sweep(store, interval):
+    while True:
+        time.sleep(interval)
+        store.sweep()
+
+
+# The session store for this worker process, or None with cookie sessions
+def get_session_store():
+    global _store, _store_pid
+    if Config.SESSION_BACKEND not in ('local', 'shared'):
+        return None
+    pid = os.getpid()
+    if _store is None or _store_pid != pid:
+        with _store_lock:
+            if _store is None or _store_pid != pid:
+                if Config.SESSION_BACKEND == 'shared':
+                    _store = KVClient(Config.SESSION_KV_ADDRESS)
+                else:
+                    _store = Store()
+                    threading.Thread(
+                        target=_sweep, args=(_store, Config.SESSION_SWEEP_INTERVAL),
+                        name='session-sweeper', daemon=True
+                    ).start()
+                _store_pid = pid
+    return _store
+
+
+# Install server-side sessions on the app unless cookie sessions are configured
+def init_app(app):
+    if Config.SESSION_BACKEND in ('local', 'shared'):
+        app.session_interface = ServerSideSessionInterface()
+    return app.session_interface
+
+
+def stats():
+    return dict(metrics)
+
+
+# Record that these accounts changed, so sessions drop their cached copy
+def mark_accounts_written(*user_ids):
+    store = get_session_store()
+    if store is None or not user_ids:
+        return
+    now = time.time()
+    try:
+        # A copy older than SESSION_ACCOUNT_TTL is stale anyway, so the
+        # marker only has to live that long
+        store.mset({_written_key(user_id): now for user_id in user_ids}, Config.SESSION_ACCOUNT_TTL)
+    except KVError as e:
+        print(f"Session store error: {e}")
+
+
+# The account summary cached in this session, or a fresh one from load()
+def account_summary(session, user_id, load):
+    if not isinstance(session, ServerSession):
+        return load(user_id)
+    cached, now = _cached_summary(session, user_id)
+    if cached is not None:
+        return cached
+    summary = load(user_id)
+    _keep_summary(session, user_id, summary, now)
+    return summary
+
+
+# account_summary() with a coroutine function as load, for the ASGI app
+async def account_summary_async(session, user_id, load):
+    if not isinstance(session, ServerSession):
+        return await load(user_id)
+    cached, now = _cached_summary(session, user_id)
+    if cached is not None:
+        return cached
+    summary = await load(user_id)
+    _keep_summary(session, user_id, summary, now)
+    return summary
+
+
+def _cached_summary(session, user_id):
+    cached = session.get('_account')
+    now = time.time()
+    if (cached and cached['user_id'] == user_id
+            and now - cached['at'] < Config.SESSION_ACCOUNT_TTL
+            and (session.account_written_at is None or cached['at'] > session.account_written_at)):
+        metrics['account_hits'] += 1
+        return cached['summary'], now
+    metrics['account_misses'] += 1
+    return None, now
+
+
+def _keep_summary(session, user_id, summary, now):
+    if summary is not None:
+        # Timestamp taken before the load: a write that commits during the
+        # load is newer than the copy and invalidates it
+        session['_account'] = {
+            'user_id': user_id,
+            'at': now,
+            'summary': json.loads(json.dumps(summary, default=str)),
+        }
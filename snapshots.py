@@ -0,0 +1,313 @@
+# Daily balance snapshots.
+#
+# daily_balances holds, for every user and every day they had activity, the
+# closing balance and the money moved per transaction type. It is built
+# incrementally from the transactions table, in id order, starting after
+# the last transaction id recorded in snapshot_state. Run
+#
+#   python snapshots.py refresh     # roll up new transactions (cron)
+#   python snapshots.py rebuild     # start over from the first transaction
+#
+# Each chunk of transactions is rolled up in its own short transaction, so a
+# backfill never holds locks for long.
+import argparse
+import time
+from datetime import date, timedelta
+from config import Config
+from db import get_db_connection
+
+FIELDS = ('deposit_in', 'withdraw_out', 'transfer_in', 'transfer_out')
+
+# Per (user, day) totals for one id range of the transactions table
+ROLLUP_QUERY = """
+    SELECT
+        user_id,
+        DATE(created_at) AS day,
+        CAST(SUM(CASE WHEN type = 'deposit' THEN amount ELSE 0 END) AS SIGNED) AS deposit_in,
+        CAST(SUM(CASE WHEN type = 'withdraw' THEN amount ELSE 0 END) AS SIGNED) AS withdraw_out,
+        CAST(SUM(CASE WHEN type = 'transfer' AND direction = 'credit' THEN amount ELSE 0 END) AS SIGNED) AS transfer_in,
+        CAST(SUM(CASE WHEN type = 'transfer' AND direction = 'debit' THEN amount ELSE 0 END) AS SIGNED) AS transfer_out
+    FROM transactions
+    WHERE {where}
+    GROUP BY user_id, day
+    ORDER BY user_id, day
+"""
+
+STATE_QUERY = "SELECT last_transaction_id, last_transaction_at FROM snapshot_state WHERE id = 1"
+
+
+def _net(row):
+    return row['deposit_in'] + row['transfer_in'] - row['withdraw_out'] - row['transfer_out']
+
+
+def get_state(cursor):
+    cursor.execute(STATE_QUERY)
+    row = cursor.fetchone()
+    if row is None:
+        return 0, None
+    return row[0], row[1]
+
+
+# Roll up the next chunk of transactions. Returns the number of transaction
+# ids covered, 0 once the snapshots are up to date.
+def refresh_chunk(connection, chunk_size=None, lag_seconds=None):
+    chunk_size = chunk_size or Config.SNAPSHOT_CHUNK_SIZE
+    lag_seconds = Config.SNAPSHOT_LAG_SECONDS if lag_seconds is None else lag_seconds
+    cursor = connection.cursor(dictionary=True, buffered=True)
+    raw = connection.cursor(buffered=True)
+    try:
+        last_id, _ = get_state(raw)
+        # Leave out the newest rows: a transaction that is still open may
+        # hold a lower id than rows that are already committed
+        raw.execute(
+            "SELECT MAX(id), MAX(created_at) FROM transactions "
+            "WHERE id > %s AND id <= %s AND created_at < NOW() - INTERVAL %s SECOND",
+            (last_id, last_id + chunk_size, lag_seconds)
+        )
+        high_id, high_at = raw.fetchone()
+        if high_id is None:
+            raw.execute("SELECT MIN(id) FROM transactions WHERE id > %s", (last_id,))
+            next_id = raw.fetchone()[0]
+            if next_id is None or next_id <= last_id + chunk_size:
+                return 0
+            # Skip over a gap in the ids (rows that were archived or rolled back)
+            high_id, high_at = next_id - 1, None
+
+        cursor.execute(ROLLUP_QUERY.format(where="id > %s AND id <= %s"), (last_id, high_id))
+        groups = cursor.fetchall()
+        if groups:
+            _apply(cursor, groups)
+
+        raw.execute(
+            "INSERT INTO snapshot_state (id, last_transaction_id, last_transaction_at) VALUES (1, %s, %s) "
+            "ON DUPLICATE KEY UPDATE last_transaction_id = VALUES(last_transaction_id), "
+            "last_transaction_at = COALESCE(VALUES(last_transaction_at), last_transaction_at)",
+            (high_id, high_at)
+        )
+        connection.commit()
+        return high_id - last_id
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+        raw.close()
+
+
+def _apply(cursor, groups):
+    user_ids = sorted({group['user_id'] for group in groups})
+    placeholders = ', '.join(['%s'] * len(user_ids))
+    cursor.execute(
+        f"""
+        SELECT b.user_id, b.day, b.closing_balance
+        FROM daily_balances b
+        JOIN (
+            SELECT user_id, MAX(day) AS day FROM daily_balances
+            WHERE user_id IN ({placeholders}) GROUP BY user_id
+        ) latest ON latest.user_id = b.user_id AND latest.day = b.day
+        FOR UPDATE
+        """,
+        user_ids
+    )
+    latest = {row['user_id']: (row['day'], row['closing_balance']) for row in cursor.fetchall()}
+
+    upserts = []
+    for group in groups:
+        user_id, day, net = group['user_id'], group['day'], _net(group)
+        last_day, closing = latest.get(user_id, (None, 0))
+        if last_day is None or day >= last_day:
+            closing += net
+            latest[user_id] = (day, closing)
+            upserts.append((user_id, day, closing) + tuple(group[field] for field in FIELDS))
+        else:
+            # A late row for a day before the newest snapshot: fix that day and
+            # shift every later closing balance by the same amount
+            _apply_late(cursor, group, net)
+            latest[user_id] = (last_day, closing + net)
+
+    cursor.executemany(
+        """
+        INSERT INTO daily_balances
+            (user_id, day, closing_balance, deposit_in, withdraw_out, transfer_in, transfer_out)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            closing_balance = VALUES(closing_balance),
+            deposit_in = deposit_in + VALUES(deposit_in),
+            withdraw_out = withdraw_out + VALUES(withdraw_out),
+            transfer_in = transfer_in + VALUES(transfer_in),
+            transfer_out = transfer_out + VALUES(transfer_out)
+        """,
+        upserts
+    )
+
+
+def _apply_late(cursor, group, net):
+    user_id, day = group['user_id'], group['day']
+    cursor.execute(
+        "SELECT closing_balance FROM daily_balances WHERE user_id = %s AND day <= %s ORDER BY day DESC LIMIT 1",
+        (user_id, day)
+    )
+    previous = cursor.fetchone()
+    opening = previous['closing_balance'] if previous else 0
+    cursor.execute(
+        """
+        INSERT INTO daily_balances
+            (user_id, day, closing_balance, deposit_in, withdraw_out, transfer_in, transfer_out)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            closing_balance = closing_balance + %s,
+            deposit_in = deposit_in + VALUES(deposit_in),
+            withdraw_out = withdraw_out + VALUES(withdraw_out),
+            transfer_in = transfer_in + VALUES(transfer_in),
+            transfer_out = transfer_out + VALUES(transfer_out)
+        """,
+        (user_id, day, opening + net) + tuple(group[field] for field in FIELDS) + (net,)
+    )
+    cursor.execute(
+        "UPDATE daily_balances SET closing_balance = closing_balance + %s WHERE user_id = %s AND day > %s",
+        (net, user_id, day)
+    )
+
+
+def refresh(connection, chunk_size=None, pause=0.0, verbose=False):
+    total = 0
+    while True:
+        covered = refresh_chunk(connection, chunk_size)
+        if not covered:
+            return total
+        total += covered
+        if verbose:
+            print(f"Rolled up {total} transaction ids")
+        if pause:
+            time.sleep(pause)
+
+
+def _month_bounds(year, month):
+    start = date(year, month, 1)
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start, end
+
+
+OPENING_QUERY = (
+    "SELECT closing_balance FROM daily_balances WHERE user_id = %s AND day < %s "
+    "ORDER BY day DESC LIMIT 1"
+)
+
+DAYS_QUERY = (
+    "SELECT day, closing_balance, deposit_in, withdraw_out, transfer_in, transfer_out "
+    "FROM daily_balances WHERE user_id = %s AND day >= %s AND day < %s ORDER BY day"
+)
+
+TAIL_QUERY = ROLLUP_QUERY.format(where="user_id = %s AND created_at >= %s AND created_at < %s AND id > %s")
+
+
+# Recent activity not in the snapshots yet; bounded by created_at so that
+# the (user_id, created_at) index limits the scan
+def _tail_params(user_id, start, end, state):
+    last_id, last_at = state
+    tail_from = max(start, (last_at - timedelta(hours=1)).date()) if last_at else start
+    return user_id, tail_from, end, last_id
+
+
+# Statement for one month: opening and closing balance, totals per type and
+# one row per day with activity. Transactions that have not been rolled up
+# yet are added from the transactions table.
+def monthly_statement(connection, user_id, year, month):
+    start, end = _month_bounds(year, month)
+    cursor = connection.cursor(dictionary=True, buffered=True)
+    raw = connection.cursor(buffered=True)
+    try:
+        state = get_state(raw)
+        cursor.execute(OPENING_QUERY, (user_id, start))
+        previous = cursor.fetchone()
+        cursor.execute(DAYS_QUERY, (user_id, start, end))
+        days = cursor.fetchall()
+        cursor.execute(TAIL_QUERY, _tail_params(user_id, start, end, state))
+        tail = cursor.fetchall()
+    finally:
+        cursor.close()
+        raw.close()
+    return _statement(start, previous, days, tail)
+
+
+# monthly_statement() on a mysql.connector.aio connection
+async def monthly_statement_async(connection, user_id, year, month):
+    start, end = _month_bounds(year, month)
+    cursor = await connection.cursor(dictionary=True)
+    try:
+        await cursor.execute(STATE_QUERY)
+        rows = await cursor.fetchall()
+        state = (rows[0]['last_transaction_id'], rows[0]['last_transaction_at']) if rows else (0, None)
+        await cursor.execute(OPENING_QUERY, (user_id, start))
+        rows = await cursor.fetchall()
+        previous = rows[0] if rows else None
+        await cursor.execute(DAYS_QUERY, (user_id, start, end))
+        days = await cursor.fetchall()
+        await cursor.execute(TAIL_QUERY, _tail_params(user_id, start, end, state))
+        tail = await cursor.fetchall()
+    finally:
+        await cursor.close()
+    return _statement(start, previous, days, tail)
+
+
+def _statement(start, previous, days, tail):
+    opening = previous['closing_balance'] if previous else 0
+    days = {row['day']: row for row in days}
+    balance = opening
+    rows = []
+    for day in sorted(set(days) | {group['day'] for group in tail}):
+        row = dict(days.get(day) or {'day': day, **{field: 0 for field in FIELDS}})
+        for group in tail:
+            if group['day'] == day:
+                for field in FIELDS:
+                    row[field] += group[field]
+        balance += _net(row)
+        row['closing_balance'] = balance
+        rows.append(row)
+
+    totals = {field: sum(row[field] for row in rows) for field in FIELDS}
+    return {
+        'month': start,
+        'opening_balance': opening,
+        'closing_balance': balance,
+        'days': rows,
+        'totals': totals,
+        'money_in': totals['deposit_in'] + totals['transfer_in'],
+        'money_out': totals['withdraw_out'] + totals['transfer_out'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['refresh', 'rebuild'])
+    parser.add_argument('--chunk', type=int, default=Config.SNAPSHOT_CHUNK_SIZE,
+                        help='transaction ids per chunk')
+    parser.add_argument('--pause', type=float, default=0.05, help='seconds to sleep between chunks')
+    args = parser.parse_args()
+
+    connection = get_db_connection()
+    if not connection:
+        return
+    try:
+        if args.command == 'rebuild':
+            cursor = connection.cursor(buffered=True)
+            # Archived transactions are no longer in the transactions table,
+            # so a rebuild would start every balance from the wrong place
+            cursor.execute("SELECT 1 FROM transactions_archive LIMIT 1")
+            if cursor.fetchone():
+                cursor.close()
+                print("transactions_archive has rows, refusing to rebuild from transactions alone")
+                return
+            cursor.execute("DELETE FROM snapshot_state")
+            cursor.execute("TRUNCATE TABLE daily_balances")
+            connection.commit()
+            cursor.close()
+        start = time.perf_counter()
+        total = refresh(connection, args.chunk, args.pause, verbose=True)
+        print(f"Snapshots up to date ({total} transaction ids in {time.perf_counter() - start:.1f}s)")
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
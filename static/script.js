@@ -128,6 +128,34 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     });
     
+    // Receiver username suggestions on the transfer form
+    const receiverInput = document.querySelector('input[data-autocomplete]');
+    if (receiverInput) {
+        const suggestions = document.getElementById(receiverInput.getAttribute('list'));
+        let pending = null;
+        receiverInput.addEventListener('input', function() {
+            clearTimeout(pending);
+            const prefix = this.value.trim();
+            if (!prefix) {
+                suggestions.innerHTML = '';
+                return;
+            }
+            pending = setTimeout(() => {
+                fetch(`${receiverInput.dataset.autocomplete}?q=${encodeURIComponent(prefix)}`)
+                    .then(response => response.ok ? response.json() : [])
+                    .then(names => {
+                        suggestions.innerHTML = '';
+                        names.forEach(name => {
+                            const option = document.createElement('option');
+                            option.value = name;
+                            suggestions.appendChild(option);
+                        });
+                    })
+                    .catch(() => {});
+            }, 150);
+        });
+    }
+    
     // Display flash messages as notifications
     const flashMessages = document.querySelectorAll('.alert');
     flashMessages.forEach(alert => {
@@ -0,0 +1,213 @@
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+from mysql.connector import Error
+from config import Config
+from money import format_paise
+
+TRANSACTION_TYPES = ('deposit', 'withdraw', 'transfer')
+
+COLUMNS = "id, type, direction, amount, description, created_at, DATE_FORMAT(created_at, '%%Y-%%m-%%d %%H:%%i:%%s') AS date"
+
+EXPORT_BATCH_SIZE = 1000
+
+ARCHIVE_TABLE = 'transactions_archive'
+
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        return None
+
+
+# Keep only the filters that are valid, as the strings the form submitted
+def parse_filters(args):
+    filters = {}
+    if args.get('type') in TRANSACTION_TYPES:
+        filters['type'] = args['type']
+    for key in ('start_date', 'end_date'):
+        if _parse_date(args.get(key)):
+            filters[key] = args[key]
+    return filters
+
+
+def _where(user_id, filters):
+    clauses = ["user_id = %s"]
+    params = [user_id]
+    if 'type' in filters:
+        clauses.append("type = %s")
+        params.append(filters['type'])
+    if 'start_date' in filters:
+        clauses.append("created_at >= %s")
+        params.append(_parse_date(filters['start_date']))
+    if 'end_date' in filters:
+        # end_date is inclusive, so compare against the start of the next day
+        clauses.append("created_at < %s")
+        params.append(_parse_date(filters['end_date']) + timedelta(days=1))
+    return clauses, params
+
+
+# A page cursor is the (created_at, id) of the last row on the previous page
+def encode_cursor(row):
+    return f"{row['created_at']:%Y%m%d%H%M%S}-{row['id']}"
+
+
+def decode_cursor(value):
+    try:
+        timestamp, txn_id = value.split('-')
+        return datetime.strptime(timestamp, '%Y%m%d%H%M%S'), int(txn_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def _after(clauses, params, position):
+    return (
+        clauses + ["(created_at < %s OR (created_at = %s AND id < %s))"],
+        params + [position[0], position[0], position[1]],
+    )
+
+
+def _page_query(table, clauses):
+    return (
+        f"SELECT {COLUMNS} FROM {table} WHERE {' AND '.join(clauses)} "
+        "ORDER BY created_at DESC, id DESC LIMIT %s"
+    )
+
+
+def _select(connection, table, clauses, params, limit):
+    db_cursor = connection.cursor(dictionary=True)
+    try:
+        db_cursor.execute(_page_query(table, clauses), params + [limit])
+        return db_cursor.fetchall()
+    finally:
+        db_cursor.close()
+
+
+async def _select_async(connection, table, clauses, params, limit):
+    db_cursor = await connection.cursor(dictionary=True)
+    try:
+        await db_cursor.execute(_page_query(table, clauses), params + [limit])
+        return await db_cursor.fetchall()
+    finally:
+        await db_cursor.close()
+
+
+def _page_where(user_id, filters, cursor):
+    clauses, params = _where(user_id, filters)
+    position = decode_cursor(cursor) if cursor else None
+    if position:
+        clauses, params = _after(clauses, params, position)
+    return clauses, params, position
+
+
+# Where the archive query continues: after the last recent row, or after the
+# cursor position when no recent rows matched
+def _archive_where(user_id, filters, rows, position):
+    clauses, params = _where(user_id, filters)
+    if rows:
+        position = (rows[-1]['created_at'], rows[-1]['id'])
+    if position:
+        clauses, params = _after(clauses, params, position)
+    return clauses, params
+
+
+def _page(rows, limit):
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+# Fetch one page of history, newest first. Uses keyset pagination on
+# (created_at, id) so deep pages cost the same as the first one.
+#
+# Old rows live in transactions_archive, and every archived row is older
+# than every row still in transactions (archive.py moves them oldest first),
+# so the archive is only read once the recent rows matching the filters have
+# run out, continuing from where they stopped.
+def fetch_page(connection, user_id, filters, cursor=None, limit=None):
+    limit = limit or Config.HISTORY_PAGE_SIZE
+    clauses, params, position = _page_where(user_id, filters, cursor)
+    rows = _select(connection, 'transactions', clauses, params, limit + 1)
+    if len(rows) <= limit:
+        clauses, params = _archive_where(user_id, filters, rows, position)
+        rows += _select(connection, ARCHIVE_TABLE, clauses, params, limit + 1 - len(rows))
+    return _page(rows, limit)
+
+
+# fetch_page() on a mysql.connector.aio connection
+async def fetch_page_async(connection, user_id, filters, cursor=None, limit=None):
+    limit = limit or Config.HISTORY_PAGE_SIZE
+    clauses, params, position = _page_where(user_id, filters, cursor)
+    rows = await _select_async(connection, 'transactions', clauses, params, limit + 1)
+    if len(rows) <= limit:
+        clauses, params = _archive_where(user_id, filters, rows, position)
+        rows += await _select_async(connection, ARCHIVE_TABLE, clauses, params, limit + 1 - len(rows))
+    return _page(rows, limit)
+
+
+def _stream(connection, table, clauses, params):
+    db_cursor = connection.cursor(dictionary=True)
+    try:
+        db_cursor.execute(
+            f"SELECT {COLUMNS} FROM {table} WHERE {' AND '.join(clauses)} "
+            "ORDER BY created_at DESC, id DESC",
+            params
+        )
+        while True:
+            rows = db_cursor.fetchmany(EXPORT_BATCH_SIZE)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        try:
+            db_cursor.close()
+        except Error:
+            # The client went away mid-download; rather than reading the rest
+            # of the result set, drop the connection
+            connection.discard()
+
+
+# Stream every matching row without loading the result set into memory.
+# The default mysql.connector cursor is unbuffered, so rows are read from
+# the server as they are consumed. Recent rows come first, then the archive,
+# starting after the last recent row in case the mover ran in between.
+def iter_rows(connection, user_id, filters):
+    clauses, params = _where(user_id, filters)
+    last = None
+    for row in _stream(connection, 'transactions', clauses, params):
+        last = row
+        yield row
+    if last is not None:
+        clauses, params = _after(clauses, params, (last['created_at'], last['id']))
+    yield from _stream(connection, ARCHIVE_TABLE, clauses, params)
+
+
+def csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['Date', 'Type', 'Amount', 'Description', 'Direction'])
+    count = 0
+    for row in rows:
+        writer.writerow([row['date'], row['type'], format_paise(row['amount']), row['description'], row['direction']])
+        count += 1
+        if count % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def json_chunks(rows):
+    yield '['
+    separator = ''
+    for row in rows:
+        yield separator + json.dumps({
+            'date': row['date'],
+            'type': row['type'],
+            'amount': format_paise(row['amount']),
+            'description': row['description'],
+            'direction': row['direction'],
+        })
+        separator = ','
+    yield ']'